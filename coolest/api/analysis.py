@@ -3,6 +3,9 @@ __author__ = 'aymgal', 'mattgomer', 'gvernard'
 import numpy as np
 from astropy.coordinates import SkyCoord
 import logging
+import copy
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
 from skimage import measure
 
 from coolest.api.composable_models import *
@@ -11,6 +14,10 @@ from coolest.api import util
 # logging settings
 logging.getLogger().setLevel(logging.INFO)
 
+# state of each worker process used by Analysis.derived_quantity_samples()
+_worker_analysis = None
+_worker_parameters = None
+
 class Analysis(object):
     """Handles computation of model-independent quantities 
     and other analysis computations.
@@ -29,11 +36,16 @@ class Analysis(object):
     supersampling : int, optional
         Supersampling factor (relative to the instrument pixel size)
         that defines the grid on which computations are performed, by default 1.
+    n_threads : int, optional
+        Number of threads used to evaluate the light and mass models
+        (see ComposableLightModel and ComposableMassModel), by default None
     """
 
-    def __init__(self, coolest_object, coolest_directory, supersampling=1):
+    def __init__(self, coolest_object, coolest_directory, supersampling=1, n_threads=None):
         self.coolest = coolest_object
         self.coolest_dir = coolest_directory
+        self.supersampling = supersampling
+        self.n_threads = n_threads
         base_coordinates = util.get_coordinates(self.coolest)
         if supersampling > 1:
             self.coordinates = base_coordinates.create_new_coordinates(pixel_scale_factor=1./supersampling)
@@ -71,7 +83,7 @@ class Analysis(object):
         """
         if kwargs_selection is None:
             kwargs_selection = {}
-        mass_model = ComposableMassModel(self.coolest, self.coolest_dir, **kwargs_selection)
+        mass_model = ComposableMassModel(self.coolest, self.coolest_dir, n_threads=self.n_threads, **kwargs_selection)
 
         # get an image of the convergence
         x, y = self.coordinates.pixel_coordinates
@@ -174,7 +186,7 @@ class Analysis(object):
         """
         if kwargs_selection is None:
             kwargs_selection = {}
-        mass_model = ComposableMassModel(self.coolest, self.coolest_dir, **kwargs_selection)
+        mass_model = ComposableMassModel(self.coolest, self.coolest_dir, n_threads=self.n_threads, **kwargs_selection)
         x, y = self.coordinates.pixel_coordinates
         kappa_image = mass_model.evaluate_convergence(x, y)
         if center is None:
@@ -259,7 +271,7 @@ class Analysis(object):
         if kwargs_selection is None:
             kwargs_selection = {}
 
-        light_model = ComposableLightModel(self.coolest, self.coolest_dir, **kwargs_selection)
+        light_model = ComposableLightModel(self.coolest, self.coolest_dir, n_threads=self.n_threads, **kwargs_selection)
 
         # select a center
         if center is None:
@@ -355,7 +367,7 @@ class Analysis(object):
         if coordinates is None:
             coordinates = self.coordinates
 
-        light_model = ComposableLightModel(self.coolest, self.coolest_dir, **kwargs_selection)
+        light_model = ComposableLightModel(self.coolest, self.coolest_dir, n_threads=self.n_threads, **kwargs_selection)
 
         if use_profile_coordinates is True:
             light_image, _, coordinates = light_model.surface_brightness(return_extra=True)
@@ -460,7 +472,7 @@ class Analysis(object):
         if kwargs_selection is None:
             kwargs_selection = {}
 
-        light_model = ComposableLightModel(self.coolest, self.coolest_dir, **kwargs_selection)
+        light_model = ComposableLightModel(self.coolest, self.coolest_dir, n_threads=self.n_threads, **kwargs_selection)
 
         # get an image of the convergence
         if no_re_eval:
@@ -525,7 +537,7 @@ class Analysis(object):
         if kwargs_selection is None:
             kwargs_selection = {}
 
-        light_model = ComposableLightModel(self.coolest, self.coolest_dir, **kwargs_selection)
+        light_model = ComposableLightModel(self.coolest, self.coolest_dir, n_threads=self.n_threads, **kwargs_selection)
 
         # select a center
         if center is None:
@@ -583,6 +595,84 @@ class Analysis(object):
         return I, theta_E, phi_ref, mask
 
 
+    def derived_quantity_samples(self, quantity, num_samples=None, seed=None, 
+                                 parameter_ids=None, n_processes=None, chunk_size=10, 
+                                 **kwargs_quantity):
+        """Computes a derived quantity (e.g. the effective Einstein radius) for 
+        samples of the posterior distribution, read from the chain file referenced 
+        in the metadata of the COOLEST object (`meta['chain_file_name']`).
+
+        Samples are distributed in chunks over a pool of processes. Each process
+        holds its own copy of the COOLEST object and of the coordinates grid, 
+        which are only transferred once when the process starts. 
+        For each sample, the point estimates of the sampled parameters are replaced 
+        by the sample values before calling the corresponding method of this class.
+
+        Parameters
+        ----------
+        quantity : str
+            Name of the method computing the derived quantity, among 
+            'effective_einstein_radius', 'effective_radial_slope', 
+            'effective_radius_light' and 'total_magnitude'
+        num_samples : int, optional
+            If given, number of samples drawn at random (without replacement)
+            from the chain, by default None (all samples)
+        seed : int, optional
+            Seed of the random generator used to draw the samples, by default None
+        parameter_ids : list, optional
+            Subset of the parameter IDs of the chain to use; if None, 
+            all columns of the chain are used, by default None
+        n_processes : int, optional
+            Number of worker processes; if 1, samples are processed sequentially in the 
+            current process, by default None (number of CPUs)
+        chunk_size : int, optional
+            Number of samples sent to a process at once, by default 10
+        kwargs_quantity : dict
+            Keyword arguments passed to the method computing the derived quantity
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Derived quantity for each sample (stacked along the first axis),
+            and the corresponding probability weights
+
+        Raises
+        ------
+        ValueError
+            If the quantity is not supported or if some sampled parameters
+            are not found in the COOLEST object.
+        """
+        supported_quantities = ('effective_einstein_radius', 'effective_radial_slope', 
+                                'effective_radius_light', 'total_magnitude')
+        if quantity not in supported_quantities:
+            raise ValueError(f"Derived quantity '{quantity}' is not supported "
+                             f"(choose among {supported_quantities})")
+        samples, weights, parameter_ids = util.read_chain(self.coolest, self.coolest_dir, 
+                                                          parameter_ids=parameter_ids)
+        entities = self.coolest.lensing_entities
+        missing_ids = [param_id for param_id in parameter_ids 
+                       if entities.get_parameter_from_id(param_id) is None]
+        if len(missing_ids) > 0:
+            raise ValueError(f"Parameters {missing_ids} are not in the COOLEST object.")
+        if num_samples is not None and num_samples < len(samples):
+            rng = np.random.default_rng(seed)
+            indices = np.sort(rng.choice(len(samples), size=num_samples, replace=False))
+            samples, weights = samples[indices], weights[indices]
+        chunks = [samples[i:i+chunk_size] for i in range(0, len(samples), chunk_size)]
+        initargs = (self.coolest, self.coolest_dir, self.supersampling, parameter_ids)
+        if n_processes == 1:
+            # the COOLEST object is copied such that its point estimates are left untouched
+            analysis, parameters = _setup_evaluation(copy.deepcopy(self.coolest), *initargs[1:])
+            results = [_evaluate_samples(analysis, parameters, quantity, chunk, kwargs_quantity) 
+                       for chunk in chunks]
+        else:
+            with ProcessPoolExecutor(max_workers=n_processes, initializer=_init_worker, 
+                                     initargs=initargs) as executor:
+                results = list(executor.map(_evaluate_chunk, repeat(quantity), 
+                                            chunks, repeat(kwargs_quantity)))
+        values = np.array([value for chunk in results for value in chunk])
+        return values, weights
+
     @staticmethod
     def effective_radius(light_map, x, y, outer_radius=10, initial_guess=1, initial_delta_pix=10, n_iter=10):
         """Computes the effective radius of the 2D surface brightness profile, 
@@ -650,4 +740,34 @@ class Analysis(object):
         array = np.asarray(array)
         idx = (np.abs(array - value)).argmin()
         return array[idx]
-    
\ No newline at end of file
+    
+
+
+def _setup_evaluation(coolest_object, coolest_directory, supersampling, parameter_ids):
+    analysis = Analysis(coolest_object, coolest_directory, supersampling=supersampling)
+    entities = analysis.coolest.lensing_entities
+    parameters = [entities.get_parameter_from_id(param_id) for param_id in parameter_ids]
+    return analysis, parameters
+
+
+def _init_worker(*args):
+    # only called in the processes of the pool, which hold their own Analysis
+    global _worker_analysis, _worker_parameters
+    _worker_analysis, _worker_parameters = _setup_evaluation(*args)
+
+
+def _evaluate_chunk(quantity, samples, kwargs_quantity):
+    return _evaluate_samples(_worker_analysis, _worker_parameters, 
+                             quantity, samples, kwargs_quantity)
+
+
+def _evaluate_samples(analysis, parameters, quantity, samples, kwargs_quantity):
+    method = getattr(analysis, quantity)
+    values = []
+    for sample in samples:
+        for param, value in zip(parameters, sample):
+            # no validation against the definition range, such that a sample
+            # outside of it does not abort the evaluation of all the other samples
+            param.point_estimate.value = float(value)
+        values.append(method(**kwargs_quantity))
+    return values
@@ -1,17 +1,107 @@
 __author__ = 'aymgal'
 
 
+import os
+import hashlib
+import threading
 import numpy as np
-import math
 import logging
-from scipy import signal
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from scipy import ndimage
 
 from coolest.api import util
+from coolest.api.rendering import RenderPlan
+from coolest.api.lensing_operator import LensingOperator
+from coolest.api.profiles import util as profile_util
+from coolest.api.profiles.mass import (check_lensing_quantities, requires_hessian,
+                                       lensing_quantities_from_hessian)
 
 
 # logging settings
 logging.getLogger().setLevel(logging.INFO)
 
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+def _broadcast_shape(x, y):
+    """Shape of the coordinates arrays x and y broadcast against each other"""
+    return np.broadcast_shapes(np.shape(x), np.shape(y))
+
+
+def evaluate_by_blocks(evaluate, x, y, block_size=None, n_threads=None):
+    """Evaluates a function of (x, y) on blocks of rows of the coordinates arrays, 
+    such that intermediate arrays created by the profiles have a bounded size. 
+    The blocks can be evaluated concurrently on a pool of threads, as most of 
+    the computations are performed by numpy and scipy routines that release the GIL. 
+    Blocks are always reassembled in the same order, hence the result does not 
+    depend on the number of threads.
+
+    Parameters
+    ----------
+    evaluate : callable
+        Function of (x, y) that returns an array, a tuple of arrays 
+        or a dictionary of those, with the same shape as x
+    x : ndarray
+        x-coordinates
+    y : ndarray
+        y-coordinates
+    block_size : int, optional
+        Maximum number of rows per block; if None and `n_threads` > 1, 
+        the rows are split evenly between threads, by default None
+    n_threads : int, optional
+        Number of threads evaluating the blocks, by default None (no threading)
+
+    Returns
+    -------
+    Same as `evaluate`
+    """
+    n_threads = 1 if n_threads is None else int(n_threads)
+    if n_threads < 1:
+        raise ValueError("Number of threads must be >= 1")
+    if np.ndim(x) == 0 and np.ndim(y) == 0:
+        return evaluate(x, y)
+    x, y = profile_util.broadcast_coordinates(x, y)
+    num_rows = len(x)
+    if block_size is None:
+        block_size = -(-num_rows // n_threads)
+    if block_size < 1:
+        raise ValueError("Block size must be >= 1")
+    if num_rows <= block_size:
+        return evaluate(x, y)
+    blocks = [slice(row_start, row_start + block_size) for row_start in range(0, num_rows, block_size)]
+    evaluate_block = lambda rows: evaluate(x[rows], y[rows])
+
+    def allocate(block):
+        if isinstance(block, dict):
+            return {key: allocate(value) for key, value in block.items()}
+        if isinstance(block, tuple):
+            return tuple(allocate(value) for value in block)
+        return np.empty(np.shape(x), dtype=np.result_type(block))
+
+    def assign(result, block, rows):
+        if isinstance(block, dict):
+            for key, value in block.items():
+                assign(result[key], value, rows)
+        elif isinstance(block, tuple):
+            for result_i, value in zip(result, block):
+                assign(result_i, value, rows)
+        else:
+            result[rows] = block
+
+    def assemble(block_results):
+        result = None
+        for rows, block in zip(blocks, block_results):
+            if result is None:
+                result = allocate(block)
+            assign(result, block, rows)
+        return result
+
+    if n_threads == 1:
+        return assemble(map(evaluate_block, blocks))
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        return assemble(executor.map(evaluate_block, blocks))
+
 
 class BaseComposableModel(object):
     """Given a COOLEST object, evaluates a selection of mass or light profiles.
@@ -33,6 +123,9 @@ class BaseComposableModel(object):
         List of either lists of indices, or 'all', for selecting which (mass or light) profile 
         of a given lensing entity to consider. If None, selects all the 
         profiles of within the corresponding entity, by default None
+    n_threads : int, optional
+        Number of threads used to evaluate the profiles concurrently on blocks 
+        of the coordinates grid (see `evaluate_by_blocks()`), by default None
 
     Raises
     ------
@@ -41,7 +134,7 @@ class BaseComposableModel(object):
     """
 
     def __init__(self, model_type, coolest_object, coolest_directory=None, 
-                 entity_selection=None, profile_selection=None):
+                 entity_selection=None, profile_selection=None, n_threads=None):
         if entity_selection is None:
             # finds the first entity that has a 'model_type' profile
             entity_selection = None
@@ -62,8 +155,10 @@ class BaseComposableModel(object):
         if profile_selection is None:
             profile_selection = 'all'
         entities = coolest_object.lensing_entities
+        self.coolest = coolest_object
         self.directory = coolest_directory
-        self.profile_list, self.param_list, self.info_list \
+        self.n_threads = n_threads
+        self.profile_list, self.param_list, self.info_list, self.param_id_list \
             = self.select_profiles(model_type, entities, 
                                    entity_selection, profile_selection,
                                    coolest_directory)
@@ -77,6 +172,7 @@ class BaseComposableModel(object):
         profile_list = []
         param_list = []
         info_list = []
+        param_id_list = []
         for i, entity in enumerate(entities):
             if self._selected(i, entity_selection):
                 if model_type == 'light_model' and entity.type == 'external_shear':
@@ -94,7 +190,69 @@ class BaseComposableModel(object):
                             profile_list.append(self._get_api_profile(model_type, profile))
                             param_list.append(self._get_point_estimates(profile))
                         info_list.append((entity.name, entity.redshift))
-        return profile_list, param_list, info_list
+                        param_id_list.append({name: param.id for name, param in profile.parameters.items()})
+        return profile_list, param_list, info_list, param_id_list
+
+    def get_sampled_param_list(self, samples, parameter_ids, ndim=2):
+        """Builds a copy of the list of parameters in which each parameter 
+        that appears in `parameter_ids` holds all the values in the 
+        corresponding column of `samples`. Those values are shaped 
+        with a leading sample axis, such that they broadcast against 
+        coordinates arrays with `ndim` dimensions.
+
+        Parameters
+        ----------
+        samples : ndarray
+            2D array of shape (n_samples, n_params)
+        parameter_ids : list
+            List of n_params parameter IDs (see LensingEntityList), 
+            in the same order as the columns of `samples`
+        ndim : int, optional
+            Number of dimensions of the coordinates arrays, by default 2
+
+        Returns
+        -------
+        list
+            List of parameter dictionaries, one per selected profile
+
+        Raises
+        ------
+        ValueError
+            If the shape of `samples` is inconsistent with `parameter_ids`.
+        """
+        samples = np.atleast_2d(samples)
+        if samples.shape[1] != len(parameter_ids):
+            raise ValueError(f"Number of sample columns ({samples.shape[1]}) does not match "
+                             f"the number of parameter IDs ({len(parameter_ids)})")
+        column_indices = {param_id: j for j, param_id in enumerate(parameter_ids)}
+        sample_shape = (samples.shape[0],) + (1,)*ndim
+        param_list = []
+        for params, param_ids in zip(self.param_list, self.param_id_list):
+            params_sampled = dict(params)
+            for name, param_id in param_ids.items():
+                if param_id in column_indices:
+                    params_sampled[name] = samples[:, column_indices[param_id]].reshape(sample_shape)
+            param_list.append(params_sampled)
+        return param_list
+
+    def _get_samples(self, samples, parameter_ids):
+        if samples is None:
+            if parameter_ids is not None:
+                raise ValueError("Parameter IDs cannot be given without samples")
+            samples, _, parameter_ids = util.read_chain(self.coolest, self.directory)
+        elif parameter_ids is None:
+            raise ValueError("Parameter IDs must be given along with samples")
+        return np.atleast_2d(samples), parameter_ids
+
+    def _cast_param_list(self, param_list, dtype):
+        """Pairs of profiles and parameters, the latter being cast to the dtype 
+        of the coordinates (see profiles.util.cast_parameters())"""
+        return [(profile, profile_util.cast_parameters(params, dtype)) 
+                for profile, params in zip(self.profile_list, param_list)]
+
+    def _evaluate_by_blocks(self, evaluate, x, y, block_size):
+        return evaluate_by_blocks(evaluate, x, y, block_size=block_size, 
+                                  n_threads=self.n_threads)
 
     def estimate_center(self):
         # TODO: improve this (for now simply considers the first profile that has a center)
@@ -174,6 +332,9 @@ class ComposableLightModel(BaseComposableModel):
         List of either lists of indices, or 'all', for selecting which light profile 
         of a given lensing entity to consider. If None, selects all the 
         profiles of within the corresponding entity, by default None
+    n_threads : int, optional
+        Number of threads used to evaluate the profiles concurrently on blocks 
+        of the coordinates grid (see `evaluate_by_blocks()`), by default None
 
     Raises
     ------
@@ -204,13 +365,20 @@ class ComposableLightModel(BaseComposableModel):
             return values, extent, coordinates
         return values
 
-    def evaluate_surface_brightness(self, x, y):
-        """Evaluates the surface brightness at given coordinates"""
-        image = np.zeros_like(x)
-        for k, (profile, params) in enumerate(zip(self.profile_list, self.param_list)):
+    def evaluate_surface_brightness(self, x, y, block_size=None):
+        """Evaluates the surface brightness at given coordinates, 
+        by blocks of `block_size` rows if given"""
+        return self._evaluate_by_blocks(self._surface_brightness, x, y, block_size)
+
+    def _surface_brightness(self, x, y, param_list=None):
+        if param_list is None:
+            param_list = self.param_list
+        dtype = profile_util.real_dtype(x, y)
+        image = np.zeros(_broadcast_shape(x, y), dtype=dtype)
+        for profile, params in self._cast_param_list(param_list, dtype):
             flux_k = profile.evaluate_surface_brightness(x, y, **params)
             if profile.units == 'per_ang':
-                flux_k *= self.pixel_area
+                flux_k = flux_k * self.pixel_area
             image += flux_k
         return image
 
@@ -231,6 +399,9 @@ class ComposableMassModel(BaseComposableModel):
         List of either lists of indices, or 'all', for selecting which mass profile 
         of a given lensing entity to consider. If None, selects all the 
         profiles of within the corresponding entity, by default None
+    n_threads : int, optional
+        Number of threads used to evaluate the profiles concurrently on blocks 
+        of the coordinates grid (see `evaluate_by_blocks()`), by default None
 
     Raises
     ------
@@ -243,29 +414,128 @@ class ComposableMassModel(BaseComposableModel):
                          coolest_directory=coolest_directory,
                          **kwargs_selection)
 
-    def evaluate_deflection(self, x, y):
-        """Evaluates the lensing deflection field at given coordinates"""
-        alpha_x, alpha_y = np.zeros_like(x), np.zeros_like(x)
-        for k, (profile, params) in enumerate(zip(self.profile_list, self.param_list)):
+    def evaluate_deflection(self, x, y, block_size=None):
+        """Evaluates the lensing deflection field at given coordinates,
+        by blocks of `block_size` rows if given"""
+        evaluate = lambda x_, y_: self._deflection(x_, y_, self.param_list, _broadcast_shape(x_, y_))
+        return self._evaluate_by_blocks(evaluate, x, y, block_size)
+
+    def evaluate_convergence(self, x, y, block_size=None):
+        """Evaluates the lensing convergence (i.e., 2D mass density) at given coordinates,
+        by blocks of `block_size` rows if given"""
+        evaluate = lambda x_, y_: self._convergence(x_, y_, self.param_list, _broadcast_shape(x_, y_))
+        return self._evaluate_by_blocks(evaluate, x, y, block_size)
+
+    def evaluate_magnification(self, x, y, block_size=None):
+        """Evaluates the lensing magnification at given coordinates,
+        by blocks of `block_size` rows if given"""
+        evaluate = lambda x_, y_: self._magnification(x_, y_, self.param_list, _broadcast_shape(x_, y_))
+        return self._evaluate_by_blocks(evaluate, x, y, block_size)
+
+    def evaluate_lensing(self, x, y, quantities=('alpha', 'kappa'), block_size=None):
+        """Evaluates several lensing quantities at given coordinates at once,
+        such that each profile performs a single pass over the coordinates.
+
+        Parameters
+        ----------
+        x : ndarray
+            x-coordinates at which to evaluate the lensing quantities
+        y : ndarray
+            y-coordinates at which to evaluate the lensing quantities
+        quantities : tuple, optional
+            Subset of 'alpha' (deflection), 'kappa' (convergence), 'shear',
+            'hessian', 'magnification' and 'potential', by default ('alpha', 'kappa')
+        block_size : int, optional
+            If given, the coordinates are evaluated by blocks of at most 
+            this number of rows to limit memory usage, by default None
+
+        Returns
+        -------
+        dict
+            Requested quantities; 'alpha' and 'shear' are tuples of two components,
+            'hessian' is the tuple (H_xx, H_xy, H_yx, H_yy)
+        """
+        evaluate = lambda x_, y_: self._lensing(x_, y_, self.param_list, _broadcast_shape(x_, y_), quantities)
+        return self._evaluate_by_blocks(evaluate, x, y, block_size)
+
+    def evaluate_deflection_samples(self, x, y, samples=None, parameter_ids=None):
+        """Evaluates the lensing deflection field at given coordinates,
+        for each of the given parameter samples at once. 
+        
+        Parameters that are not sampled keep their point estimate value.
+        If `samples` is None, all samples of the chain file referenced in 
+        the metadata of the COOLEST object (`meta['chain_file_name']`) are used.
+
+        Parameters
+        ----------
+        x : ndarray
+            x-coordinates at which to evaluate the deflection
+        y : ndarray
+            y-coordinates at which to evaluate the deflection
+        samples : ndarray, optional
+            2D array of shape (n_samples, n_params), by default None
+        parameter_ids : list, optional
+            List of parameter IDs corresponding to the columns of `samples`, by default None
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Deflection field components, each with shape (n_samples, *x.shape)
+        """
+        param_list, shape = self._prepare_samples(x, y, samples, parameter_ids)
+        return self._deflection(x, y, param_list, shape)
+
+    def evaluate_convergence_samples(self, x, y, samples=None, parameter_ids=None):
+        """Evaluates the lensing convergence at given coordinates,
+        for each of the given parameter samples at once
+        (see `evaluate_deflection_samples()`)."""
+        param_list, shape = self._prepare_samples(x, y, samples, parameter_ids)
+        return self._convergence(x, y, param_list, shape)
+
+    def evaluate_magnification_samples(self, x, y, samples=None, parameter_ids=None):
+        """Evaluates the lensing magnification at given coordinates,
+        for each of the given parameter samples at once
+        (see `evaluate_deflection_samples()`)."""
+        param_list, shape = self._prepare_samples(x, y, samples, parameter_ids)
+        return self._magnification(x, y, param_list, shape)
+
+    def evaluate_lensing_samples(self, x, y, quantities=('alpha', 'kappa'), 
+                                 samples=None, parameter_ids=None):
+        """Evaluates several lensing quantities at given coordinates at once,
+        for each of the given parameter samples at once
+        (see `evaluate_lensing()` and `evaluate_deflection_samples()`)."""
+        param_list, shape = self._prepare_samples(x, y, samples, parameter_ids)
+        return self._lensing(x, y, param_list, shape, quantities)
+
+    def _prepare_samples(self, x, y, samples, parameter_ids):
+        samples, parameter_ids = self._get_samples(samples, parameter_ids)
+        param_list = self.get_sampled_param_list(samples, parameter_ids, ndim=np.ndim(x))
+        shape = (samples.shape[0],) + _broadcast_shape(x, y)
+        return param_list, shape
+
+    def _deflection(self, x, y, param_list, shape):
+        dtype = profile_util.real_dtype(x, y)
+        alpha_x, alpha_y = np.zeros(shape, dtype=dtype), np.zeros(shape, dtype=dtype)
+        for profile, params in self._cast_param_list(param_list, dtype):
             a_x, a_y = profile.deflection(x, y, **params)
             alpha_x += a_x
             alpha_y += a_y
         return alpha_x, alpha_y
 
-    def evaluate_convergence(self, x, y):
-        """Evaluates the lensing convergence (i.e., 2D mass density) at given coordinates"""
-        kappa = np.zeros_like(x)
-        for k, (profile, params) in enumerate(zip(self.profile_list, self.param_list)):
+    def _convergence(self, x, y, param_list, shape):
+        dtype = profile_util.real_dtype(x, y)
+        kappa = np.zeros(shape, dtype=dtype)
+        for profile, params in self._cast_param_list(param_list, dtype):
             kappa += profile.convergence(x, y, **params)
         return kappa
 
-    def evaluate_magnification(self, x, y):
-        """Evaluates the lensing magnification at given coordinates"""
-        H_xx_sum = np.zeros_like(x)
-        H_xy_sum = np.zeros_like(x)
-        H_yx_sum = np.zeros_like(x)
-        H_yy_sum = np.zeros_like(x)
-        for k, (profile, params) in enumerate(zip(self.profile_list, self.param_list)):
+    def _magnification(self, x, y, param_list, shape):
+        dtype = profile_util.real_dtype(x, y)
+        H_xx_sum = np.zeros(shape, dtype=dtype)
+        H_xy_sum = np.zeros(shape, dtype=dtype)
+        H_yx_sum = np.zeros(shape, dtype=dtype)
+        H_yy_sum = np.zeros(shape, dtype=dtype)
+        for profile, params in self._cast_param_list(param_list, dtype):
             H_xx, H_xy, H_yx, H_yy = profile.hessian(x, y, **params)
             H_xx_sum += H_xx
             H_xy_sum += H_xy
@@ -275,6 +545,34 @@ class ComposableMassModel(BaseComposableModel):
         mu = 1. / det_A
         return mu
 
+    def _lensing(self, x, y, param_list, shape, quantities):
+        quantities = check_lensing_quantities(quantities)
+        # quantities evaluated by each profile and summed
+        summed = [q for q in ('alpha', 'potential') if q in quantities]
+        if requires_hessian(quantities):
+            summed.append('hessian')
+        elif 'kappa' in quantities:
+            summed.append('kappa')
+        n_comp = {'alpha': 2, 'potential': 1, 'hessian': 4, 'kappa': 1}
+        dtype = profile_util.real_dtype(x, y)
+        sums = {q: [np.zeros(shape, dtype=dtype) for _ in range(n_comp[q])] for q in summed}
+        for profile, params in self._cast_param_list(param_list, dtype):
+            results_k = profile.evaluate_lensing(x, y, quantities=summed, **params)
+            for q in summed:
+                values = results_k[q] if n_comp[q] > 1 else (results_k[q],)
+                for total, value in zip(sums[q], values):
+                    total += value
+        results = {}
+        if 'alpha' in quantities:
+            results['alpha'] = tuple(sums['alpha'])
+        if 'potential' in quantities:
+            results['potential'] = sums['potential'][0]
+        if 'hessian' in sums:
+            results.update(lensing_quantities_from_hessian(tuple(sums['hessian']), quantities))
+        elif 'kappa' in quantities:
+            results['kappa'] = sums['kappa'][0]
+        return results
+
     def ray_shooting(self, x, y):
         """evaluates the lens equation beta = theta - alpha(theta)"""
         alpha_x, alpha_y = self.evaluate_deflection(x, y)
@@ -299,6 +597,18 @@ class ComposableLensModel(object):
         List of either lists of indices, or 'all', for selecting which light/mass profile 
         of a given lensing entity to consider. If None, selects all the 
         profiles of within the corresponding entity, by default None
+    ray_shooting_cache_size : int, optional
+        If given, ray-shot coordinates are cached for at most this number of 
+        (coordinates, mass parameters) combinations, such that changing only 
+        source parameters does not require to evaluate the deflection field again
+        (see RayShootingCache), by default None (no caching)
+    n_threads : int, optional
+        Number of threads used to evaluate the lensed surface brightness 
+        concurrently on blocks of the coordinates grid, by default None
+    dtype : numpy dtype, optional
+        Precision in which model images are evaluated (float32 or float64); 
+        in single precision, profiles are evaluated on float32 coordinates and 
+        parameters (see RenderPlan), by default float64
 
     Raises
     ------
@@ -307,8 +617,11 @@ class ComposableLensModel(object):
     """
 
     def __init__(self, coolest_object, coolest_directory=None, 
-                 kwargs_selection_source=None, kwargs_selection_lens_mass=None):
+                 kwargs_selection_source=None, kwargs_selection_lens_mass=None,
+                 ray_shooting_cache_size=None, n_threads=None, dtype=np.float64):
         self.coolest = coolest_object
+        self.n_threads = n_threads
+        self.dtype = util.check_float_dtype(dtype)
         self.coord_obs = util.get_coordinates(self.coolest)
         self.directory = coolest_directory
         if kwargs_selection_source is None:
@@ -321,71 +634,345 @@ class ComposableLensModel(object):
         self.source = ComposableLightModel(coolest_object, 
                                           coolest_directory,
                                           **kwargs_selection_source)
-
-    def model_image(self, supersampling=5, convolved=True, super_convolution=True):
-        """generates an image of the lens based on the selected model components"""
-        obs = self.coolest.observation
-        psf = self.coolest.instrument.psf
-        if convolved is True and psf.type == 'PixelatedPSF':
-            scale_factor = obs.pixels.pixel_size / psf.pixels.pixel_size
-            supersampling_conv = int(round(scale_factor))
-            if not math.isclose(scale_factor, supersampling_conv):
-                raise ValueError(f"PSF supersampling ({scale_factor}) not close to an integer?")
-            if supersampling_conv < 1:
-                raise ValueError("PSF pixel size smaller than data pixel size")
-        if supersampling < 1:
-            raise ValueError("Supersampling must be >= 1")
-        if convolved is True and supersampling_conv > supersampling:
-            supersampling = supersampling_conv
-            logging.warning(f"Supersampling adapted to the PSF pixel size ({supersampling})")
-        coord_eval = self.coord_obs.create_new_coordinates(pixel_scale_factor=1./supersampling)
-        x, y = coord_eval.pixel_coordinates
+        self._render_plans = {}
+        if ray_shooting_cache_size:
+            self._ray_shooting_cache = RayShootingCache(self.lens_mass, maxsize=ray_shooting_cache_size)
+        else:
+            self._ray_shooting_cache = None
+
+    def model_image(self, supersampling=5, convolved=True, super_convolution=True, 
+                    block_size=None, mask=None):
+        """generates an image of the lens based on the selected model components.
+        If `block_size` is given, the supersampled grid is evaluated and downsampled by 
+        blocks of this number of rows (see RenderPlan.render_tiled()), 
+        which bounds the memory usage for large images or supersampling factors.
+        With multiple threads, blocks are evaluated concurrently 
+        (by default, one block per thread).
+        If `mask` is given, the model is only evaluated where needed for rendering 
+        the pixels inside the mask, and pixels outside are set to zero 
+        (see RenderPlan.render_masked())."""
+        plan = self.get_render_plan(supersampling=supersampling, convolved=convolved, 
+                                    super_convolution=super_convolution)
+        if mask is not None:
+            image = plan.render_masked(self._lensed_surface_brightness, mask)
+            return image, self.coord_obs
+        n_threads = self.n_threads or 1
+        if block_size is not None or n_threads > 1:
+            if block_size is None:
+                block_size = -(-plan.coord_eval.array_shape[0] // n_threads)
+            image = plan.render_tiled(self._lensed_surface_brightness, 
+                                      block_size=block_size, n_threads=n_threads)
+            return image, self.coord_obs
+        x, y = plan.pixel_coordinates_sparse
         image = self.evaluate_lensed_surface_brightness(x, y)
+        image = plan.render(image)
+        return image, self.coord_obs
+
+    def model_image_samples(self, samples, parameter_ids, supersampling=5, convolved=True, 
+                            super_convolution=True, mask=None):
+        """generates images of the lens for each of the given parameter samples at once.
+        Parameters of both the mass and source models can be sampled; parameters 
+        that are not sampled keep their point estimate value.
+
+        Parameters
+        ----------
+        samples : ndarray
+            2D array of shape (n_samples, n_params)
+        parameter_ids : list
+            List of parameter IDs corresponding to the columns of `samples`
+        supersampling, convolved, super_convolution : 
+            See RenderPlan
+        mask : ndarray, optional
+            If given, images are only rendered inside the mask 
+            (see RenderPlan.render_masked()), by default None
+
+        Returns
+        -------
+        ndarray
+            Model images, with shape (n_samples, *image_shape)
+        """
+        plan = self.get_render_plan(supersampling=supersampling, convolved=convolved, 
+                                    super_convolution=super_convolution)
+        samples = np.atleast_2d(samples)
+        def evaluate(x, y):
+            ndim = np.ndim(x)
+            mass_param_list = self.lens_mass.get_sampled_param_list(samples, parameter_ids, ndim=ndim)
+            source_param_list = self.source.get_sampled_param_list(samples, parameter_ids, ndim=ndim)
+            shape = (samples.shape[0],) + _broadcast_shape(x, y)
+            alpha_x, alpha_y = self.lens_mass._deflection(x, y, mass_param_list, shape)
+            return self.source._surface_brightness(x - alpha_x, y - alpha_y, source_param_list)
+        if mask is not None:
+            return plan.render_masked(evaluate, mask)
+        x, y = plan.pixel_coordinates_sparse
+        return plan.render(evaluate(x, y))
+
+    def model_image_adaptive(self, supersampling_max=10, tolerance=None, convolved=True, 
+                             magnification_threshold=10., refinement_mask=None, 
+                             return_extra=False):
+        """generates an image of the lens where the supersampling factor is adapted 
+        to each pixel. The model is first evaluated at the pixel centers; pixels 
+        that are candidates for refinement are those where the error of this 
+        first estimate, given by the curvature of the lensed surface brightness, 
+        exceeds the tolerance, where the magnification exceeds a threshold 
+        (i.e., near the critical curves), and those in `refinement_mask`. 
+        Each candidate pixel is then supersampled by factors 2, 4, 8, ... 
+        (up to `supersampling_max`) until the change of its value between 
+        two successive factors (from a factor of at least 4) is below the tolerance.
+        The convolution with the PSF (if required) is performed on the 
+        observation grid (as with `super_convolution=False` in RenderPlan).
+
+        Parameters
+        ----------
+        supersampling_max : int, optional
+            Maximum supersampling factor, by default 10
+        tolerance : float, optional
+            Absolute tolerance on the value of each pixel, 
+            by default 1e-3 times the maximum of the image evaluated at the pixel centers
+        convolved : bool, optional
+            If True, the image is convolved with the PSF, by default True
+        magnification_threshold : float, optional
+            Pixels where the absolute magnification exceeds this value 
+            are candidates for refinement, by default 10.
+            If None, the magnification is not evaluated.
+        refinement_mask : ndarray, optional
+            2D array with the shape of the observation, with pixels that 
+            are candidates for refinement given by non-zero values, by default None
+        return_extra : bool, optional
+            If True, also returns the map of supersampling factors, by default False
+
+        Returns
+        -------
+        ndarray, Coordinates[, ndarray]
+            Model image, coordinates of the observation 
+            [and supersampling factor of each pixel]
+
+        Raises
+        ------
+        ValueError
+            If `supersampling_max` is smaller than 1, 
+            or the refinement mask does not have the shape of the observation.
+        """
+        if supersampling_max < 1:
+            raise ValueError("Maximum supersampling must be >= 1")
+        x, y = self.coord_obs.pixel_coordinates
+        x, y = x.astype(self.dtype, copy=False), y.astype(self.dtype, copy=False)
+        if refinement_mask is not None and np.shape(refinement_mask) != np.shape(x):
+            raise ValueError(f"Shape of the refinement mask {np.shape(refinement_mask)} does not "
+                             f"match the one of the observation {np.shape(x)}")
+        # the many small sets of coordinates evaluated here are not worth caching
+        image = self._lensed_surface_brightness(x, y, use_cache=False)
+        if tolerance is None:
+            tolerance = 1e-3 * np.nanmax(np.abs(image))
+        # the pixel average differs from the central value by ~ laplacian / 24 (in pixel units);
+        # a safety factor of 2 accounts for the discrete laplacian underestimating sharp features
+        refine = ~(np.abs(ndimage.laplace(image, mode='nearest')) / 12. <= tolerance)
+        if magnification_threshold is not None:
+            mu = self.lens_mass.evaluate_magnification(x, y)
+            refine |= ~(np.abs(mu) <= magnification_threshold)
+        if refinement_mask is not None:
+            refine |= np.asarray(refinement_mask) > 0
+        supersampling_map = np.ones(np.shape(image), dtype=int)
+        active = np.flatnonzero(refine)
+        factor = 1
+        while factor < supersampling_max and len(active) > 0:
+            factor = min(2 * factor, supersampling_max)
+            values = self._pixel_average(x.flat[active], y.flat[active], factor)
+            # NaN values are not refined further; the first refinement is never 
+            # considered converged, as the central value can be accurate by chance
+            converged = ~(np.abs(values - image.flat[active]) > tolerance) & (factor > 2)
+            image.flat[active] = values
+            supersampling_map.flat[active] = factor
+            active = active[~converged]
         if convolved is True:
-            if psf.type != 'PixelatedPSF':
-                raise NotImplementedError
-            kernel = psf.pixels.get_pixels(directory=self.directory)
-            kernel_sum = kernel.sum()
-            if not math.isclose(kernel_sum, 1., abs_tol=1e-3):
-                kernel /= kernel_sum
-                logging.warning(f"PSF kernel is not normalized (sum={kernel_sum}), "
-                                f"so it has been normalized before convolution")
-            if np.isnan(image).any():
-                np.nan_to_num(image, copy=False, nan=0., posinf=None, neginf=None)
-                logging.warning("Found NaN values in image prior to convolution; "
-                                "they have been replaced by zeros.")
-            if super_convolution and supersampling_conv == supersampling:
-                # first convolve then downscale
-                image = signal.fftconvolve(image, kernel, mode='same')
-                image = util.downsampling(image, factor=supersampling)
-            else:
-                # first downscale then convolve
-                image = util.downsampling(image, factor=supersampling)
-                image = signal.fftconvolve(image, kernel, mode='same')
-        elif supersampling > 1:
-            image = util.downsampling(image, factor=supersampling)
+            plan = self.get_render_plan(supersampling=supersampling_max, convolved=True, 
+                                        super_convolution=False)
+            image = plan.convolve(plan._remove_nans(image))
+        if return_extra:
+            return image, self.coord_obs, supersampling_map
         return image, self.coord_obs
 
+    def _pixel_average(self, x, y, factor):
+        """Mean of the lensed surface brightness over the factor x factor 
+        sub-pixels of the observation pixels centered on (x, y)"""
+        offsets = (np.arange(factor) + 0.5) / factor - 0.5  # in pixel units
+        i_off, j_off = np.meshgrid(offsets, offsets)
+        x_off, y_off = self.coord_obs.pixel_to_radec(i_off.ravel(), j_off.ravel())
+        x_0, y_0 = self.coord_obs.pixel_to_radec(0., 0.)
+        x_sub = x[:, None] + (x_off - x_0).astype(x.dtype)[None, :]
+        y_sub = y[:, None] + (y_off - y_0).astype(y.dtype)[None, :]
+        return self._lensed_surface_brightness(x_sub, y_sub, use_cache=False).mean(axis=1)
+
     def model_residuals(self, mask=None, **model_image_kwargs):
-        """computes the normalized residuals map as (data - model) / sigma"""
-        model, _ = self.model_image(**model_image_kwargs)
-        data = self.coolest.observation.pixels.get_pixels(directory=self.directory)
-        noise = self.coolest.observation.noise
-        if noise.type != 'NoiseMap':
-            raise NotImplementedError
-        sigma = noise.noise_map.get_pixels(directory=self.directory)
+        """computes the normalized residuals map as (data - model) / sigma.
+        If `mask` is given, the model is only rendered inside the mask."""
+        model, _ = self.model_image(mask=mask, **model_image_kwargs)
+        data, sigma = self._get_data_and_noise(model=model)
         if mask is None:
             mask = np.ones_like(model)
         return ((data - model) / sigma) * mask, self.coord_obs
 
-    def evaluate_lensed_surface_brightness(self, x, y):
-        """Evaluates the surface brightness of a lensed source at given coordinates"""
+    def get_render_plan(self, supersampling=5, convolved=True, super_convolution=True):
+        """Returns the RenderPlan associated with the given settings, 
+        which is created only once and then reused by subsequent calls, 
+        as long as the PSF of the COOLEST object is not changed.
+        See RenderPlan for the description of the arguments.
+        """
+        key = (supersampling, convolved, super_convolution, self._psf_key())
+        if key not in self._render_plans:
+            self._render_plans[key] = RenderPlan(self.coolest, self.directory,
+                                                 supersampling=supersampling,
+                                                 convolved=convolved,
+                                                 super_convolution=super_convolution,
+                                                 coordinates=self.coord_obs,
+                                                 dtype=self.dtype)
+        return self._render_plans[key]
+
+    def _psf_key(self):
+        """Settings of the PSF that a RenderPlan depends on"""
+        psf = self.coolest.instrument.psf
+        if psf.type == 'PixelatedPSF':
+            # the file can be overwritten at the same path, as for FitsCache entries
+            abs_path = psf.pixels.fits_file._get_abs_path(self.directory)
+            stat = os.stat(abs_path) if os.path.exists(abs_path) else None
+            file_key = None if stat is None else (stat.st_size, stat.st_mtime_ns)
+            return (psf.type, abs_path, file_key, psf.pixels.pixel_size)
+        elif psf.type == 'GaussianPSF':
+            return (psf.type, psf.fwhm)
+        return (psf.type,)
+
+    def get_lensing_operator(self, supersampling=5, convolved=True, super_convolution=True, 
+                             cache_path=None):
+        """Returns the sparse linear operator that maps the pixels of the 
+        (pixelated) source to the model image, for the current mass parameters.
+        See LensingOperator.from_lens_model() for the description of the arguments.
+        """
+        return LensingOperator.from_lens_model(self, supersampling=supersampling, 
+                                               convolved=convolved, 
+                                               super_convolution=super_convolution,
+                                               cache_path=cache_path)
+
+    def _get_data_and_noise(self, model=None):
+        """Returns the data and the noise standard deviation map; if the noise 
+        depends on the flux of the target, it is estimated from `model` if given, 
+        otherwise from the data (see util.noise_variance())"""
+        data = self.coolest.observation.pixels.get_pixels(directory=self.directory)
+        variance, flux_factor = util.noise_variance(self.coolest, self.directory, 
+                                                    shape=np.shape(data))
+        if flux_factor is not None:
+            flux = data if model is None else model
+            variance = variance + flux_factor * np.maximum(flux, 0.)
+        return data, np.sqrt(variance)
+
+    def evaluate_lensed_surface_brightness(self, x, y, block_size=None):
+        """Evaluates the surface brightness of a lensed source at given coordinates,
+        by blocks of `block_size` rows if given or if multiple threads are used 
+        (in which case each block is an entry of the ray-shooting cache)"""
+        if block_size is None and not (self.n_threads or 1) > 1:
+            return self._lensed_surface_brightness(x, y)
+        return evaluate_by_blocks(self._lensed_surface_brightness, x, y, 
+                                  block_size=block_size, n_threads=self.n_threads)
+
+    def _lensed_surface_brightness(self, x, y, use_cache=True):
         # ray-shooting
-        x_rs, y_rs = self.ray_shooting(x, y)
+        if use_cache:
+            x_rs, y_rs = self.ray_shooting(x, y)
+        else:
+            x_rs, y_rs = self.lens_mass.ray_shooting(x, y)
         # evaluates at ray-shooted coordinates
-        lensed_image = self.source.evaluate_surface_brightness(x_rs, y_rs)
-        return lensed_image
+        return self.source.evaluate_surface_brightness(x_rs, y_rs)
 
     def ray_shooting(self, x, y):
         """evaluates the lens equation beta = theta - alpha(theta)"""
+        if self._ray_shooting_cache is not None:
+            return self._ray_shooting_cache(x, y)
         return self.lens_mass.ray_shooting(x, y)
+
+    def ray_shooting_cache_info(self):
+        """Returns the statistics of the ray-shooting cache, or None if disabled"""
+        if self._ray_shooting_cache is None:
+            return None
+        return self._ray_shooting_cache.info()
+
+    def clear_ray_shooting_cache(self):
+        """Removes all entries from the ray-shooting cache, if enabled"""
+        if self._ray_shooting_cache is not None:
+            self._ray_shooting_cache.clear()
+
+
+class RayShootingCache(object):
+    """Bounded cache of ray-shot coordinates, with least-recently-used eviction.
+
+    Entries are keyed on the shape, dtype and a hash of the content of the 
+    coordinates arrays, and on the values of the mass profile parameters, 
+    such that coordinates recreated between calls (e.g. when rendering inside 
+    a mask or by blocks of rows) are found in the cache. When rendering by blocks, 
+    each block is a separate entry, so `maxsize` should be at least the number of blocks.
+    The cache can be used from multiple threads. The cached ray-shot 
+    coordinates are returned as read-only arrays.
+
+    Parameters
+    ----------
+    mass_model : ComposableMassModel
+        Mass model used to ray-shoot coordinates in case of a cache miss
+    maxsize : int, optional
+        Maximum number of cached entries, by default 8
+    """
+
+    def __init__(self, mass_model, maxsize=8):
+        if maxsize < 1:
+            raise ValueError("Maximum size of the ray-shooting cache must be >= 1")
+        self._mass_model = mass_model
+        self.maxsize = int(maxsize)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, x, y):
+        key = self._key(x, y)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        x_rs, y_rs = self._mass_model.ray_shooting(x, y)
+        x_rs, y_rs = np.asarray(x_rs), np.asarray(y_rs)
+        x_rs.flags.writeable = False
+        y_rs.flags.writeable = False
+        with self._lock:
+            self._entries[key] = (x_rs, y_rs)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return x_rs, y_rs
+
+    def info(self):
+        """Returns the number of hits and misses, the maximum and current size of the cache"""
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
+
+    def clear(self):
+        """Removes all entries and resets the statistics"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def _key(self, x, y):
+        params_key = tuple(
+            tuple((name, self._hashable(value)) for name, value in sorted(params.items()))
+            for params in self._mass_model.param_list
+        )
+        return (self._coordinates_key(x), self._coordinates_key(y), params_key)
+
+    @staticmethod
+    def _coordinates_key(array):
+        array = np.ascontiguousarray(array)
+        return (array.shape, array.dtype.str, hashlib.blake2b(array, digest_size=16).digest())
+
+    @staticmethod
+    def _hashable(value):
+        if isinstance(value, (np.ndarray, list, tuple)):
+            value = np.asarray(value)
+            return (value.shape, value.tobytes())
+        return value
@@ -26,11 +26,21 @@ class Coordinates(object):
         x-coordinate of the pixel with index (0, 0)
     y_at_ij_0 : _type_
         y-coordinate of the pixel with index (0, 0)
+
+    Notes
+    -----
+    Instances are immutable and hashable, such that they can be used as keys 
+    of caches. The 2D coordinates arrays are created on first access only, 
+    and returned as read-only arrays on subsequent accesses.
     """
 
+    # attributes that define the coordinates grid, which cannot be changed
+    _defining_attributes = ('_matrix_pix2ang', '_matrix_ang2pix', '_ra_at_xy_0', '_dec_at_xy_0',
+                            '_x_at_radec_0', '_y_at_radec_0', '_nx', '_ny')
+
     def __init__(self, nx, ny, matrix_ij_to_xy, x_at_ij_0, y_at_ij_0):
-        self._matrix_pix2ang = matrix_ij_to_xy
-        self._matrix_ang2pix = np.linalg.inv(self._matrix_pix2ang)
+        self._matrix_pix2ang = self._read_only(np.array(matrix_ij_to_xy, dtype=float))
+        self._matrix_ang2pix = self._read_only(np.linalg.inv(self._matrix_pix2ang))
         self._ra_at_xy_0 = x_at_ij_0
         self._dec_at_xy_0 = y_at_ij_0
         self._x_at_radec_0, self._y_at_radec_0 \
@@ -38,8 +48,41 @@ class Coordinates(object):
                              0, 0, self._matrix_ang2pix)
         self._nx = nx
         self._ny = ny
-        self._x_grid, self._y_grid = self.coordinate_grid_2d(nx, ny)
+        self._grid = None  # 2D coordinates arrays are only created when needed
+        self._axes = None
+        self._sparse_grid = None
         self._model_grids = {}
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if name in self._defining_attributes and getattr(self, '_frozen', False):
+            raise AttributeError(f"Coordinates are immutable (cannot set '{name}')")
+        super().__setattr__(name, value)
+
+    def _key(self):
+        return (self._nx, self._ny, tuple(self._matrix_pix2ang.ravel().tolist()),
+                float(self._ra_at_xy_0), float(self._dec_at_xy_0))
+
+    def __eq__(self, other):
+        if not isinstance(other, Coordinates):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    @staticmethod
+    def _read_only(array):
+        array.setflags(write=False)
+        return array
+
+    @property
+    def _x_grid(self):
+        return self.pixel_coordinates[0]
+
+    @property
+    def _y_grid(self):
+        return self.pixel_coordinates[1]
 
     @property
     def pixel_area(self):
@@ -53,13 +96,111 @@ class Coordinates(object):
     def num_points(self):
         return self._nx * self._ny
 
+    @property
+    def array_shape(self):
+        """shape of the 2D arrays of coordinates"""
+        return (self._nx, self._ny)
+
     @property
     def pixel_coordinates(self):
-        return self._x_grid, self._y_grid
+        """2D arrays of x and y coordinates (read-only), created on first access"""
+        if self._grid is None:
+            x_grid, y_grid = self.coordinate_grid_2d(self._nx, self._ny)
+            self._grid = (self._read_only(x_grid), self._read_only(y_grid))
+        return self._grid
+
+    def pixel_coordinates_block(self, row_start, row_stop):
+        """Returns the coordinates of a block of rows of the 2D coordinates arrays,
+        i.e. equal to `x[row_start:row_stop], y[row_start:row_stop]` where `x, y = pixel_coordinates`,
+        without creating the full arrays.
+        """
+        row_start, row_stop, _ = slice(row_start, row_stop).indices(self._nx)
+        num_cols = self._ny
+        # flattened indices in the 1D grid (see coordinate_grid_2d())
+        k = np.arange(row_start * num_cols, max(row_stop, row_start) * num_cols)
+        x_grid, y_grid = k % self._nx, k // self._nx
+        M = self._matrix_pix2ang
+        ra_grid = x_grid * M[0, 0] + y_grid * M[0, 1] + self._ra_at_xy_0
+        dec_grid = x_grid * M[1, 0] + y_grid * M[1, 1] + self._dec_at_xy_0
+        return ra_grid.reshape(-1, num_cols), dec_grid.reshape(-1, num_cols)
+
+    def iterate_row_blocks(self, block_size):
+        """Iterates over blocks of at most `block_size` rows of the 2D coordinates arrays.
+
+        Parameters
+        ----------
+        block_size : int
+            Number of rows in each block
+
+        Yields
+        ------
+        (int, int, ndarray, ndarray)
+            First and last (excluded) row indices, and x and y coordinates of the block
+        """
+        if block_size < 1:
+            raise ValueError("Block size must be >= 1")
+        for row_start in range(0, self._nx, block_size):
+            row_stop = min(row_start + block_size, self._nx)
+            yield (row_start, row_stop, *self.pixel_coordinates_block(row_start, row_stop))
+
+    @property
+    def is_axis_aligned(self):
+        """True if the coordinates axes are aligned with the axes of the pixel grid,
+        in which case the grid is fully described by `pixel_axes`"""
+        return self._matrix_pix2ang[0, 1] == 0 and self._matrix_pix2ang[1, 0] == 0
+
+    @property
+    def is_separable(self):
+        """True if x only varies along the columns and y only along the rows 
+        of the 2D coordinates arrays, such that they can be represented by 
+        broadcastable 1D arrays (see `pixel_coordinates_sparse`).
+
+        This requires the grid to be axis-aligned and square (nx == ny). 
+        The 2D arrays are obtained by reshaping the 1D grid, whose x index 
+        varies fastest with a period of nx, to the shape (nx, ny) with 
+        util.array2image(). When nx != ny, a row of the 2D arrays therefore 
+        spans several rows of the grid, such that both x and y vary along 
+        both axes and no 1D arrays can reproduce `pixel_coordinates`.
+        """
+        return self.is_axis_aligned and self._nx == self._ny
+
+    @property
+    def pixel_coordinates_sparse(self):
+        """Broadcastable x and y coordinates (read-only), with shapes (1, n) 
+        and (n, 1), equivalent to `pixel_coordinates` for separable grids 
+        (similar to `numpy.meshgrid(..., sparse=True)`).
+        Callers that also handle other grids should check `is_separable` 
+        and use `pixel_coordinates` otherwise, as done by RenderPlan.
+
+        Raises
+        ------
+        ValueError
+            If the grid is not separable, i.e. it is rotated or not square 
+            (see `is_separable`).
+        """
+        if not self.is_separable:
+            reason = "rotated" if not self.is_axis_aligned else f"not square ({self._nx}x{self._ny})"
+            raise ValueError("Sparse coordinates are only available for separable grids "
+                             f"(the grid is {reason}, see Coordinates.is_separable)")
+        if self._sparse_grid is None:
+            x_axis, y_axis = self.pixel_axes
+            self._sparse_grid = (x_axis[np.newaxis, :], y_axis[:, np.newaxis])
+        return self._sparse_grid
 
     @property
     def pixel_axes(self):
-        return self._x_grid[0, :], self._y_grid[:, 0]
+        """1D arrays of x coordinates along the first row and y coordinates 
+        along the first column of the grid (read-only), 
+        computed without creating the 2D coordinates arrays"""
+        if self._axes is None:
+            M = self._matrix_pix2ang
+            # flattened indices in the 1D grid (see coordinate_grid_2d())
+            k_row = np.arange(self._ny)
+            k_col = np.arange(self._nx) * self._ny
+            x_axis = (k_row % self._nx) * M[0, 0] + (k_row // self._nx) * M[0, 1] + self._ra_at_xy_0
+            y_axis = (k_col % self._nx) * M[1, 0] + (k_col // self._nx) * M[1, 1] + self._dec_at_xy_0
+            self._axes = (self._read_only(x_axis), self._read_only(y_axis))
+        return self._axes
 
     @property
     def extent(self):
@@ -0,0 +1,309 @@
+__author__ = 'aymgal'
+
+
+import os
+import hashlib
+import numpy as np
+from scipy import sparse, spatial, ndimage
+
+from coolest.api.profiles import util as profile_util
+
+
+class LensingOperator(object):
+    """Linear operator mapping the pixels of a pixelated source
+    (PixelatedRegularGrid or IrregularGrid) to the pixels of the model image,
+    for a fixed mass model, coordinates grid and supersampling factor.
+
+    The operator is stored as a `scipy.sparse` CSR matrix that combines the
+    ray-shooting, the interpolation weights of the source and the downsampling
+    to the observation grid. Rendering a new realisation of the source only
+    requires a sparse matrix-vector product. The PSF convolution (if required) 
+    is performed as in ComposableLensModel.model_image() with the same settings:
+    if the render plan convolves on the supersampled grid (`super_convolution=True`), 
+    the PSF is included in the matrix, before the downsampling; 
+    otherwise the image is convolved on the observation grid after the product.
+
+    For spline interpolation (cubic and quintic) of a PixelatedRegularGrid,
+    the matrix acts on the B-spline coefficients of the source, which are computed
+    from the pixel values before the matrix-vector product (see `source_vector()`).
+    For an IrregularGrid, image pixels that are ray-shot outside the convex hull
+    of the source points receive no flux.
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix
+        Matrix of shape (number of image pixels, number of source pixels)
+    image_shape : tuple
+        Shape of the model image (at the observation resolution)
+    source_type : str
+        Type of the source profile, 'PixelatedRegularGrid' or 'IrregularGrid'
+    interpolation_method : str
+        Interpolation method of the source profile
+    render_plan : RenderPlan, optional
+        Render plan used for convolving the image with the PSF, by default None
+    includes_psf : bool, optional
+        If True, the PSF convolution is included in the matrix, by default False
+    """
+
+    def __init__(self, matrix, image_shape, source_type, interpolation_method,
+                 render_plan=None, includes_psf=False):
+        self.matrix = sparse.csr_matrix(matrix)
+        self.image_shape = tuple(image_shape)
+        self.source_type = source_type
+        self.interpolation_method = interpolation_method
+        self.includes_psf = includes_psf
+        self._render_plan = render_plan
+
+    @classmethod
+    def from_lens_model(cls, lens_model, supersampling=5, convolved=True, 
+                        super_convolution=True, cache_path=None):
+        """Builds the lensing operator of a ComposableLensModel, whose source
+        must consist of a single pixelated profile.
+
+        Parameters
+        ----------
+        lens_model : ComposableLensModel
+            Lens model, with current mass parameters and source pixels grid
+        supersampling : int, optional
+            Supersampling factor of the evaluation grid, by default 5
+        convolved : bool, optional
+            If True, `model_image()` convolves the image with the PSF, by default True
+        super_convolution : bool, optional
+            If True and if the PSF allows it (see RenderPlan), the convolution is 
+            performed on the supersampled grid and included in the matrix, 
+            which makes it denser, by default True
+        cache_path : str, optional
+            Path to a .npz file; if it exists and has been built with the same
+            settings, the operator is read from it, otherwise it is built and
+            written to it, by default None (no disk caching)
+
+        Returns
+        -------
+        LensingOperator
+            The lensing operator
+
+        Raises
+        ------
+        ValueError
+            If the source does not consist of a single pixelated profile.
+        """
+        if lens_model.source.num_profiles != 1:
+            raise ValueError("The lensing operator requires a source with a single light profile")
+        profile = lens_model.source.profile_list[0]
+        params = lens_model.source.param_list[0]
+        if profile.type not in ('PixelatedRegularGrid', 'IrregularGrid'):
+            raise ValueError(f"The lensing operator requires a pixelated source "
+                             f"(got '{profile.type}')")
+        plan = lens_model.get_render_plan(supersampling=supersampling, convolved=convolved,
+                                          super_convolution=super_convolution)
+        includes_psf = plan.convolved is True and plan.convolve_first
+        key = cls._cache_key(lens_model, plan, profile, params, includes_psf)
+        if cache_path is not None and os.path.exists(cache_path):
+            operator = cls.load(cache_path, key=key)
+            if operator is not None:
+                operator._render_plan = plan
+                return operator
+        x, y = plan.pixel_coordinates
+        x_rs, y_rs = lens_model.ray_shooting(x, y)
+        if profile.type == 'PixelatedRegularGrid':
+            weights = cls._regular_grid_weights(profile, params, x_rs, y_rs)
+        else:
+            weights = cls._irregular_grid_weights(profile, params, x_rs, y_rs)
+        down = cls._downsampling_matrix(plan.coord_eval.array_shape, plan.supersampling)
+        if includes_psf:
+            # convolution on the supersampled grid (multiplied first, as the weights are sparser)
+            down = down @ convolution_matrix(plan._kernel, plan.coord_eval.array_shape)
+        matrix = (down @ weights).tocsr()
+        operator = cls(matrix, plan.coord_obs.array_shape, profile.type,
+                       profile.interpolation_method, render_plan=plan, 
+                       includes_psf=includes_psf)
+        if cache_path is not None:
+            operator.save(cache_path, key=key)
+        return operator
+
+    def source_vector(self, source):
+        """Converts the source pixels to the vector the matrix acts on.
+
+        Parameters
+        ----------
+        source : ndarray
+            2D array of pixel values of a PixelatedRegularGrid,
+            or 1D array of values `z` of an IrregularGrid
+
+        Returns
+        -------
+        ndarray
+            1D array of size equal to the number of columns of the matrix
+        """
+        source = np.asarray(source, dtype=float)
+        if self.source_type == 'PixelatedRegularGrid':
+            order = self._spline_order(self.interpolation_method)
+            if order > 1:
+                source = ndimage.spline_filter(source, order=order, output=np.float64,
+                                               mode='constant')
+        return source.ravel()
+
+    def model_image(self, source):
+        """Renders the model image of a given source realisation.
+
+        Parameters
+        ----------
+        source : ndarray
+            Source pixels, see `source_vector()`
+
+        Returns
+        -------
+        ndarray
+            2D model image at the observation resolution
+        """
+        image = (self.matrix @ self.source_vector(source)).reshape(self.image_shape)
+        if self.includes_psf:
+            return image
+        if self._render_plan is not None and self._render_plan.convolved is True:
+            image = self._render_plan.convolve(image)
+        return image
+
+    def save(self, path, key=''):
+        """Writes the operator to a .npz file, along with an optional key
+        identifying the settings it has been built with"""
+        matrix = self.matrix
+        with open(path, 'wb') as f:
+            np.savez(f, data=matrix.data, indices=matrix.indices, indptr=matrix.indptr,
+                     shape=np.array(matrix.shape), image_shape=np.array(self.image_shape),
+                     source_type=self.source_type,
+                     interpolation_method=self.interpolation_method, 
+                     includes_psf=self.includes_psf, key=key)
+
+    @classmethod
+    def load(cls, path, key=None):
+        """Reads an operator written by `save()`. If `key` is given and differs
+        from the one stored in the file, returns None."""
+        with np.load(path) as content:
+            if key is not None and str(content['key']) != key:
+                return None
+            matrix = sparse.csr_matrix((content['data'], content['indices'], content['indptr']),
+                                       shape=tuple(content['shape']))
+            includes_psf = bool(content['includes_psf']) if 'includes_psf' in content.files else False
+            return cls(matrix, tuple(content['image_shape']), str(content['source_type']),
+                       str(content['interpolation_method']), includes_psf=includes_psf)
+
+    @staticmethod
+    def _spline_order(method):
+        return {'linear': 1, 'cubic': 3, 'quintic': 5}[method]
+
+    @classmethod
+    def _regular_grid_weights(cls, profile, params, x, y):
+        """Sparse matrix of the spline weights of each evaluation point
+        with respect to the spline coefficients of the source.
+
+        Points depend on at most (order+1)^2 consecutive coefficients, hence
+        at most one coefficient in each class of indices (i, j) modulo (order+2).
+        Interpolating the indicator of each class gives the weight of that
+        coefficient, and interpolating the indicator scaled by the coefficient
+        indices recovers which coefficient it is (including at the boundaries).
+        """
+        order = cls._spline_order(profile.interpolation_method)
+        points = profile.get_coordinates().pixel_axes
+        shape = np.shape(params['pixels'])
+        points_eval = np.array([y.ravel(), x.ravel()]).T
+        stride = order + 2
+        rows_i, cols_i = np.indices(shape)
+        index_plus_one = np.arange(1, rows_i.size + 1, dtype=float).reshape(shape)
+        rows, cols, values = [], [], []
+        for a in range(stride):
+            for b in range(stride):
+                indicator = ((rows_i % stride == a) & (cols_i % stride == b)).astype(float)
+                weight = profile_util.CartesianGridInterpolator(
+                    points, indicator, method=profile.interpolation_method)(points_eval)
+                nonzero = np.nonzero(weight)[0]
+                if len(nonzero) == 0:
+                    continue
+                scaled = profile_util.CartesianGridInterpolator(
+                    points, indicator * index_plus_one, method=profile.interpolation_method)(points_eval)
+                index = np.rint(scaled[nonzero] / weight[nonzero]).astype(int) - 1
+                rows.append(nonzero)
+                cols.append(index)
+                values.append(weight[nonzero])
+        rows, cols, values = np.concatenate(rows), np.concatenate(cols), np.concatenate(values)
+        return sparse.csr_matrix((values, (rows, cols)), shape=(points_eval.shape[0], rows_i.size))
+
+    @staticmethod
+    def _irregular_grid_weights(profile, params, x, y):
+        """Sparse matrix of the interpolation weights of each evaluation point
+        with respect to the values of the source points"""
+        num_eval, num_source = x.size, len(params['z'])
+        if profile.interpolation_method == 'linear':
+            tri = profile.get_triangulation(params['x'], params['y'])
+            vertices, weights = profile._get_barycentric_weights(tri, x.ravel(), y.ravel())
+            inside = vertices[:, 0] >= 0
+            rows = np.repeat(np.nonzero(inside)[0], 3)
+            return sparse.csr_matrix((weights[inside].ravel(), (rows, vertices[inside].ravel())),
+                                     shape=(num_eval, num_source))
+        elif profile.interpolation_method == 'nearest':
+            tree = spatial.cKDTree(np.array([params['x'], params['y']]).T)
+            _, index = tree.query(np.array([x.ravel(), y.ravel()]).T)
+            return sparse.csr_matrix((np.ones(num_eval), (np.arange(num_eval), index)),
+                                     shape=(num_eval, num_source))
+        raise NotImplementedError(f"The lensing operator does not support the interpolation "
+                                  f"method '{profile.interpolation_method}' for an irregular grid")
+
+    @staticmethod
+    def _downsampling_matrix(shape, factor):
+        """Sparse matrix equivalent to `util.downsampling()` on flattened images"""
+        num_rows, num_cols = shape
+        if factor == 1:
+            return sparse.identity(num_rows * num_cols, format='csr')
+        rows, cols = np.indices(shape)
+        index_down = (rows // factor) * (num_cols // factor) + cols // factor
+        num_down = (num_rows // factor) * (num_cols // factor)
+        return sparse.csr_matrix((np.full(rows.size, 1. / factor**2),
+                                  (index_down.ravel(), np.arange(rows.size))),
+                                 shape=(num_down, rows.size))
+
+    @staticmethod
+    def _cache_key(lens_model, plan, profile, params, includes_psf):
+        """Hash of all quantities the operator depends on"""
+        sha = hashlib.sha1()
+        def update(value):
+            sha.update(np.asarray(value, dtype=float).tobytes()
+                       if not isinstance(value, str) else value.encode())
+        for mass_params in lens_model.lens_mass.param_list:
+            for name, value in sorted(mass_params.items()):
+                update(name)
+                update(value)
+        for profile_mass in lens_model.lens_mass.profile_list:
+            update(profile_mass.__class__.__name__)
+        x, y = plan.pixel_coordinates
+        update(x)
+        update(y)
+        update(str(plan.supersampling))
+        if includes_psf:
+            update(plan._kernel)
+        update(profile.type)
+        update(profile.interpolation_method)
+        if profile.type == 'PixelatedRegularGrid':
+            for axis in profile.get_coordinates().pixel_axes:
+                update(axis)
+        else:
+            update(params['x'])
+            update(params['y'])
+        return sha.hexdigest()
+
+
+def convolution_matrix(kernel, image_shape):
+    """Sparse matrix equivalent to `scipy.signal.fftconvolve(image, kernel, mode='same')`
+    applied to flattened images of shape `image_shape`"""
+    num_rows, num_cols = image_shape
+    offset_rows, offset_cols = (kernel.shape[0] - 1) // 2, (kernel.shape[1] - 1) // 2
+    rows_out, cols_out = np.indices(image_shape)
+    rows, cols, values = [], [], []
+    for a, b in zip(*np.nonzero(kernel)):
+        rows_in = rows_out + offset_rows - a
+        cols_in = cols_out + offset_cols - b
+        valid = (rows_in >= 0) & (rows_in < num_rows) & (cols_in >= 0) & (cols_in < num_cols)
+        rows.append((rows_out * num_cols + cols_out)[valid])
+        cols.append((rows_in * num_cols + cols_in)[valid])
+        values.append(np.full(np.count_nonzero(valid), kernel[a, b]))
+    num_pix = num_rows * num_cols
+    return sparse.csr_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))),
+                             shape=(num_pix, num_pix))
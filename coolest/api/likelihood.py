@@ -0,0 +1,172 @@
+__author__ = 'aymgal'
+
+
+import numpy as np
+
+from coolest.template.classes.likelihood_list import LikelihoodList
+from coolest.api.composable_models import ComposableLensModel
+from coolest.api import util
+
+
+class ImagingLikelihood(object):
+    """Evaluates the Gaussian log-likelihood of the imaging data given
+    the lens model described in a COOLEST object, for the current point
+    estimates of the parameters or for a batch of parameter samples.
+
+    The data, the noise variance (see `util.noise_variance()`) and the
+    likelihood mask are read and combined only once. If the noise does not
+    depend on the model flux, the inverse variance map and the normalization
+    of the likelihood are precomputed, such that evaluating the likelihood
+    only requires to render the model images.
+
+    Parameters
+    ----------
+    coolest_object : COOLEST
+        COOLEST instance
+    coolest_directory : str, optional
+        Directory which contains the COOLEST template, by default None
+    likelihoods : LikelihoodList, optional
+        Likelihood terms, with 'imaging_data' first; only 'imaging_data' is
+        currently supported, by default LikelihoodList('imaging_data')
+    mask : ndarray, optional
+        Likelihood mask (1 for pixels included, 0 otherwise), by default None
+    supersampling : int, optional
+        Supersampling factor of the evaluation grid, by default 5
+    convolved : bool, optional
+        If True, model images are convolved with the PSF, by default True
+    super_convolution : bool, optional
+        See RenderPlan, by default True
+    masked_rendering : bool, optional
+        If True, model images are only rendered for the pixels inside the mask
+        (see RenderPlan.render_masked()), by default True
+    dtype : numpy dtype, optional
+        Precision in which model images are evaluated (see ComposableLensModel);
+        the likelihood itself is always computed in double precision, by default float64
+    kwargs_selection_source : dict, optional
+        Selection of the source model components (see ComposableLensModel), by default None
+    kwargs_selection_lens_mass : dict, optional
+        Selection of the lens mass model components (see ComposableLensModel), by default None
+
+    Raises
+    ------
+    ValueError
+        If 'imaging_data' is not the first likelihood term, or the mask has a wrong shape.
+    NotImplementedError
+        If other likelihood terms are given.
+    """
+
+    def __init__(self, coolest_object, coolest_directory=None, likelihoods=None, mask=None,
+                 supersampling=5, convolved=True, super_convolution=True, masked_rendering=True,
+                 kwargs_selection_source=None, kwargs_selection_lens_mass=None, dtype=np.float64):
+        if likelihoods is None:
+            likelihoods = LikelihoodList('imaging_data')
+        if len(likelihoods) == 0 or likelihoods[0] != 'imaging_data':
+            raise ValueError("The first likelihood term must be 'imaging_data'")
+        if len(likelihoods) > 1:
+            raise NotImplementedError(f"Likelihood terms {list(likelihoods[1:])} are not supported")
+        self.likelihoods = likelihoods
+        self.lens_model = ComposableLensModel(coolest_object, coolest_directory,
+                                              kwargs_selection_source=kwargs_selection_source,
+                                              kwargs_selection_lens_mass=kwargs_selection_lens_mass,
+                                              dtype=dtype)
+        self._kwargs_render = dict(supersampling=supersampling, convolved=convolved,
+                                   super_convolution=super_convolution)
+        self.data = coolest_object.observation.pixels.get_pixels(directory=coolest_directory)
+        variance, flux_factor = util.noise_variance(coolest_object, coolest_directory,
+                                                    shape=np.shape(self.data))
+        if mask is None:
+            mask = np.ones(np.shape(self.data))
+        elif np.shape(mask) != np.shape(self.data):
+            raise ValueError(f"Shape of the mask {np.shape(mask)} does not match "
+                             f"the one of the data {np.shape(self.data)}")
+        # pixels with infinite variance (e.g. zero weight) do not contribute
+        self.mask = (np.asarray(mask) > 0) & np.isfinite(variance)
+        self.num_pixels = int(np.count_nonzero(self.mask))
+        if masked_rendering and self.num_pixels < self.mask.size:
+            self._kwargs_render['mask'] = self.mask
+        self._variance = np.where(self.mask, variance, 1.)
+        self._flux_factor = None if flux_factor is None else np.where(self.mask, flux_factor, 0.)
+        if self._flux_factor is None:
+            self._inv_variance = np.where(self.mask, 1. / self._variance, 0.)
+            self._log_norm = np.sum(np.log(2. * np.pi * self._variance[self.mask]))
+        else:
+            self._inv_variance = None
+            self._log_norm = None
+
+    def chi2(self, model=None):
+        """Masked chi-square of the data given the model image(s).
+
+        Parameters
+        ----------
+        model : ndarray, optional
+            Model image, possibly with leading axes (e.g. one image per sample);
+            by default the model image for the current point estimates
+
+        Returns
+        -------
+        float or ndarray
+            Chi-square, with the same leading axes as `model`
+        """
+        if model is None:
+            model = self.model_image()
+        model = np.asarray(model, dtype=np.float64)
+        inv_variance, _ = self._inverse_variance(model)
+        return np.sum((self.data - model)**2 * inv_variance, axis=(-2, -1))
+
+    def log_likelihood(self, model=None):
+        """Gaussian log-likelihood (including its normalization) of the
+        data given the model image(s) (see `chi2()`)"""
+        if model is None:
+            model = self.model_image()
+        model = np.asarray(model, dtype=np.float64)
+        inv_variance, log_norm = self._inverse_variance(model)
+        chi2 = np.sum((self.data - model)**2 * inv_variance, axis=(-2, -1))
+        return - 0.5 * (chi2 + log_norm)
+
+    def chi2_samples(self, samples, parameter_ids, batch_size=4):
+        """Masked chi-square for each of the given parameter samples
+        (see `log_likelihood_samples()`)"""
+        return self._evaluate_samples(self.chi2, samples, parameter_ids, batch_size)
+
+    def log_likelihood_samples(self, samples, parameter_ids, batch_size=4):
+        """Gaussian log-likelihood for each of the given parameter samples.
+        Model images are rendered for `batch_size` samples at once
+        (see ComposableLensModel.model_image_samples()).
+
+        Parameters
+        ----------
+        samples : ndarray
+            2D array of shape (n_samples, n_params)
+        parameter_ids : list
+            List of parameter IDs corresponding to the columns of `samples`
+        batch_size : int, optional
+            Number of samples evaluated at once, which bounds the memory usage, by default 4
+
+        Returns
+        -------
+        ndarray
+            Log-likelihood values, with shape (n_samples,)
+        """
+        return self._evaluate_samples(self.log_likelihood, samples, parameter_ids, batch_size)
+
+    def model_image(self):
+        """Model image for the current point estimates of the parameters"""
+        image, _ = self.lens_model.model_image(**self._kwargs_render)
+        return image
+
+    def _evaluate_samples(self, function, samples, parameter_ids, batch_size):
+        samples = np.atleast_2d(samples)
+        results = []
+        for start in range(0, samples.shape[0], batch_size):
+            models = self.lens_model.model_image_samples(samples[start:start+batch_size],
+                                                         parameter_ids, **self._kwargs_render)
+            results.append(function(models))
+        return np.concatenate(results)
+
+    def _inverse_variance(self, model):
+        if self._flux_factor is None:
+            return self._inv_variance, self._log_norm
+        variance = self._variance + self._flux_factor * np.maximum(model, 0.)
+        inv_variance = np.where(self.mask, 1. / variance, 0.)
+        log_norm = np.sum(np.where(self.mask, np.log(2. * np.pi * variance), 0.), axis=(-2, -1))
+        return inv_variance, log_norm
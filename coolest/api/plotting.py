@@ -37,12 +37,16 @@ class ModelPlotter(object):
     color_bad_values : str, optional
         Color assigned to NaN values (typically negative values in log-scale), 
         by default '#111111' (dark gray)
+    n_threads : int, optional
+        Number of threads used to evaluate the models displayed in the panels
+        (see ComposableLensModel), by default None
     """
 
     def __init__(self, coolest_object, coolest_directory=None, 
-                 color_bad_values='#222222'):
+                 color_bad_values='#222222', n_threads=None):
         self.coolest = coolest_object
         self._directory = coolest_directory
+        self._n_threads = n_threads
 
         self.cmap_flux = copy.copy(plt.get_cmap('magma'))
         self.cmap_flux.set_bad(color_bad_values)
@@ -85,14 +89,14 @@ class ModelPlotter(object):
             raise ValueError("`extent_irreg` is deprecated; use `xylim` instead.")
         if kwargs_light is None:
             kwargs_light = {}
-        light_model = ComposableLightModel(self.coolest, self._directory, **kwargs_light)
+        light_model = ComposableLightModel(self.coolest, self._directory, n_threads=self._n_threads, **kwargs_light)
         if plot_caustics:
             if kwargs_lens_mass is None:
                 raise ValueError("`kwargs_lens_mass` must be provided to compute caustics")
             if coordinates_lens is None:
                 coordinates_lens = util.get_coordinates(self.coolest).create_new_coordinates(pixel_scale_factor=0.1)
             # NOTE: here we assume that `kwargs_light` is for the source!
-            mass_model = ComposableMassModel(self.coolest, self._directory, **kwargs_lens_mass)
+            mass_model = ComposableMassModel(self.coolest, self._directory, n_threads=self._n_threads, **kwargs_lens_mass)
             _, caustics = util.find_all_lens_lines(coordinates_lens, mass_model)
         if cmap is None:
             cmap = self.cmap_flux
@@ -136,7 +140,7 @@ class ModelPlotter(object):
         """
         if cmap is None:
             cmap = self.cmap_flux
-        lens_model = ComposableLensModel(self.coolest, self._directory,
+        lens_model = ComposableLensModel(self.coolest, self._directory, n_threads=self._n_threads,
                                          kwargs_selection_source=kwargs_source,
                                          kwargs_selection_lens_mass=kwargs_lens_mass)
         image, coordinates = lens_model.model_image(**model_image_kwargs)
@@ -159,7 +163,7 @@ class ModelPlotter(object):
             cmap = self.cmap_res
         if norm is None:
             norm = Normalize(-6, 6)
-        lens_model = ComposableLensModel(self.coolest, self._directory,
+        lens_model = ComposableLensModel(self.coolest, self._directory, n_threads=self._n_threads,
                                          kwargs_selection_source=kwargs_source,
                                          kwargs_selection_lens_mass=kwargs_lens_mass)
         image, coordinates = lens_model.model_residuals(mask=mask, **model_image_kwargs)
@@ -187,7 +191,7 @@ class ModelPlotter(object):
         """
         if kwargs_lens_mass is None:
             kwargs_lens_mass = {}
-        mass_model = ComposableMassModel(self.coolest, self._directory,
+        mass_model = ComposableMassModel(self.coolest, self._directory, n_threads=self._n_threads,
                                          **kwargs_lens_mass)
         if cmap is None:
             cmap = self.cmap_conv
@@ -215,7 +219,7 @@ class ModelPlotter(object):
         """
         if kwargs_lens_mass is None:
             kwargs_lens_mass = {}
-        mass_model = ComposableMassModel(self.coolest, self._directory,
+        mass_model = ComposableMassModel(self.coolest, self._directory, n_threads=self._n_threads,
                                          **kwargs_lens_mass)
         if cmap is None:
             cmap = self.cmap_res
@@ -251,7 +255,7 @@ class ModelPlotter(object):
         """
         if kwargs_lens_mass is None:
             kwargs_lens_mass = {}
-        mass_model = ComposableMassModel(self.coolest, self._directory,
+        mass_model = ComposableMassModel(self.coolest, self._directory, n_threads=self._n_threads,
                                          **kwargs_lens_mass)
         if cmap is None:
             cmap = self.cmap_mag
@@ -279,7 +283,7 @@ class ModelPlotter(object):
         """
         if kwargs_lens_mass is None:
             kwargs_lens_mass = {}
-        mass_model = ComposableMassModel(self.coolest, self._directory,
+        mass_model = ComposableMassModel(self.coolest, self._directory, n_threads=self._n_threads,
                                         **kwargs_lens_mass)
         if cmap is None:
             cmap = self.cmap_res
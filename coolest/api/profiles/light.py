@@ -2,7 +2,7 @@ __author__ = 'aymgal', 'lynevdv', 'Giorgos Vernardos'
 
 
 import numpy as np
-from scipy import interpolate
+from scipy import interpolate, spatial
 
 from coolest.template.classes.profiles.light import (Sersic as TemplateSersic,
                                                      Shapelets as TemplateShapelets,
@@ -90,9 +90,10 @@ class Shapelets(BaseLightProfile):
 
     def evaluate_surface_brightness(self, x, y, amps=0, n_max=0, beta=0, center_x=0, center_y=0):
         """Returns the surface brightness at the given position (x, y)"""
+        x, y = util.broadcast_coordinates(x, y)
         x_, y_ = x.flatten(), y.flatten()
         flux = self._backend.function(x_, y_, amps, n_max, beta, center_x=center_x, center_y=center_y)
-        return flux.reshape(*x.shape)
+        return flux.reshape(*x.shape).astype(util.real_dtype(x, y), copy=False)
 
 
 class PixelatedRegularGrid(BaseLightProfile):
@@ -114,6 +115,8 @@ class PixelatedRegularGrid(BaseLightProfile):
         self._pix_scl_x = np.abs(self._fov_x[0] - self._fov_x[1]) / self._nx
         self._pix_scl_y = np.abs(self._fov_y[0] - self._fov_y[1]) / self._ny
         self._interp_method = interpolation_method
+        self._coordinates = None
+        self._interp_cache = None  # (pixels, interpolator) of the last evaluation
 
     def surface_brightness(self, pixels=None):
         """Returns the surface brightness pixels"""
@@ -122,20 +125,43 @@ class PixelatedRegularGrid(BaseLightProfile):
         return pixels
 
     def evaluate_surface_brightness(self, x, y, pixels=None):
-        coordinates = self.get_coordinates()
-        points = coordinates.pixel_axes
-        interp = util.CartesianGridInterpolator(points, pixels, method=self._interp_method)
+        """Returns the surface brightness at the given position (x, y), 
+        interpolated with splines from the pixel values"""
+        interp = self.get_interpolator(pixels, dtype=util.real_dtype(x, y))
+        x, y = util.broadcast_coordinates(x, y)
         points_eval = np.array([y.ravel(), x.ravel()]).T
         pixels_eval = interp(points_eval).reshape(*x.shape)
         return pixels_eval
 
+    def get_interpolator(self, pixels, dtype=np.float64):
+        """Returns the interpolator of the given pixel values. 
+        The spline coefficients are computed only once for a given array of 
+        pixel values: the interpolator is reused as long as the pixel values 
+        are not changed (in-place modifications included)."""
+        cache = self._interp_cache
+        if cache is not None and cache[1].values.dtype == dtype and np.array_equal(cache[0], pixels):
+            return cache[1]
+        points = self.get_coordinates().pixel_axes
+        interp = util.CartesianGridInterpolator(points, pixels, method=self._interp_method,
+                                                prefilter=True, dtype=dtype)
+        # single assignment such that concurrent threads always see a consistent entry
+        self._interp_cache = (np.array(pixels, copy=True), interp)
+        return interp
+
+    @property
+    def interpolation_method(self):
+        return self._interp_method
+
     def get_extent(self):
         coordinates = self.get_coordinates()
         return coordinates.plt_extent
 
     def get_coordinates(self):
-        from coolest.api.util import get_coordinates_from_regular_grid
-        return get_coordinates_from_regular_grid(self._fov_x, self._fov_y, self._nx, self._ny)
+        if self._coordinates is None:
+            from coolest.api.util import get_coordinates_from_regular_grid
+            self._coordinates = get_coordinates_from_regular_grid(self._fov_x, self._fov_y, 
+                                                                  self._nx, self._ny)
+        return self._coordinates
 
 
 class IrregularGrid(BaseLightProfile):
@@ -151,6 +177,8 @@ class IrregularGrid(BaseLightProfile):
         self._fov_y = field_of_view_y
         self._n = num_pix
         self._interp_method = interpolation_method
+        self._tri_cache = None  # (x, y, triangulation) of the last evaluation
+        self._weights_cache = None  # (x_eval, y_eval, vertices, weights) of the last evaluation
 
     def surface_brightness(self, x=None, y=None, z=None):
         """Returns the surface brightness pixels"""
@@ -159,9 +187,64 @@ class IrregularGrid(BaseLightProfile):
         return x, y, z
 
     def evaluate_surface_brightness(self, x_eval, y_eval, x=None, y=None, z=None):
-        z_eval = interpolate.griddata((x, y), z, (x_eval, y_eval), 
-                                      method=self._interp_method)
-        return z_eval
+        """Returns the surface brightness at the given position (x_eval, y_eval),
+        interpolated from the values z at the points (x, y). 
+        Equivalent to `scipy.interpolate.griddata`, except that the Delaunay 
+        triangulation of the points (x, y) is computed only once, and for linear 
+        interpolation, the barycentric weights are reused as long as the 
+        evaluation points are not changed."""
+        x_eval, y_eval = util.broadcast_coordinates(x_eval, y_eval)
+        dtype = util.real_dtype(x_eval, y_eval)
+        if self._interp_method == 'nearest':
+            z_eval = interpolate.griddata((x, y), z, (x_eval, y_eval), method='nearest')
+            return z_eval.astype(dtype, copy=False)
+        tri = self.get_triangulation(x, y)
+        if self._interp_method == 'linear':
+            vertices, weights = self._get_barycentric_weights(tri, x_eval, y_eval)
+            z = np.asarray(z, dtype=float)
+            z_eval = np.einsum('...j,...j->...', z[vertices], weights)
+            z_eval[vertices[..., 0] < 0] = np.nan  # outside the convex hull
+            return z_eval.astype(dtype, copy=False)
+        interp = interpolate.CloughTocher2DInterpolator(tri, z, fill_value=np.nan)
+        return interp(x_eval, y_eval).astype(dtype, copy=False)
+
+    def get_triangulation(self, x, y):
+        """Returns the Delaunay triangulation of the points (x, y), 
+        which is reused as long as the points are not changed"""
+        cache = self._tri_cache
+        if (cache is not None and np.array_equal(cache[0], x) 
+            and np.array_equal(cache[1], y)):
+            return cache[2]
+        x, y = np.array(x, dtype=float), np.array(y, dtype=float)
+        tri = spatial.Delaunay(np.array([x, y]).T)
+        # single assignment such that concurrent threads always see a consistent entry
+        self._tri_cache = (x, y, tri)
+        self._weights_cache = None
+        return tri
+
+    def _get_barycentric_weights(self, tri, x_eval, y_eval):
+        """Returns the indices of the vertices of the triangle that contains 
+        each evaluation point, and the corresponding barycentric weights. 
+        Points outside of the triangulation have vertex indices equal to -1."""
+        cache = self._weights_cache
+        if (cache is not None and cache[0] is tri and np.array_equal(cache[1], x_eval) 
+            and np.array_equal(cache[2], y_eval)):
+            return cache[3], cache[4]
+        x_eval, y_eval = np.array(x_eval, dtype=float), np.array(y_eval, dtype=float)
+        points = np.stack([x_eval, y_eval], axis=-1)
+        simplices = tri.find_simplex(points)
+        transform = tri.transform[simplices]
+        bary = np.einsum('...ij,...j->...i', transform[..., :2, :], points - transform[..., 2, :])
+        weights = np.concatenate([bary, 1. - bary.sum(axis=-1, keepdims=True)], axis=-1)
+        vertices = tri.simplices[simplices]
+        vertices[simplices < 0] = -1
+        weights[simplices < 0] = 0.
+        self._weights_cache = (tri, x_eval, y_eval, vertices, weights)
+        return vertices, weights
+
+    @property
+    def interpolation_method(self):
+        return self._interp_method
 
     def get_extent(self):
         return [
@@ -4,11 +4,49 @@ __author__ = 'aymgal'
 import numpy as np
 from scipy import special
 
-from coolest.template.classes.profiles.mass import (PEMD as TemplatePEMD,
+from coolest.template.classes.profiles.mass import (SIE as TemplateSIE,
+                                                    NIE as TemplateNIE,
+                                                    PEMD as TemplatePEMD,
                                                     ExternalShear as TemplateExternalShear)
 from coolest.api.profiles import util
 
 
+# quantities that can be requested to evaluate_lensing()
+LENSING_QUANTITIES = ('alpha', 'kappa', 'shear', 'hessian', 'magnification', 'potential')
+
+
+def check_lensing_quantities(quantities):
+    """Checks and returns the requested lensing quantities as a tuple"""
+    if isinstance(quantities, str):
+        quantities = (quantities,)
+    for quantity in quantities:
+        if quantity not in LENSING_QUANTITIES:
+            raise ValueError(f"Lensing quantity '{quantity}' is not supported "
+                             f"(choose among {LENSING_QUANTITIES})")
+    return tuple(quantities)
+
+
+def requires_hessian(quantities):
+    """Whether some of the requested quantities are derived from the hessian"""
+    return any(quantity in quantities for quantity in ('shear', 'hessian', 'magnification'))
+
+
+def lensing_quantities_from_hessian(hessian, quantities):
+    """Derives the convergence, shear and magnification from the 
+    hessian components (H_xx, H_xy, H_yx, H_yy)"""
+    H_xx, H_xy, H_yx, H_yy = hessian
+    results = {}
+    if 'kappa' in quantities:
+        results['kappa'] = (H_xx + H_yy) / 2.
+    if 'shear' in quantities:
+        results['shear'] = ((H_xx - H_yy) / 2., H_xy)
+    if 'hessian' in quantities:
+        results['hessian'] = hessian
+    if 'magnification' in quantities:
+        det_A = (1 - H_xx) * (1 - H_yy) - H_xy*H_yx
+        results['magnification'] = 1. / det_A
+    return results
+
 
 class BaseMassProfile(object):
     """Base class to define a mass profile to compute lensing quantities.
@@ -37,6 +75,38 @@ class BaseMassProfile(object):
         raise NotImplementedError(f"The method hessian() is not defined "
                                   f"for profile '{self.__class__.__name__}'")
 
+    def evaluate_lensing(self, x, y, quantities=('alpha', 'kappa'), **params):
+        """Evaluates several lensing quantities at the given position (x, y) at once.
+
+        Parameters
+        ----------
+        x : ndarray
+            x-coordinates at which to evaluate the profile
+        y : ndarray
+            y-coordinates at which to evaluate the profile
+        quantities : tuple, optional
+            Subset of 'alpha' (deflection), 'kappa' (convergence), 'shear',
+            'hessian', 'magnification' and 'potential', by default ('alpha', 'kappa')
+
+        Returns
+        -------
+        dict
+            Requested quantities; 'alpha' and 'shear' are tuples of two components,
+            'hessian' is the tuple (H_xx, H_xy, H_yx, H_yy)
+        """
+        quantities = check_lensing_quantities(quantities)
+        results = {}
+        if 'alpha' in quantities:
+            results['alpha'] = self.deflection(x, y, **params)
+        if 'potential' in quantities:
+            results['potential'] = self.potential(x, y, **params)
+        if requires_hessian(quantities):
+            hessian = self.hessian(x, y, **params)
+            results.update(lensing_quantities_from_hessian(hessian, quantities))
+        elif 'kappa' in quantities:
+            results['kappa'] = self.convergence(x, y, **params)
+        return results
+
     @property
     def template_class(self):
         if self._template_class is None:
@@ -52,6 +122,150 @@ class BaseMassProfile(object):
         return list(self.template_class.parameters.keys())
 
 
+class NIE(BaseMassProfile):
+
+    """
+    Non-singular Isothermal Ellipsoid, with closed-form expressions for the deflection 
+    and the hessian :cite:p:`Keeton1998`. 
+    The convergence is kappa = b / (2 sqrt(q^2 (s^2 + x^2) + y^2)) along the major axis,
+    where the Einstein radius and the core radius are converted to b and s following 
+    the conventions of lenstronomy (:cite:t:`lenstronomy2018`:, :cite:t:`lenstronomy2021`:).
+    """
+
+    _template_class = TemplateNIE()
+
+    def param_conv(self, theta_E, r_core, q):
+        theta_E_conv = theta_E / (np.sqrt((1. + q**2) / (2. * q)))
+        b = theta_E_conv * np.sqrt((1. + q**2) / 2.)
+        s = r_core / np.sqrt(q)
+        return b, s
+
+    def deflection(self, x, y, theta_E=1., r_core=0., phi=0., q=1., center_x=0., center_y=0.):
+        b, s = self.param_conv(theta_E, r_core, q)
+        phi_ = util.eastofnorth2normalradians(phi)
+        x_, y_ = util.shift(x, y, center_x, center_y)
+        x_, y_ = util.rotate(x_, y_, phi_)
+        psi = self._psi_major_axis(x_, y_, s, q)
+        a_x_, a_y_ = self._defl_major_axis(x_, y_, b, s, q, psi)
+        a_x, a_y = util.rotate(a_x_, a_y_, - phi_)
+        return a_x, a_y
+
+    def convergence(self, x, y, theta_E=1., r_core=0., phi=0., q=1., center_x=0., center_y=0.):
+        """Returns the convergence (kappa) at the given position (x, y)"""
+        b, s = self.param_conv(theta_E, r_core, q)
+        phi_ = util.eastofnorth2normalradians(phi)
+        x_, y_ = util.shift(x, y, center_x, center_y)
+        x_, y_ = util.rotate(x_, y_, phi_)
+        return b / (2. * self._psi_major_axis(x_, y_, s, q))
+
+    def potential(self, x, y, theta_E=1., r_core=0., phi=0., q=1., center_x=0., center_y=0.):
+        b, s = self.param_conv(theta_E, r_core, q)
+        phi_ = util.eastofnorth2normalradians(phi)
+        x_, y_ = util.shift(x, y, center_x, center_y)
+        x_, y_ = util.rotate(x_, y_, phi_)
+        psi = self._psi_major_axis(x_, y_, s, q)
+        a_x_, a_y_ = self._defl_major_axis(x_, y_, b, s, q, psi)
+        return self._pot_major_axis(x_, y_, a_x_, a_y_, b, s, q, psi)
+
+    def hessian(self, x, y, theta_E=1., r_core=0., phi=0., q=1., center_x=0., center_y=0.):
+        b, s = self.param_conv(theta_E, r_core, q)
+        phi_ = util.eastofnorth2normalradians(phi)
+        x_, y_ = util.shift(x, y, center_x, center_y)
+        x_, y_ = util.rotate(x_, y_, phi_)
+        psi = self._psi_major_axis(x_, y_, s, q)
+        return self._hessian_major_axis(x_, y_, b, s, q, psi, phi_)
+
+    def evaluate_lensing(self, x, y, quantities=('alpha', 'kappa'), 
+                         theta_E=1., r_core=0., phi=0., q=1., center_x=0., center_y=0.):
+        """Evaluates several lensing quantities at the given position (x, y), 
+        sharing the coordinates transformation between all of them 
+        (see `BaseMassProfile.evaluate_lensing()`)."""
+        quantities = check_lensing_quantities(quantities)
+        b, s = self.param_conv(theta_E, r_core, q)
+        phi_ = util.eastofnorth2normalradians(phi)
+        x_, y_ = util.shift(x, y, center_x, center_y)
+        x_, y_ = util.rotate(x_, y_, phi_)
+        psi = self._psi_major_axis(x_, y_, s, q)
+        results = {}
+        if 'alpha' in quantities or 'potential' in quantities:
+            a_x_, a_y_ = self._defl_major_axis(x_, y_, b, s, q, psi)
+        if 'alpha' in quantities:
+            results['alpha'] = util.rotate(a_x_, a_y_, - phi_)
+        if 'potential' in quantities:
+            results['potential'] = self._pot_major_axis(x_, y_, a_x_, a_y_, b, s, q, psi)
+        if requires_hessian(quantities):
+            hessian = self._hessian_major_axis(x_, y_, b, s, q, psi, phi_)
+            results.update(lensing_quantities_from_hessian(hessian, quantities))
+        elif 'kappa' in quantities:
+            results['kappa'] = b / (2. * psi)
+        return results
+
+    @staticmethod
+    def _psi_major_axis(x_, y_, s, q):
+        psi = np.sqrt(q**2 * (s**2 + x_**2) + y_**2)
+        return np.maximum(psi, 1e-9)
+
+    @staticmethod
+    def _defl_major_axis(x_, y_, b, s, q, psi):
+        # Eq. (9) in Keeton & Kochanek 1998; the lower bound avoids the singularity for q = 1
+        e = np.sqrt(np.maximum(1. - q**2, 1e-20))
+        a_x_ = b / e * np.arctan(e * x_ / (psi + s))
+        a_y_ = b / e * np.arctanh(e * y_ / (psi + q**2 * s))
+        return a_x_, a_y_
+
+    @staticmethod
+    def _pot_major_axis(x_, y_, a_x_, a_y_, b, s, q, psi):
+        return x_*a_x_ + y_*a_y_ - b*s/2. * np.log((psi + s)**2 + (1. - q**2) * x_**2)
+
+    @staticmethod
+    def _hessian_major_axis(x_, y_, b, s, q, psi, phi_):
+        # derivatives of the deflection along the major axis
+        D = (psi + s)**2 + (1. - q**2) * x_**2
+        f_xx = b * (psi * (psi + s) - q**2 * x_**2) / (psi * D)
+        f_yy = b * (psi * (psi + q**2 * s) - y_**2) / (q**2 * psi * D)
+        f_xy = - b * x_ * y_ / (psi * D)
+        # rotate back
+        cos, sin = np.cos(phi_), np.sin(phi_)
+        H_xx = cos**2 * f_xx - 2 * cos * sin * f_xy + sin**2 * f_yy
+        H_yy = sin**2 * f_xx + 2 * cos * sin * f_xy + cos**2 * f_yy
+        H_xy = cos * sin * (f_xx - f_yy) + (cos**2 - sin**2) * f_xy
+        H_yx = H_xy
+        return H_xx, H_xy, H_yx, H_yy
+
+
+class SIE(NIE):
+
+    """
+    Singular Isothermal Ellipsoid, i.e. a NIE with zero core radius
+    (equivalent to a PEMD with gamma = 2).
+    """
+
+    _template_class = TemplateSIE()
+
+    def deflection(self, x, y, theta_E=1., phi=0., q=1., center_x=0., center_y=0.):
+        return super().deflection(x, y, theta_E=theta_E, r_core=0., phi=phi, q=q, 
+                                  center_x=center_x, center_y=center_y)
+
+    def convergence(self, x, y, theta_E=1., phi=0., q=1., center_x=0., center_y=0.):
+        """Returns the convergence (kappa) at the given position (x, y)"""
+        return super().convergence(x, y, theta_E=theta_E, r_core=0., phi=phi, q=q, 
+                                   center_x=center_x, center_y=center_y)
+
+    def potential(self, x, y, theta_E=1., phi=0., q=1., center_x=0., center_y=0.):
+        return super().potential(x, y, theta_E=theta_E, r_core=0., phi=phi, q=q, 
+                                 center_x=center_x, center_y=center_y)
+
+    def hessian(self, x, y, theta_E=1., phi=0., q=1., center_x=0., center_y=0.):
+        return super().hessian(x, y, theta_E=theta_E, r_core=0., phi=phi, q=q, 
+                               center_x=center_x, center_y=center_y)
+
+    def evaluate_lensing(self, x, y, quantities=('alpha', 'kappa'), 
+                         theta_E=1., phi=0., q=1., center_x=0., center_y=0.):
+        return super().evaluate_lensing(x, y, quantities=quantities, theta_E=theta_E, 
+                                        r_core=0., phi=phi, q=q, 
+                                        center_x=center_x, center_y=center_y)
+
+
 class PEMD(BaseMassProfile):
 
     """
@@ -62,6 +276,26 @@ class PEMD(BaseMassProfile):
     # TODO: use parameter values (point estimates, prior, etc...) contained in the template?
     _template_class = TemplatePEMD()
 
+    # above this number of terms the series is slower than the hypergeometric function
+    _max_series_terms = 300
+
+    def __init__(self, deflection_method='series', series_tolerance=1e-12):
+        """
+        Parameters
+        ----------
+        deflection_method : str, optional
+            Method to evaluate the angular part of the deflection field. 
+            Either 'series' for the rapidly converging series of :cite:t:`Tessore2015`,
+            or 'hyp2f1' for the Gauss hypergeometric function from scipy, by default 'series'.
+        series_tolerance : float, optional
+            Absolute tolerance used to truncate the series, by default 1e-12
+        """
+        if deflection_method not in ('series', 'hyp2f1'):
+            raise ValueError(f"Deflection method '{deflection_method}' is not supported "
+                             f"(choose 'series' or 'hyp2f1')")
+        self._defl_method = deflection_method
+        self._series_tol = series_tolerance
+
     def param_conv(self, theta_E, q, gamma):
         theta_E_conv = theta_E / (np.sqrt((1. + q**2) / (2. * q)))
         b = theta_E_conv * np.sqrt((1. + q**2) / 2.)
@@ -82,20 +316,65 @@ class PEMD(BaseMassProfile):
         a_x, a_y = util.rotate(a_x_, a_y_, - phi_)
         return a_x, a_y
 
-    @staticmethod
-    def _defl_major_axis(x_, y_, b, t, q):
+    def _defl_major_axis(self, x_, y_, b, t, q):
+        if self._is_isothermal(t):
+            psi = NIE._psi_major_axis(x_, y_, 0., q)
+            return NIE._defl_major_axis(x_, y_, b, 0., q, psi)
         # evaluate the profile following to Tessore et al. 2015
-        Z = np.empty(np.shape(x_), dtype=complex)
-        Z.real = q * x_
+        qx_ = q * x_
+        Z = np.empty(np.broadcast(qx_, y_).shape, dtype=util.complex_dtype(qx_, y_))
+        Z.real = qx_
         Z.imag = y_
         R = np.abs(Z)
         R = np.maximum(R, 1e-9)
-        R_omega = Z * special.hyp2f1(1, t/2, 2-t/2, -(1-q)/(1+q)*(Z/Z.conj()))
+        coeffs = None
+        if self._defl_method == 'series':
+            coeffs = self._series_coefficients(t, q, self._series_tol, self._max_series_terms)
+        if coeffs is None:
+            R_omega = Z * special.hyp2f1(1, t/2, 2-t/2, -(1-q)/(1+q)*(Z/Z.conj()))
+        else:
+            R_omega = Z * self._sum_series(coeffs, (Z/R)**2)
         alpha = 2. / (1+q) * (b/R)**t * R_omega
         a_x_ = np.nan_to_num(alpha.real, neginf=-1e10, posinf=1e10)
         a_y_ = np.nan_to_num(alpha.imag, neginf=-1e10, posinf=1e10)
         return a_x_, a_y_
 
+    def _is_isothermal(self, t):
+        # for gamma = 2, closed-form expressions exist (see NIE)
+        return self._defl_method == 'series' and np.all(t == 1.)
+
+    @staticmethod
+    def _series_coefficients(t, q, tolerance, max_terms):
+        """Coefficients c_n of the series expansion of the angular function, 
+        such that 2F1(1, t/2; 2-t/2; -f w) = sum_n c_n w^n, where w = exp(2i phi)
+        and f = (1-q)/(1+q) (see Eq. 29 in :cite:t:`Tessore2015`). 
+        Since |w| = 1, the truncation error is independent of the position and 
+        is bounded by the geometric tail |c_N| f / (1 - f). 
+        Returns None if more than `max_terms` terms are needed.
+        """
+        f = (1. - q) / (1. + q)
+        f_max = np.max(f)
+        if f_max >= 1.:
+            return None
+        coeffs = [np.ones_like(f * t)]
+        n = 0
+        while np.max(np.abs(coeffs[-1])) * f_max / (1. - f_max) > tolerance:
+            n += 1
+            if n > max_terms:
+                return None
+            coeffs.append(- f * (2.*n - 2. + t) / (2.*n + 2. - t) * coeffs[-1])
+        return coeffs
+
+    @staticmethod
+    def _sum_series(coeffs, w):
+        """Evaluates sum_n c_n w^n with Horner's scheme"""
+        result = np.empty(np.broadcast(coeffs[-1], w).shape, dtype=np.result_type(w, np.complex64))
+        result[...] = coeffs[-1]
+        for c_n in coeffs[-2::-1]:
+            result *= w
+            result += c_n
+        return result
+
     def convergence(self, x, y, theta_E=1., gamma=2., phi=0., q=1., center_x=0., center_y=0.):
         """Returns the convergence (kappa) at the given position (x, y)"""
         phi_ = util.eastofnorth2normalradians(phi)
@@ -108,12 +387,29 @@ class PEMD(BaseMassProfile):
         R = np.maximum(R, 1e-9)
         return (2 - t)/2. * (b/R)**t
 
+    def potential(self, x, y, theta_E=1., gamma=2., phi=0., q=1., center_x=0., center_y=0.):
+        b, t = self.param_conv(theta_E, q, gamma)
+        phi_ = util.eastofnorth2normalradians(phi)
+        x_, y_ = util.shift(x, y, center_x, center_y)
+        x_, y_ = util.rotate(x_, y_, phi_)
+        alpha_x_, alpha_y_ = self._defl_major_axis(x_, y_, b, t, q)
+        return self._pot_major_axis(x_, y_, alpha_x_, alpha_y_, t)
+
+    @staticmethod
+    def _pot_major_axis(x_, y_, alpha_x_, alpha_y_, t):
+        # for a power-law, the potential is simply related to the deflection (Tessore et al. 2015)
+        return (x_*alpha_x_ + y_*alpha_y_) / (2. - t)
+
     def hessian(self, x, y, theta_E=1., gamma=2., phi=0., q=1., center_x=0., center_y=0.):
         b, t = self.param_conv(theta_E, q, gamma)
         phi_ = util.eastofnorth2normalradians(phi)
         x_, y_ = util.shift(x, y, center_x, center_y)
         x_, y_ = util.rotate(x_, y_, phi_)
 
+        if self._is_isothermal(t):
+            psi = NIE._psi_major_axis(x_, y_, 0., q)
+            return NIE._hessian_major_axis(x_, y_, b, 0., q, psi, phi_)
+
         # convergence
         kappa_ = self._conv_major_axis(x_, y_, b, t, q)
         kappa_ = np.nan_to_num(kappa_, neginf=-1e10, posinf=1e10)
@@ -121,6 +417,10 @@ class PEMD(BaseMassProfile):
         # deflection
         alpha_x_, alpha_y_ = self._defl_major_axis(x_, y_, b, t, q)
 
+        return self._hessian_major_axis(x_, y_, kappa_, alpha_x_, alpha_y_, t, phi_)
+
+    @staticmethod
+    def _hessian_major_axis(x_, y_, kappa_, alpha_x_, alpha_y_, t, phi_):
         #R = np.hypot(q*x, y)
         #R = np.maximum(R, 1e-9)
         r = np.hypot(x_, y_)
@@ -149,6 +449,40 @@ class PEMD(BaseMassProfile):
 
         return H_xx, H_xy, H_yx, H_yy
 
+    def evaluate_lensing(self, x, y, quantities=('alpha', 'kappa'), 
+                         theta_E=1., gamma=2., phi=0., q=1., center_x=0., center_y=0.):
+        """Evaluates several lensing quantities at the given position (x, y), 
+        sharing the coordinates transformation and the deflection field 
+        between all of them (see `BaseMassProfile.evaluate_lensing()`)."""
+        quantities = check_lensing_quantities(quantities)
+        second_order = requires_hessian(quantities)
+        b, t = self.param_conv(theta_E, q, gamma)
+        phi_ = util.eastofnorth2normalradians(phi)
+        x_, y_ = util.shift(x, y, center_x, center_y)
+        x_, y_ = util.rotate(x_, y_, phi_)
+
+        results = {}
+        if second_order or 'alpha' in quantities or 'potential' in quantities:
+            alpha_x_, alpha_y_ = self._defl_major_axis(x_, y_, b, t, q)
+        if 'alpha' in quantities:
+            results['alpha'] = util.rotate(alpha_x_, alpha_y_, - phi_)
+        if 'potential' in quantities:
+            results['potential'] = self._pot_major_axis(x_, y_, alpha_x_, alpha_y_, t)
+        if second_order and self._is_isothermal(t):
+            psi = NIE._psi_major_axis(x_, y_, 0., q)
+            hessian = NIE._hessian_major_axis(x_, y_, b, 0., q, psi, phi_)
+            results.update(lensing_quantities_from_hessian(hessian, quantities))
+            return results
+        if second_order or 'kappa' in quantities:
+            kappa_ = self._conv_major_axis(x_, y_, b, t, q)
+            kappa_ = np.nan_to_num(kappa_, neginf=-1e10, posinf=1e10)
+        if second_order:
+            hessian = self._hessian_major_axis(x_, y_, kappa_, alpha_x_, alpha_y_, t, phi_)
+            results.update(lensing_quantities_from_hessian(hessian, quantities))
+        elif 'kappa' in quantities:
+            results['kappa'] = kappa_
+        return results
+
 
 class ExternalShear(BaseMassProfile):
 
@@ -165,8 +499,15 @@ class ExternalShear(BaseMassProfile):
         a_y = gamma2 * x_ - gamma1 * y_
         return a_x, a_y
 
+    def potential(self, x, y, gamma_ext=0., phi_ext=0.):
+        """coordinates of the origin for the external shear profile assumed to be (0., 0.)""" 
+        phi_ext_ = util.eastofnorth2normalradians(phi_ext)
+        gamma1 = gamma_ext * np.cos(2.*phi_ext_)
+        gamma2 = gamma_ext * np.sin(2.*phi_ext_)
+        return 0.5 * gamma1 * (x**2 - y**2) + gamma2 * x * y
+
     def convergence(self, x, y, gamma_ext=0., phi_ext=0.):
-        return np.zeros_like(x)
+        return np.zeros(np.broadcast_shapes(np.shape(x), np.shape(y)), dtype=util.real_dtype(x, y))
 
     def hessian(self, x, y, gamma_ext=0., phi_ext=0.):
         kappa = 0.
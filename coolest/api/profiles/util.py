@@ -10,6 +10,40 @@ def eastofnorth2normalradians(phi_in):
     phi_out = (phi_in - 90.) * np.pi / 180.
     return phi_out
 
+# NOTE: the coordinates transformations below accept any arrays x and y that broadcast 
+# against each other, e.g. with shapes (1, n) and (n, 1) for a separable grid 
+# (see Coordinates.pixel_coordinates_sparse); full 2D arrays are only created 
+# by operations that mix x and y.
+
+def real_dtype(*arrays):
+    """Floating-point dtype in which profiles are evaluated for the given input arrays: 
+    single precision if all of them are single precision, double precision otherwise"""
+    return np.result_type(*[np.asarray(a).dtype for a in arrays], np.float32)
+
+def complex_dtype(*arrays):
+    """Complex counterpart of `real_dtype()`"""
+    return np.result_type(real_dtype(*arrays), np.complex64)
+
+def cast_parameters(params, dtype):
+    """Returns the dictionary of parameters with floating-point values cast to `dtype`, 
+    such that evaluating a profile on coordinates of that dtype is not promoted 
+    to double precision by the parameters"""
+    if np.dtype(dtype) == np.float64:
+        return params
+    params_cast = {}
+    for name, value in params.items():
+        if isinstance(value, (float, np.floating)) or (
+            isinstance(value, np.ndarray) and np.issubdtype(value.dtype, np.floating)):
+            value = np.asarray(value, dtype=dtype)[()]
+        params_cast[name] = value
+    return params_cast
+
+def broadcast_coordinates(x, y):
+    """Returns x and y broadcast to their common shape, as read-only views"""
+    if np.shape(x) == np.shape(y):
+        return x, y
+    return np.broadcast_arrays(x, y)
+
 def shift(x, y, center_x, center_y):
     x_shift = x - center_x
     y_shift = y - center_y
@@ -32,13 +66,25 @@ class CartesianGridInterpolator(object):
     """
     Regular grid spline interpolator
     https://docs.scipy.org/doc/scipy/tutorial/interpolate/ND_regular_grid.html#uniformly-spaced-data
+
+    If `prefilter` is True, the B-spline coefficients of the values are computed
+    once at construction (for cubic and quintic orders), such that the interpolant 
+    passes through the values and each call only performs the coordinate mapping.
+    Values (and coefficients) are stored and interpolated with the given `dtype`.
     """
     
-    def __init__(self, points, values, method='linear', fill_value=0.):
+    def __init__(self, points, values, method='linear', fill_value=0., prefilter=False,
+                 dtype=np.float64):
         self.limits = np.array([[min(x), max(x)] for x in points])
-        self.values = np.asarray(values, dtype=float)
+        self.values = np.asarray(values, dtype=dtype)
         self.order = {'linear': 1, 'cubic': 3, 'quintic': 5}[method]
         self.fill_value = fill_value
+        if prefilter and self.order > 1:
+            # same as the prefiltering done by `map_coordinates` with mode='constant'
+            self.coefficients = ndimage.spline_filter(self.values, order=self.order, 
+                                                      output=np.float64, mode='constant').astype(dtype, copy=False)
+        else:
+            self.coefficients = self.values
 
     def __call__(self, xi):
         """
@@ -57,7 +103,7 @@ class CartesianGridInterpolator(object):
                   for val, n, (lo, hi) in zip(xi, ns, self.limits)]
 
         # interpolate
-        return ndimage.map_coordinates(self.values, coords,
+        return ndimage.map_coordinates(self.coefficients, coords,
                                        order=self.order,
                                        mode='constant',
                                        cval=self.fill_value,
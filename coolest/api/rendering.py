@@ -0,0 +1,411 @@
+__author__ = 'aymgal'
+
+
+import numpy as np
+import math
+import logging
+from scipy import fft, ndimage
+from concurrent.futures import ThreadPoolExecutor
+
+from coolest.api import util
+from coolest.api.coordinates import Coordinates
+
+
+# logging settings
+logging.getLogger().setLevel(logging.INFO)
+
+
+class RenderPlan(object):
+    """Holds all quantities needed to render a model image on the grid
+    of the observation, that do not depend on the lens model parameters.
+    It is built once for a given observation, PSF and supersampling factor,
+    such that rendering an image only requires to evaluate the profiles
+    and perform a single forward and inverse FFT.
+    A Gaussian PSF is applied with its analytical transfer function, 
+    or as two 1D convolutions for small kernels.
+
+    Parameters
+    ----------
+    coolest_object : COOLEST
+        COOLEST instance
+    coolest_directory : str, optional
+        Directory which contains the COOLEST template, by default None
+    supersampling : int, optional
+        Supersampling factor of the evaluation grid (relative to
+        the observation pixel size), by default 5
+    convolved : bool, optional
+        If True, the image is convolved with the PSF, by default True
+    super_convolution : bool, optional
+        If True and if the PSF is supersampled with the same factor,
+        the convolution is performed before downsampling, by default True
+    coordinates : Coordinates, optional
+        Coordinates of the observation; if None, they are built from the
+        COOLEST object, by default None
+    dtype : numpy dtype, optional
+        Precision of the evaluation coordinates, PSF kernel and convolution 
+        (float32 or float64), by default float64
+
+    Raises
+    ------
+    ValueError
+        If the supersampling factor, the PSF pixel size or the dtype are invalid.
+    NotImplementedError
+        If the PSF type is not supported.
+    """
+
+    # Gaussian kernels are truncated at this number of standard deviations
+    gaussian_truncation = 5.
+    # Gaussian kernels up to this size are applied as two 1D convolutions, otherwise by FFT
+    max_separable_size = 31
+
+    def __init__(self, coolest_object, coolest_directory=None,
+                 supersampling=5, convolved=True, super_convolution=True,
+                 coordinates=None, dtype=np.float64):
+        self.dtype = util.check_float_dtype(dtype)
+        self._coordinates_cast = {}
+        obs = coolest_object.observation
+        psf = coolest_object.instrument.psf
+        if convolved is True and psf.type not in ('PixelatedPSF', 'GaussianPSF'):
+            raise NotImplementedError
+        if convolved is True and psf.type == 'GaussianPSF' and not psf.fwhm > 0:
+            raise ValueError(f"FWHM of the Gaussian PSF must be positive (got {psf.fwhm})")
+        if convolved is True and psf.type == 'PixelatedPSF':
+            scale_factor = obs.pixels.pixel_size / psf.pixels.pixel_size
+            supersampling_conv = int(round(scale_factor))
+            if not math.isclose(scale_factor, supersampling_conv):
+                raise ValueError(f"PSF supersampling ({scale_factor}) not close to an integer?")
+            if supersampling_conv < 1:
+                raise ValueError("PSF pixel size smaller than data pixel size")
+        if supersampling < 1:
+            raise ValueError("Supersampling must be >= 1")
+        if convolved is True and psf.type == 'PixelatedPSF' and supersampling_conv > supersampling:
+            supersampling = supersampling_conv
+            logging.warning(f"Supersampling adapted to the PSF pixel size ({supersampling})")
+        if coordinates is None:
+            coordinates = util.get_coordinates(coolest_object)
+        self.coord_obs = coordinates
+        self.coord_eval = self.coord_obs.create_new_coordinates(pixel_scale_factor=1./supersampling)
+        self.supersampling = supersampling
+        self.convolved = convolved
+        self.convolve_first = False
+        self._gaussian_sigma = None
+        if convolved is True and psf.type == 'GaussianPSF':
+            # the Gaussian kernel can be evaluated at any resolution
+            self.convolve_first = super_convolution
+            sigma = psf.fwhm / (2. * math.sqrt(2. * math.log(2.)))  # in observation pixels
+            if self.convolve_first:
+                self._setup_gaussian_convolution(sigma * supersampling, self.coord_eval.array_shape)
+            else:
+                self._setup_gaussian_convolution(sigma, self.coord_obs.array_shape)
+        elif convolved is True:
+            kernel = psf.pixels.get_pixels(directory=coolest_directory)
+            kernel_sum = kernel.sum()
+            if not math.isclose(kernel_sum, 1., abs_tol=1e-3):
+                kernel = kernel / kernel_sum
+                logging.warning(f"PSF kernel is not normalized (sum={kernel_sum}), "
+                                f"so it has been normalized before convolution")
+            self.convolve_first = super_convolution and supersampling_conv == supersampling
+            if self.convolve_first:
+                image_shape = self.coord_eval.array_shape
+            else:
+                image_shape = self.coord_obs.array_shape
+            kernel = kernel.astype(self.dtype)
+            self._kernel = kernel
+            self._kernel_fft_full = {}  # used by render_tiled()
+            self._setup_convolution(kernel, image_shape)
+
+    @property
+    def pixel_coordinates(self):
+        """Coordinates of the (supersampled) grid on which the model is evaluated"""
+        return self._cast_coordinates('full', self.coord_eval.pixel_coordinates)
+
+    @property
+    def pixel_coordinates_sparse(self):
+        """Same as `pixel_coordinates`, as broadcastable 1D arrays if the grid is separable
+        (see Coordinates.pixel_coordinates_sparse)"""
+        if self.coord_eval.is_separable:
+            return self._cast_coordinates('sparse', self.coord_eval.pixel_coordinates_sparse)
+        return self.pixel_coordinates
+
+    def _cast_coordinates(self, key, coordinates):
+        """Coordinates arrays with the dtype of the plan, cast only once"""
+        if self.dtype == np.float64:
+            return coordinates
+        if key not in self._coordinates_cast:
+            self._coordinates_cast[key] = tuple(Coordinates._read_only(c.astype(self.dtype)) 
+                                                for c in coordinates)
+        return self._coordinates_cast[key]
+
+    def render(self, image):
+        """Convolves (if required) and downsamples an image evaluated
+        on the supersampled grid, to the resolution of the observation.
+
+        Parameters
+        ----------
+        image : ndarray
+            2D array evaluated on the grid given by `pixel_coordinates`, 
+            possibly with leading axes (e.g. one image per sample)
+
+        Returns
+        -------
+        ndarray
+            2D array at the observation resolution (with the same leading axes)
+        """
+        if self.convolved is True:
+            image = self._remove_nans(image)
+            if self.convolve_first:
+                # first convolve then downscale
+                image = self.convolve(image)
+                image = util.downsampling(image, factor=self.supersampling)
+            else:
+                # first downscale then convolve
+                image = util.downsampling(image, factor=self.supersampling)
+                image = self.convolve(image)
+        elif self.supersampling > 1:
+            image = util.downsampling(image, factor=self.supersampling)
+        return image
+
+    def render_tiled(self, evaluate, block_size=100, n_threads=None):
+        """Evaluates and renders a model image by blocks of rows of the 
+        (supersampled) evaluation grid, such that the memory needed does not 
+        depend on the number of rows of the image. 
+        Each block is downsampled as soon as it has been evaluated.
+        If the convolution is performed on the supersampled grid, each block 
+        is extended by the half-height of the PSF kernel, so the rendered image
+        does not depend on the block size (up to numerical precision).
+
+        Parameters
+        ----------
+        evaluate : callable
+            Function of (x, y) returning the model evaluated at these coordinates
+        block_size : int, optional
+            Number of rows of the evaluation grid per block, rounded down to 
+            a multiple of the supersampling factor, by default 100
+        n_threads : int, optional
+            Number of threads evaluating blocks concurrently; blocks are always
+            assembled in the same order, by default None (no threading)
+
+        Returns
+        -------
+        ndarray
+            2D array at the observation resolution
+        """
+        factor = self.supersampling
+        block_size = max(int(block_size) // factor, 1) * factor
+        num_rows = self.coord_eval.array_shape[0]
+        blocks = [(row_start, min(row_start + block_size, num_rows)) 
+                  for row_start in range(0, num_rows, block_size)]
+        render_block = lambda rows: self._render_block(evaluate, *rows)
+        if n_threads is not None and n_threads > 1 and len(blocks) > 1:
+            with ThreadPoolExecutor(max_workers=n_threads) as executor:
+                image, found_nans = self._assemble_blocks(blocks, executor.map(render_block, blocks))
+        else:
+            image, found_nans = self._assemble_blocks(blocks, map(render_block, blocks))
+        if found_nans:
+            self._warn_nans()
+        if self.convolved is True and not self.convolve_first:
+            image = self.convolve(image)
+        return image
+
+    def render_masked(self, evaluate, mask):
+        """Evaluates and renders a model image only where it is needed for the pixels 
+        inside a mask of the observation grid: the model is evaluated only on the 
+        pixels of the (supersampled) evaluation grid that are inside the mask, 
+        dilated by the support of the PSF kernel, and the convolution is 
+        restricted to the bounding box of those pixels.
+        Inside the mask, the rendered image is the same as with `render()` 
+        (up to numerical precision); pixels outside the mask are set to zero.
+
+        Parameters
+        ----------
+        evaluate : callable
+            Function of (x, y), 1D arrays of coordinates, returning the model evaluated 
+            at these coordinates, possibly with leading axes (e.g. one model per sample)
+        mask : ndarray
+            2D array with the shape of the observation, 
+            with pixels to be rendered given by non-zero values
+
+        Returns
+        -------
+        ndarray
+            2D array at the observation resolution (with the same leading axes 
+            as the output of `evaluate`)
+
+        Raises
+        ------
+        ValueError
+            If the shape of the mask does not match the one of the observation.
+        """
+        mask = np.asarray(mask) > 0
+        if mask.shape != self.coord_obs.array_shape:
+            raise ValueError(f"Shape of the mask {mask.shape} does not match "
+                             f"the one of the observation {self.coord_obs.array_shape}")
+        needed, bbox_eval, bbox_obs = self._masked_region(mask)
+        x, y = self.pixel_coordinates
+        values = evaluate(x[needed], y[needed])
+        image = np.zeros(np.shape(values)[:-1] + needed.shape, dtype=np.result_type(values))
+        image[..., needed] = values
+        if self.convolved is True:
+            image = self._remove_nans(image)
+            if self.convolve_first:
+                image[(Ellipsis,) + bbox_eval] = self._convolve_region(image[(Ellipsis,) + bbox_eval])
+        image = util.downsampling(image, factor=self.supersampling)
+        if self.convolved is True and not self.convolve_first:
+            image[(Ellipsis,) + bbox_obs] = self._convolve_region(image[(Ellipsis,) + bbox_obs])
+        return np.where(mask, image, 0.)
+
+    def _masked_region(self, mask):
+        """Pixels of the evaluation grid needed to render the pixels inside the mask, 
+        and bounding boxes of the pixels entering the convolution (on the evaluation 
+        and observation grids). The last computed region is cached."""
+        cached = getattr(self, '_masked_region_cache', None)
+        if cached is not None and np.array_equal(cached[0], mask):
+            return cached[1]
+        factor = self.supersampling
+        upsample = lambda m: np.repeat(np.repeat(m, factor, axis=0), factor, axis=1)
+        bbox_eval, bbox_obs = None, None
+        if self.convolved is True:
+            # support of the kernel, made symmetric about its central pixel
+            structure = np.ones(tuple(2 * (n // 2) + 1 for n in self._kernel.shape), dtype=bool)
+        if self.convolved is True and self.convolve_first:
+            needed = ndimage.binary_dilation(upsample(mask), structure=structure)
+            bbox_eval = self._bounding_box(needed)
+        elif self.convolved is True:
+            needed_obs = ndimage.binary_dilation(mask, structure=structure)
+            bbox_obs = self._bounding_box(needed_obs)
+            needed = upsample(needed_obs)
+        else:
+            needed = upsample(mask)
+        region = (needed, bbox_eval, bbox_obs)
+        self._masked_region_cache = (mask.copy(), region)
+        return region
+
+    @staticmethod
+    def _bounding_box(region):
+        rows, cols = np.nonzero(region)
+        if len(rows) == 0:
+            return (slice(0, 0), slice(0, 0))
+        return (slice(rows.min(), rows.max() + 1), slice(cols.min(), cols.max() + 1))
+
+    def _convolve_region(self, image):
+        """Convolution of an image of any shape with the PSF kernel, with zeros 
+        beyond its edges, equivalent to `scipy.signal.fftconvolve(image, kernel, mode='same')`"""
+        if image.size == 0:
+            return image
+        if self._gaussian_sigma is not None:
+            return self._convolve_gaussian(image)
+        image_conv = self._convolve_full(image)
+        crop = tuple(slice((n_k - 1) // 2, (n_k - 1) // 2 + n_i) 
+                     for n_i, n_k in zip(image.shape[-2:], self._kernel.shape))
+        return image_conv[(Ellipsis,) + crop]
+
+    def _assemble_blocks(self, blocks, block_results):
+        factor = self.supersampling
+        image = np.empty(self.coord_obs.array_shape, dtype=self.dtype)
+        found_nans = False
+        for (row_start, row_stop), (block, block_nans) in zip(blocks, block_results):
+            image[row_start//factor:row_stop//factor] = block
+            found_nans = found_nans or block_nans
+        return image, found_nans
+
+    def _render_block(self, evaluate, row_start, row_stop):
+        """Evaluates, convolves (if performed on the supersampled grid) and 
+        downsamples the rows [row_start, row_stop) of the evaluation grid"""
+        convolve_block = self.convolved is True and self.convolve_first
+        if convolve_block:
+            # rows of the evaluation grid needed for the convolved rows [row_start, row_stop)
+            num_rows_kernel = self._kernel.shape[0]
+            offset = (num_rows_kernel - 1) // 2
+            input_start = max(row_start + offset - num_rows_kernel + 1, 0)
+            input_stop = min(row_stop + offset, self.coord_eval.array_shape[0])
+        else:
+            input_start, input_stop = row_start, row_stop
+        x, y = self.coord_eval.pixel_coordinates_block(input_start, input_stop)
+        block = evaluate(x.astype(self.dtype, copy=False), y.astype(self.dtype, copy=False))
+        found_nans = False
+        if self.convolved is True and np.isnan(block).any():
+            block = np.nan_to_num(block, nan=0., posinf=None, neginf=None)
+            found_nans = True
+        if convolve_block:
+            block = self._convolve_full(block)
+            rows = slice(row_start + offset - input_start, row_stop + offset - input_start)
+            block = block[rows, self._crop[1]]
+        return util.downsampling(block, factor=self.supersampling), found_nans
+
+    def _convolve_full(self, image):
+        """Full convolution of an image of any shape with the PSF kernel,
+        with transfer functions cached for each image shape"""
+        if self._gaussian_sigma is not None:
+            radius = (self._kernel.shape[0] - 1) // 2
+            pad_width = [(0, 0)] * (image.ndim - 2) + [(radius, radius)] * 2
+            return self._convolve_gaussian(np.pad(image, pad_width))
+        full_shape = tuple(n_i + n_k - 1 for n_i, n_k in zip(image.shape[-2:], self._kernel.shape))
+        if full_shape not in self._kernel_fft_full:
+            fft_shape = tuple(fft.next_fast_len(n, real=True) for n in full_shape)
+            self._kernel_fft_full[full_shape] = (fft_shape, fft.rfft2(self._kernel, s=fft_shape))
+        fft_shape, kernel_fft = self._kernel_fft_full[full_shape]
+        image_conv = fft.irfft2(fft.rfft2(image, s=fft_shape) * kernel_fft, s=fft_shape)
+        return image_conv[..., :full_shape[0], :full_shape[1]]
+
+    def _remove_nans(self, image):
+        if np.isnan(image).any():
+            image = np.nan_to_num(image, nan=0., posinf=None, neginf=None)
+            self._warn_nans()
+        return image
+
+    @staticmethod
+    def _warn_nans():
+        logging.warning("Found NaN values in image prior to convolution; "
+                        "they have been replaced by zeros.")
+
+    def convolve(self, image):
+        """Convolves an image with the PSF kernel using the precomputed
+        kernel transfer function, equivalent to
+        `scipy.signal.fftconvolve(image, kernel, mode='same')`.
+        Any leading axes of `image` (e.g. samples) are kept.
+        """
+        if self._gaussian_sigma is not None:
+            return self._convolve_gaussian(image)
+        image_fft = fft.rfft2(image, s=self._fft_shape)
+        image_conv = fft.irfft2(image_fft * self._kernel_fft, s=self._fft_shape)
+        return image_conv[(Ellipsis,) + self._crop]
+
+    def _setup_convolution(self, kernel, image_shape):
+        full_shape = [n_i + n_k - 1 for n_i, n_k in zip(image_shape, kernel.shape)]
+        self._fft_shape = tuple(fft.next_fast_len(n, real=True) for n in full_shape)
+        self._kernel_fft = fft.rfft2(kernel, s=self._fft_shape)
+        # indices for extracting the central part of the full convolution
+        self._crop = tuple(slice((n_k - 1) // 2, (n_k - 1) // 2 + n_i)
+                           for n_i, n_k in zip(image_shape, kernel.shape))
+
+    def _setup_gaussian_convolution(self, sigma, image_shape):
+        radius = max(int(math.ceil(self.gaussian_truncation * sigma)), 1)
+        positions = np.arange(-radius, radius + 1)
+        kernel_1d = np.exp(- 0.5 * (positions / sigma)**2)
+        self._kernel_1d = (kernel_1d / kernel_1d.sum()).astype(self.dtype)
+        self._kernel = np.outer(self._kernel_1d, self._kernel_1d)  # used for tiled rendering
+        self._kernel_fft_full = {}
+        self._gaussian_sigma = sigma
+        self._gaussian_separable = len(kernel_1d) <= self.max_separable_size
+        self._gaussian_transfer = {}  # transfer functions for each image shape
+        self._crop = tuple(slice(radius, radius + n_i) for n_i in image_shape)
+
+    def _convolve_gaussian(self, image):
+        """Convolution with the Gaussian kernel (zero-padded boundaries), 
+        either as two 1D convolutions with the truncated kernel, or by FFT 
+        with the analytical transfer function of the Gaussian"""
+        if self._gaussian_separable:
+            image = ndimage.convolve1d(image, self._kernel_1d, axis=-1, mode='constant', cval=0.)
+            return ndimage.convolve1d(image, self._kernel_1d, axis=-2, mode='constant', cval=0.)
+        shape = np.shape(image)[-2:]
+        if shape not in self._gaussian_transfer:
+            # padding by the kernel radius prevents wrap-around effects
+            radius = (self._kernel.shape[0] - 1) // 2
+            fft_shape = tuple(fft.next_fast_len(n + 2 * radius, real=True) for n in shape)
+            factor = - 2. * (np.pi * self._gaussian_sigma)**2
+            transfer = np.exp(factor * fft.fftfreq(fft_shape[0])[:, None]**2) \
+                       * np.exp(factor * fft.rfftfreq(fft_shape[1])[None, :]**2)
+            self._gaussian_transfer[shape] = (fft_shape, transfer.astype(self.dtype))
+        fft_shape, transfer = self._gaussian_transfer[shape]
+        image_conv = fft.irfft2(fft.rfft2(image, s=fft_shape) * transfer, s=fft_shape)
+        return image_conv[..., :shape[0], :shape[1]]
@@ -0,0 +1,519 @@
+__author__ = 'aymgal'
+
+
+import inspect
+import numpy as np
+import logging
+from scipy import sparse, linalg
+from scipy.sparse import linalg as sparse_linalg
+
+from coolest.template.classes.regularization import Regularization
+from coolest.api.lensing_operator import LensingOperator, convolution_matrix
+
+
+# logging settings
+logging.getLogger().setLevel(logging.INFO)
+
+
+# relative tolerance of the conjugate gradient, whose keyword is 'tol' before scipy 1.12
+_CG_TOLERANCE = {'rtol' if 'rtol' in inspect.signature(sparse_linalg.cg).parameters else 'tol': 1e-10}
+
+# maximum number of source pixels of the kernel regularizations, whose matrix is dense
+MAX_KERNEL_REGULARIZATION_SIZE = 4000
+
+# regularizations whose penalty is a quadratic form of the source pixels
+SUPPORTED_REGULARIZATIONS = (
+    'PixelRidge',
+    'PixelGradient',
+    'PixelCurvature',
+    'PixelExponentialKernel',
+    'PixelGaussianKernel',
+    'PixelStarlet',
+)
+
+
+class SourceInversion(object):
+    """Reconstructs a pixelated source (PixelatedRegularGrid or IrregularGrid)
+    from the imaging data, given the mass model of a ComposableLensModel,
+    by solving the regularized linear least-squares problem
+
+        (M^T W M + sum_k lambda_k H_k) s = M^T W d,
+
+    where M is the sparse lensing and PSF operator, W the inverse noise
+    variance (times the likelihood mask), d the data and H_k the sparse
+    matrices of the quadratic regularization terms (see `regularization_matrices()`).
+
+    The matrices are assembled once, such that solving for different
+    regularization strengths only requires to factorize the sum of the matrices.
+    With sparse matrices, if `scikit-sparse` is installed, the system is solved 
+    with a sparse Cholesky factorization whose symbolic analysis is computed 
+    only once; otherwise it is solved with preconditioned conjugate gradients, 
+    starting from the previous solution. 
+    As the PSF makes the operator much denser, for a moderate number of source 
+    pixels the system is assembled with dense matrices (the columns of the 
+    operator being convolved by FFT) and solved with a dense Cholesky factorization.
+    The starlet regularization is a matrix-free operator (see StarletGramOperator), 
+    hence with sparse matrices it requires the conjugate gradient solver.
+
+    For spline interpolation (cubic and quintic) of a PixelatedRegularGrid,
+    the system is solved for the B-spline coefficients of the source, while
+    the regularization applies to the pixel values.
+
+    Parameters
+    ----------
+    lens_model : ComposableLensModel
+        Lens model, whose source consists of a single pixelated profile
+    regularizations : list
+        List of either template Regularization instances (the point estimates
+        of their hyper-parameters are used as default strengths), or tuples
+        (regularization type, dictionary of hyper-parameters)
+    supersampling : int, optional
+        Supersampling factor of the evaluation grid, by default 5
+    convolved : bool, optional
+        If True, the PSF is included in the operator, by default True. 
+        The convolution is performed on the observation grid 
+        (as with `super_convolution=False` in RenderPlan)
+    mask : ndarray, optional
+        Likelihood mask (1 for pixels included, 0 otherwise), by default None
+    solver : str, optional
+        'cholesky' (requires `scikit-sparse` for sparse matrices, and is not 
+        available with the starlet regularization), 'cg' or 'auto', by default 'auto'
+    dense : bool, optional
+        If True, the system is assembled with dense matrices; by default None, 
+        in which case dense matrices are used for at most `max_dense_size` source pixels
+    kwargs_regularization : dict, optional
+        Keyword arguments for each regularization type,
+        e.g. {'PixelGaussianKernel': {'scale': 0.1}}, by default None
+
+    Raises
+    ------
+    ValueError
+        If the solver is not supported, or is not compatible with the regularizations.
+    NotImplementedError
+        If a regularization type is not supported.
+    """
+
+    max_dense_size = 4000
+
+    def __init__(self, lens_model, regularizations, supersampling=5, convolved=True,
+                 mask=None, solver='auto', dense=None, kwargs_regularization=None):
+        if solver not in ('auto', 'cholesky', 'cg'):
+            raise ValueError(f"Unknown solver '{solver}' (supported: 'auto', 'cholesky', 'cg')")
+        # the PSF is applied below on the observation grid
+        self.operator = lens_model.get_lensing_operator(supersampling=supersampling,
+                                                        convolved=convolved, 
+                                                        super_convolution=False)
+        profile = lens_model.source.profile_list[0]
+        params = lens_model.source.param_list[0]
+        if dense is None:
+            dense = self.operator.matrix.shape[1] <= self.max_dense_size
+        self.dense = dense
+
+        # response of the data to each source basis coefficient
+        if convolved is True:
+            plan = lens_model.get_render_plan(supersampling=supersampling, convolved=True,
+                                              super_convolution=False)
+        if dense:
+            response = self.operator.matrix.toarray()
+            if convolved is True:
+                response = self._convolve_columns(response, plan)
+        else:
+            response = self.operator.matrix
+            if convolved is True:
+                psf = convolution_matrix(plan._kernel, self.operator.image_shape)
+                response = (psf @ response).tocsr()
+        self.response = response
+
+        # data and noise weights
+        data, sigma = lens_model._get_data_and_noise()
+        weights = 1. / np.asarray(sigma, dtype=float)**2
+        if mask is not None:
+            weights = weights * np.asarray(mask, dtype=float)
+        if dense:
+            weighted_response = weights.reshape(-1, 1) * response
+            self._data_matrix = response.T @ weighted_response
+        else:
+            weighted_response = sparse.diags(weights.ravel()) @ response
+            self._data_matrix = (response.T @ weighted_response).tocsc()
+        self._data_vector = weighted_response.T @ np.asarray(data, dtype=float).ravel()
+
+        # maps the solved coefficients to the source pixel values
+        self._interpolation = self._nodes_matrix(profile, params)
+
+        # regularization matrices, one per hyper-parameter
+        if kwargs_regularization is None:
+            kwargs_regularization = {}
+        self.regularization_types = []
+        self._regul_matrices = []
+        self._default_strengths = []
+        for regularization in regularizations:
+            regul_type, hyper_params = self._parse_regularization(regularization)
+            matrices = regularization_matrices(regul_type, profile, params,
+                                               **kwargs_regularization.get(regul_type, {}))
+            if self._interpolation is not None:
+                matrices = {name: self._interpolate_regularization(H)
+                            for name, H in matrices.items()}
+            if dense:
+                matrices = {name: _to_dense(H) for name, H in matrices.items()}
+            self.regularization_types.append(regul_type)
+            self._regul_matrices.append(matrices)
+            self._default_strengths.append({name: hyper_params.get(name) for name in matrices})
+        matrix_free = any(not sparse.issparse(H) and not isinstance(H, np.ndarray)
+                          for matrices in self._regul_matrices for H in matrices.values())
+
+        if solver == 'auto':
+            if dense:
+                solver = 'cholesky'
+            elif matrix_free:
+                solver = 'cg'
+            else:
+                try:
+                    import sksparse.cholmod
+                except ImportError:
+                    solver = 'cg'
+                else:
+                    solver = 'cholesky'
+        if solver == 'cholesky' and not dense and matrix_free:
+            raise ValueError("The sparse Cholesky solver does not support matrix-free "
+                             "regularizations (e.g. 'PixelStarlet'), use the 'cg' solver instead")
+        self.solver = solver
+
+        self._source_shape = np.shape(params['pixels']) if profile.type == 'PixelatedRegularGrid' \
+                             else np.shape(params['z'])
+        self._factor = None
+        self._solution = None
+
+    def solve(self, strengths=None):
+        """Solves for the source given the regularization strengths.
+
+        Parameters
+        ----------
+        strengths : list, optional
+            List of dictionaries of hyper-parameters (e.g. {'lambda': 1.})
+            overriding the ones given at initialization, for each regularization,
+            by default None
+
+        Returns
+        -------
+        ndarray
+            Source pixel values, with the same shape as the source profile pixels
+
+        Raises
+        ------
+        ValueError
+            If a strength is not specified.
+        """
+        matrix = self.system_matrix(strengths)
+        if self.solver == 'cholesky':
+            solution = self._solve_cholesky(matrix)
+        else:
+            solution = self._solve_cg(matrix, self._system_diagonal(strengths))
+        self._solution = solution
+        if self._interpolation is not None:
+            solution = self._interpolation @ solution
+        return solution.reshape(self._source_shape)
+
+    def system_matrix(self, strengths=None):
+        """Returns the sparse matrix of the linear system for the given
+        regularization strengths (see `solve()`), or a LinearOperator 
+        if a regularization is matrix-free"""
+        matrix = self._data_matrix.copy()
+        for strength, H in self._weighted_regularizations(strengths):
+            if self.dense or (sparse.issparse(matrix) and sparse.issparse(H)):
+                matrix = matrix + strength * H
+            else:
+                matrix = sparse_linalg.aslinearoperator(matrix) \
+                         + strength * sparse_linalg.aslinearoperator(H)
+        if self.dense or not sparse.issparse(matrix):
+            return matrix
+        return matrix.tocsc()
+
+    def _weighted_regularizations(self, strengths):
+        """Pairs of (strength, matrix) of each regularization term"""
+        terms = []
+        for k, matrices in enumerate(self._regul_matrices):
+            strengths_k = dict(self._default_strengths[k])
+            if strengths is not None and strengths[k] is not None:
+                strengths_k.update(strengths[k])
+            for name, H in matrices.items():
+                if strengths_k.get(name) is None:
+                    raise ValueError(f"Strength '{name}' of regularization "
+                                     f"'{self.regularization_types[k]}' has not been specified")
+                terms.append((float(strengths_k[name]), H))
+        return terms
+
+    def _system_diagonal(self, strengths):
+        """Diagonal of the system matrix, used as preconditioner; 
+        it is approximate if the diagonal of a regularization operator is not known"""
+        diagonal = self._data_matrix.diagonal().copy()
+        for strength, H in self._weighted_regularizations(strengths):
+            if hasattr(H, 'diagonal'):
+                diagonal += strength * H.diagonal()
+        return diagonal
+
+    def _interpolate_regularization(self, H):
+        """Regularization matrix acting on the B-spline coefficients"""
+        if sparse.issparse(H):
+            return (self._interpolation.T @ H @ self._interpolation).tocsc()
+        interpolation = sparse_linalg.aslinearoperator(self._interpolation)
+        return interpolation.T @ H @ interpolation
+
+    def model_image(self, source):
+        """Model image of a source returned by `solve()`"""
+        return self.operator.model_image(source)
+
+    def _solve_cholesky(self, matrix):
+        if self.dense:
+            return linalg.cho_solve(linalg.cho_factor(matrix), self._data_vector)
+        from sksparse.cholmod import analyze
+        if self._factor is None:
+            # symbolic analysis (fill-reducing ordering) only performed once
+            self._factor = analyze(matrix)
+        self._factor.cholesky_inplace(matrix)
+        return self._factor(self._data_vector)
+
+    def _solve_cg(self, matrix, diagonal):
+        diagonal = diagonal.copy()
+        diagonal[diagonal == 0.] = 1.
+        preconditioner = sparse.diags(1. / diagonal)
+        solution, info = sparse_linalg.cg(matrix, self._data_vector, x0=self._solution,
+                                          M=preconditioner, atol=0., **_CG_TOLERANCE,
+                                          maxiter=10 * matrix.shape[0])
+        if info != 0:
+            logging.warning(f"Conjugate gradient did not converge (info={info})")
+        return solution
+
+    @staticmethod
+    def _convolve_columns(response, plan):
+        """Convolves each column of a dense operator, seen as an image, with the PSF"""
+        columns = response.T.reshape(-1, *plan.coord_obs.array_shape)
+        columns = plan.convolve(columns)
+        return np.ascontiguousarray(columns.reshape(len(columns), -1).T)
+
+    @staticmethod
+    def _parse_regularization(regularization):
+        if isinstance(regularization, Regularization):
+            hyper_params = {name: parameter.point_estimate.value
+                            for name, parameter in regularization.parameters.items()}
+            return regularization.type, hyper_params
+        regul_type, hyper_params = regularization
+        return regul_type, dict(hyper_params)
+
+    def _nodes_matrix(self, profile, params):
+        """Sparse matrix mapping B-spline coefficients to the pixel values,
+        or None if the source is not interpolated with splines"""
+        if profile.type != 'PixelatedRegularGrid' or profile.interpolation_method == 'linear':
+            return None
+        x, y = profile.get_coordinates().pixel_coordinates
+        return LensingOperator._regular_grid_weights(profile, params, x, y).tocsc()
+
+
+def regularization_matrices(regularization_type, profile, params, scale=None, num_scales=None):
+    """Sparse matrices H of the quadratic regularization terms s^T H s
+    of a pixelated source s, one per hyper-parameter of the regularization.
+
+    - PixelRidge: identity
+    - PixelGradient: sum of squared differences between neighbouring pixels
+      (along rows and columns, or along the edges of the Delaunay triangulation)
+    - PixelCurvature: sum of squared second differences along rows and columns,
+      or squared graph Laplacian of the Delaunay triangulation
+    - PixelExponentialKernel, PixelGaussianKernel: inverse of the covariance matrix
+      exp(-d/scale) or exp(-d^2/(2 scale^2)) between pixels at distance d.
+      This matrix is dense and requires a dense Cholesky factorization, 
+      with O(N^2) memory and O(N^3) time for N pixels, hence it is limited 
+      to `MAX_KERNEL_REGULARIZATION_SIZE` (4000) pixels.
+    - PixelStarlet: sum of squared starlet coefficients, excluding the coarse scale.
+      The starlet regularization is usually an L1 norm, which does not lead to a
+      linear problem, so the L2 norm is used instead. As coarse starlet scales 
+      couple all pixels, this matrix is dense; it is returned as a matrix-free 
+      StarletGramOperator, whose memory usage scales with the size of the grid axes.
+
+    Parameters
+    ----------
+    regularization_type : str
+        Type of regularization (see SUPPORTED_REGULARIZATIONS)
+    profile : PixelatedRegularGrid or IrregularGrid
+        Source light profile
+    params : dict
+        Parameters of the source profile
+    scale : float, optional
+        Correlation length of kernel regularizations, in arcsec,
+        by default the pixel size (or the median distance between neighbouring points)
+    num_scales : int, optional
+        Number of starlet scales, by default log2 of the smallest dimension of the grid
+
+    Returns
+    -------
+    dict
+        Sparse matrices (or StarletGramOperator), with the names of the 
+        corresponding hyper-parameters as keys
+
+    Raises
+    ------
+    ValueError
+        If a kernel regularization has more than `MAX_KERNEL_REGULARIZATION_SIZE` 
+        pixels, or the starlet regularization has less than 2 scales.
+    NotImplementedError
+        If the regularization is not a quadratic form or is not supported for the profile.
+    """
+    if regularization_type not in SUPPORTED_REGULARIZATIONS:
+        raise NotImplementedError(f"Regularization '{regularization_type}' is not supported "
+                                  f"(supported: {', '.join(SUPPORTED_REGULARIZATIONS)})")
+    regular = profile.type == 'PixelatedRegularGrid'
+    if regular:
+        shape = np.shape(params['pixels'])
+        num_pix = shape[0] * shape[1]
+    else:
+        num_pix = len(params['z'])
+
+    if regularization_type == 'PixelRidge':
+        return {'lambda': sparse.identity(num_pix, format='csc')}
+
+    elif regularization_type in ('PixelGradient', 'PixelCurvature'):
+        if regular:
+            order = 1 if regularization_type == 'PixelGradient' else 2
+            D_rows = sparse.kron(_difference_matrix(shape[0], order), sparse.identity(shape[1]))
+            D_cols = sparse.kron(sparse.identity(shape[0]), _difference_matrix(shape[1], order))
+            H = D_rows.T @ D_rows + D_cols.T @ D_cols
+        else:
+            D = _edges_difference_matrix(profile, params)
+            H = D.T @ D
+            if regularization_type == 'PixelCurvature':
+                H = H.T @ H  # squared graph Laplacian
+        return {'lambda': H.tocsc()}
+
+    elif regularization_type in ('PixelExponentialKernel', 'PixelGaussianKernel'):
+        if num_pix > MAX_KERNEL_REGULARIZATION_SIZE:
+            raise ValueError(f"Regularization '{regularization_type}' requires a dense matrix "
+                             f"and is limited to {MAX_KERNEL_REGULARIZATION_SIZE} source pixels "
+                             f"(got {num_pix})")
+        if regular:
+            x, y = profile.get_coordinates().pixel_coordinates
+            x, y = x.ravel(), y.ravel()
+        else:
+            x, y = np.asarray(params['x']), np.asarray(params['y'])
+        distances = np.hypot(x[:, None] - x[None, :], y[:, None] - y[None, :])
+        if scale is None:
+            distances_ = distances + np.diag(np.full(num_pix, np.inf))
+            scale = np.median(distances_.min(axis=1))
+        if regularization_type == 'PixelExponentialKernel':
+            covariance = np.exp(- distances / scale)
+        else:
+            covariance = np.exp(- distances**2 / (2. * scale**2))
+        covariance[np.diag_indices(num_pix)] += 1e-8  # numerical stability
+        precision = linalg.cho_solve(linalg.cho_factor(covariance), np.identity(num_pix))
+        return {'lambda': sparse.csc_matrix(precision)}
+
+    elif regularization_type == 'PixelStarlet':
+        if not regular:
+            raise NotImplementedError("Starlet regularization is only supported for regular grids")
+        if num_scales is None:
+            num_scales = int(np.log2(min(shape)))
+        if num_scales < 2:
+            raise ValueError("Starlet regularization requires at least 2 scales")
+        # each starlet scale is W_j = A_j - A_{j+1}, where A_j are separable smoothing operators,
+        # hence W_j^T W_j is a sum of Kronecker products of matrices acting on each axis
+        smoothing_rows = _starlet_smoothing_matrices(shape[0], num_scales)
+        smoothing_cols = _starlet_smoothing_matrices(shape[1], num_scales)
+        def gram_terms(j):
+            return [(sign, smoothing_rows[a].T @ smoothing_rows[b], 
+                     smoothing_cols[a].T @ smoothing_cols[b])
+                    for a, b, sign in [(j, j, 1.), (j, j+1, -1.), (j+1, j, -1.), (j+1, j+1, 1.)]]
+        H_hf = StarletGramOperator(gram_terms(0), shape)
+        # excludes the coarse scale
+        H = StarletGramOperator([term for j in range(1, num_scales - 1) for term in gram_terms(j)], shape)
+        return {'lambda_hf': H_hf, 'lambda': H}
+
+
+def _difference_matrix(n, order):
+    """Finite differences of given order along a 1D array of size n"""
+    D = sparse.identity(n, format='csr')
+    for _ in range(order):
+        m = D.shape[0]
+        D = sparse.diags([-np.ones(m - 1), np.ones(m - 1)], [0, 1], shape=(m - 1, m)) @ D
+    return D
+
+
+def _edges_difference_matrix(profile, params):
+    """Differences of values along the edges of the Delaunay triangulation"""
+    tri = profile.get_triangulation(params['x'], params['y'])
+    simplices = tri.simplices
+    edges = np.concatenate([simplices[:, [0, 1]], simplices[:, [1, 2]], simplices[:, [2, 0]]])
+    edges = np.unique(np.sort(edges, axis=1), axis=0)
+    num_edges = len(edges)
+    rows = np.repeat(np.arange(num_edges), 2)
+    values = np.tile([-1., 1.], num_edges)
+    return sparse.csr_matrix((values, (rows, edges.ravel())),
+                             shape=(num_edges, len(params['z'])))
+
+
+class StarletGramOperator(sparse_linalg.LinearOperator):
+    """Matrix-free symmetric operator sum_k sign_k (P_k kron Q_k) acting on flattened 
+    2D arrays S of shape (n_rows, n_cols), applied as sum_k sign_k P_k S Q_k^T.
+    This represents the dense Gram matrix of starlet scales with O(n_rows^2 + n_cols^2) 
+    memory, instead of O((n_rows n_cols)^2).
+
+    Parameters
+    ----------
+    terms : list
+        List of tuples (sign, P, Q), with P and Q 2D arrays of shapes 
+        (n_rows, n_rows) and (n_cols, n_cols), such that the sum is symmetric
+    shape_2d : tuple
+        Shape (n_rows, n_cols) of the 2D arrays
+    """
+
+    def __init__(self, terms, shape_2d):
+        num_pix = shape_2d[0] * shape_2d[1]
+        super().__init__(dtype=np.float64, shape=(num_pix, num_pix))
+        self.terms = terms
+        self.shape_2d = tuple(shape_2d)
+
+    def _matmat(self, X):
+        num_vectors = X.shape[1]
+        S = np.asarray(X).T.reshape(num_vectors, *self.shape_2d)
+        result = sum(sign * (P @ S @ Q.T) for sign, P, Q in self.terms)
+        return result.reshape(num_vectors, -1).T
+
+    def _matvec(self, x):
+        return self._matmat(np.reshape(x, (-1, 1))).ravel()
+
+    def _adjoint(self):
+        return self
+
+    def diagonal(self):
+        """Diagonal of the operator"""
+        return sum(sign * np.kron(np.diag(P), np.diag(Q)) for sign, P, Q in self.terms)
+
+
+def _to_dense(H):
+    if sparse.issparse(H):
+        return H.toarray()
+    return H @ np.identity(H.shape[1])
+
+
+def _starlet_smoothing_matrices(n, num_scales):
+    """Matrices (dense arrays of shape (n, n)) of the successive smoothings 
+    of the isotropic undecimated wavelet transform (starlets) along one axis 
+    of size n, with the B3-spline filter and mirror boundary conditions"""
+    h = np.array([1., 4., 6., 4., 1.]) / 16.
+    smoothing = [sparse.identity(n, format='csr')]
+    for j in range(num_scales - 1):
+        smoothing.append((_mirror_filter_matrix(n, h, 2**j) @ smoothing[-1]).tocsr())
+    return [A.toarray() for A in smoothing]
+
+
+def _mirror_filter_matrix(n, h, step):
+    """1D convolution with the filter h dilated by `step`, with mirror boundaries"""
+    half = len(h) // 2
+    rows, cols, values = [], [], []
+    for k, h_k in enumerate(h):
+        index = np.arange(n) + (k - half) * step
+        # reflection about the edges, without repeating the edge pixel
+        index = np.abs(index)
+        index = np.where(index > n - 1, 2 * (n - 1) - index, index)
+        index = np.clip(index, 0, n - 1)
+        rows.append(np.arange(n))
+        cols.append(index)
+        values.append(np.full(n, h_k))
+    return sparse.csr_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))),
+                             shape=(n, n))
@@ -2,6 +2,8 @@ __author__ = 'aymgal'
 
 
 import os
+import glob
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 # from astropy.coordinates import SkyCoord
 from skimage import measure
@@ -45,6 +47,115 @@ def get_coolest_object(file_path, verbose=False, **kwargs_serializer):
     return serializer.load(verbose=verbose)
 
 
+def get_coolest_objects(file_paths, max_workers=None, verbose=False, **kwargs_serializer):
+    """Loads a catalog of COOLEST templates concurrently on a pool of threads, 
+    such that reading and parsing the JSON files overlaps with the I/O of the 
+    external FITS files (headers read to setup the grids, existence checks). 
+    Errors are collected for each file instead of being raised.
+
+    The returned objects and directories can be passed directly to, e.g., 
+    MultiModelPlotter and ParametersPlotter.
+
+    Parameters
+    ----------
+    file_paths : str or list
+        List of paths to the templates, or a glob pattern (e.g. '/data/*/coolest.json'). 
+        Paths may include the .json extension and the '_pyAPI' suffix, 
+        which are removed (see `get_coolest_object()`)
+    max_workers : int, optional
+        Number of threads, by default None (see concurrent.futures.ThreadPoolExecutor)
+    verbose : bool, optional
+        If True, prints useful output for debugging, by default False
+    kwargs_serializer : dict, optional
+        Keyword arguments passed to JSONSerializer
+
+    Returns
+    -------
+    (dict, dict)
+        COOLEST objects and errors (exception instances) keyed by the absolute 
+        path of each template without extension, in the order of `file_paths`
+    """
+    if isinstance(file_paths, str):
+        file_paths = sorted(glob.glob(file_paths))
+    template_paths = []
+    for file_path in file_paths:
+        file_path = os.path.abspath(file_path)
+        if file_path[-5:].lower() == '.json':
+            file_path = file_path[:-5]
+        if file_path.endswith(JSONSerializer._api_suffix):
+            file_path = file_path[:-len(JSONSerializer._api_suffix)]
+        if file_path not in template_paths:
+            template_paths.append(file_path)
+
+    def load(file_path):
+        try:
+            return get_coolest_object(file_path, verbose=verbose, **kwargs_serializer), None
+        except Exception as error:
+            return None, error
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(load, template_paths))
+    objects, errors = {}, {}
+    for file_path, (coolest_object, error) in zip(template_paths, results):
+        if error is None:
+            objects[file_path] = coolest_object
+        else:
+            errors[file_path] = error
+    return objects, errors
+
+
+def read_chain(coolest_object, coolest_directory, parameter_ids=None):
+    """Reads the chain file referenced in the metadata of a COOLEST object
+    (`meta['chain_file_name']`). The file should contain comma-separated
+    columns named after the parameter IDs, the last one being
+    the probability weights.
+
+    Parameters
+    ----------
+    coolest_object : COOLEST
+        COOLEST instance
+    coolest_directory : str
+        Directory which contains the COOLEST template and the chain file
+    parameter_ids : list, optional
+        Subset of parameter IDs to read; if None, all columns are read, by default None
+
+    Returns
+    -------
+    (ndarray, ndarray, list)
+        Samples with shape (n_samples, n_params), probability weights
+        with shape (n_samples,), and the parameter IDs of each column
+
+    Raises
+    ------
+    ValueError
+        If no chain file is referenced, if the columns are not comma-separated,
+        or if some parameter IDs are not found in the chain file.
+    """
+    chain_file_name = coolest_object.meta.get('chain_file_name', None)
+    if chain_file_name is None:
+        raise ValueError("No chain file is referenced in the metadata of the COOLEST object.")
+    if coolest_directory is None:
+        raise ValueError("The directory in which the COOLEST file is located "
+                         "must be provided for loading the chain file")
+    chain_file = os.path.join(coolest_directory, chain_file_name)
+    with open(chain_file, 'r') as f:
+        header = f.readline()
+    if ';' in header:
+        raise ValueError("Columns must be coma-separated (no semi-colon) in chain file.")
+    chain_file_headers = [name.strip() for name in header.split(',')]
+    chain_file_headers.pop()  # remove the last column name that is the probability weights
+    if parameter_ids is None:
+        parameter_ids = chain_file_headers
+    missing_ids = set(parameter_ids) - set(chain_file_headers)
+    if len(missing_ids) > 0:
+        raise ValueError(f"Parameters {missing_ids} are not in the chain file '{chain_file}'.")
+    column_indices = [chain_file_headers.index(param_id) for param_id in parameter_ids]
+    content = np.loadtxt(chain_file, delimiter=',', skiprows=1, ndmin=2)
+    samples = content[:, column_indices]
+    weights = content[:, -1]
+    return samples, weights, list(parameter_ids)
+
+
 def get_coordinates(coolest_object, offset_x=0., offset_y=0.):
     from coolest.api.coordinates import Coordinates  # prevents circular import errors
     nx, ny = coolest_object.observation.pixels.shape
@@ -85,6 +196,97 @@ def get_coordinates_set(coolest_file_list, reference=0):
     return coordinates_list
 
 
+def noise_variance(coolest_object, coolest_directory=None, shape=None):
+    """Returns the variance of the noise in each pixel of the observation, 
+    for any of the supported noise types. When the noise depends on the 
+    flux of the target (Gaussian approximation of its shot noise), the 
+    variance is given by `variance + flux_factor * max(flux, 0)`, 
+    where `flux` is the (modeled) flux in electrons per second.
+
+    - UniformGaussianNoise: variance is the squared standard deviation
+    - NoiseMap: variance is the squared noise map
+    - NoiseRealization: variance is estimated as the variance of the 
+      noise realization, assuming the noise is stationary
+    - InstrumentalNoise: readout noise (from the Instrument) and sky shot noise 
+      (from the magnitudes of the sky and of the zero-point) contribute to the variance, 
+      and target shot noise to the flux factor, given the exposure time
+    - DrizzledNoise: variance is the squared background RMS and the flux factor 
+      is the inverse of the weight map (effective exposure time); pixels with 
+      zero weight have an infinite variance
+
+    Parameters
+    ----------
+    coolest_object : COOLEST
+        COOLEST instance
+    coolest_directory : str, optional
+        Directory which contains the COOLEST template, by default None
+    shape : tuple, optional
+        Shape of the observation, by default the one of the observation pixels
+
+    Returns
+    -------
+    (ndarray, ndarray or None)
+        Variance and flux factor (None if the noise does not depend on the flux), 
+        both broadcastable to `shape`
+
+    Raises
+    ------
+    ValueError
+        If a quantity required by the noise type is missing.
+    NotImplementedError
+        If the noise type is not supported.
+    """
+    obs = coolest_object.observation
+    noise = obs.noise
+    if shape is None:
+        shape = obs.pixels.shape
+    flux_factor = None
+    if noise.type == 'UniformGaussianNoise':
+        variance = np.full(shape, float(noise.std_dev)**2)
+    elif noise.type == 'NoiseMap':
+        variance = noise.noise_map.get_pixels(directory=coolest_directory)**2
+    elif noise.type == 'NoiseRealization':
+        realization = noise.noise_realization.get_pixels(directory=coolest_directory)
+        variance = np.full(shape, np.var(realization))
+    elif noise.type == 'InstrumentalNoise':
+        exposure_time = obs.exposure_time
+        if exposure_time is None:
+            raise ValueError("InstrumentalNoise requires the exposure time of the observation")
+        if hasattr(exposure_time, 'get_pixels'):
+            exposure_time = exposure_time.get_pixels(directory=coolest_directory)
+        exposure_time = np.asarray(exposure_time, dtype=float)
+        variance = np.zeros(shape)
+        if noise.with_readout_noise:
+            variance = variance + float(coolest_object.instrument.readout_noise)**2 / exposure_time**2
+        if noise.with_sky_shot_noise:
+            if obs.mag_sky_brightness is None or obs.mag_zero_point is None:
+                raise ValueError("Sky shot noise requires the sky brightness "
+                                 "and the zero-point magnitudes of the observation")
+            # sky flux in electrons per second per pixel
+            sky_flux = 10**(-0.4 * (obs.mag_sky_brightness - obs.mag_zero_point)) \
+                       * coolest_object.instrument.pixel_size**2
+            variance = variance + sky_flux / exposure_time
+        if noise.with_target_shot_noise:
+            flux_factor = np.broadcast_to(1. / exposure_time, shape)
+    elif noise.type == 'DrizzledNoise':
+        wht = noise.wht_map.get_pixels(directory=coolest_directory)
+        valid = wht > 0
+        variance = np.where(valid, float(noise.background_rms)**2, np.inf)
+        flux_factor = np.where(valid, 1. / np.where(valid, wht, 1.), 0.)
+    else:
+        raise NotImplementedError(f"Noise type '{noise.type}' is not supported")
+    return variance, flux_factor
+
+
+def check_float_dtype(dtype):
+    """Checks that `dtype` is a supported floating-point precision for 
+    evaluating models (float32 or float64) and returns it as a numpy dtype"""
+    dtype = np.dtype(dtype)
+    if dtype not in (np.float32, np.float64):
+        raise ValueError(f"Unsupported dtype '{dtype}' (choose float32 or float64)")
+    return dtype
+
+
 def array2image(array, nx=0, ny=0):
     """Convert a 1d array into a 2d array.
 
@@ -122,14 +324,16 @@ def image2array(image):
 
 
 def downsampling(image, factor=1):
+    """Averages blocks of factor x factor pixels of the last two axes of `image`, 
+    keeping its dtype"""
     if factor < 1:
         raise ValueError(f"Downscaling factor must be > 1")
     if factor == 1:
         return image
     f = int(factor)
-    nx, ny = np.shape(image)
+    *leading_shape, nx, ny = np.shape(image)  # any leading axes (e.g. samples) are kept
     if int(nx/f) == nx/f and int(ny/f) == ny/f:
-        down = image.reshape([int(nx/f), f, int(ny/f), f]).mean(3).mean(1)
+        down = image.reshape(leading_shape + [int(nx/f), f, int(ny/f), f]).mean(-1).mean(-2)
         return down
     else:
         raise ValueError(f"Downscaling factor {factor} is not possible with shape ({nx}, {ny})")
@@ -23,6 +23,28 @@ def filter_dict(dictionary, exclude_keys=None):
     return dictionary_
 
 
+def _attributes(obj):
+    if isinstance(obj, APIBaseObject):
+        return obj._attributes()
+    return obj.__dict__
+
+
+def _materialize(obj, visited):
+    if id(obj) in visited:
+        return
+    visited.add(id(obj))
+    if isinstance(obj, APIBaseObject):
+        obj._materialize_attributes()
+        for value in obj.__dict__.values():
+            _materialize(value, visited)
+    if isinstance(obj, dict):
+        obj = obj.values()
+    elif not isinstance(obj, (list, tuple)):
+        return
+    for value in obj:
+        _materialize(value, visited)
+
+
 # class Fields(object):
 #     """Essentially a wrapper of inspect.signature
 #     to store argument names and default value in a readable json format.
@@ -51,6 +73,23 @@ class APIBaseObject(object):
             else:
                 self.documentation = ""
         # self.fields = Fields(self.__init__)
+
+    def _attributes(self):
+        """Attributes of the object that are serialized"""
+        return self.__dict__
+
+    def _materialize_attributes(self):
+        """Instantiates the attributes of the object that are 
+        only instantiated when first accessed, if any"""
+        pass
+
+    def materialize(self):
+        """Instantiates the attributes of the object, and of all the objects 
+        it contains, that are otherwise only instantiated when first accessed
+        (see `parameter.LazyAttribute`). This is needed before serializing 
+        the object from its `__dict__`, e.g. with `jsonpickle`.
+        """
+        _materialize(self, set())
         
     def to_JSON(self, indent=2, exclude_keys=None):
         """Returns a JSON representation of `self`, filtering out specific attributes
@@ -64,5 +103,5 @@ class APIBaseObject(object):
             List of attribute names to be excluded from the JSON representation
             (see `standard` submodule for examples), by default None
         """
-        return json.dumps(self, default=lambda o: filter_dict(o.__dict__, exclude_keys), 
+        return json.dumps(self, default=lambda o: filter_dict(_attributes(o), exclude_keys), 
                           sort_keys=True, indent=indent)
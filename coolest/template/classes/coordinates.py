@@ -1,6 +1,7 @@
 __author__ = 'aymgal'
 
 
+from functools import lru_cache
 from astropy.coordinates import SkyCoord
 
 from coolest.template.classes.base import APIBaseObject
@@ -25,11 +26,25 @@ class CoordinatesOrigin(APIBaseObject):
         super().__init__()
 
     def _check_sky_coord(self, origin_ra, origin_dec):
-        # creates astropy object to check everything is good
-        sky_coord = SkyCoord(origin_ra, origin_dec, frame='icrs')
-        return sky_coord.to_string(style='hmsdms').split(' ')
+        # cached as this is slow compared to loading the rest of a template,
+        # unless the coordinates are not hashable (e.g. lists or arrays)
+        try:
+            hash((origin_ra, origin_dec))
+        except TypeError:
+            check = _sky_coord_strings
+        else:
+            check = _sky_coord_strings_cached
+        return check(origin_ra, origin_dec)
 
 
+def _sky_coord_strings(origin_ra, origin_dec):
+    # creates astropy object to check everything is good
+    sky_coord = SkyCoord(origin_ra, origin_dec, frame='icrs')
+    return tuple(sky_coord.to_string(style='hmsdms').split(' '))
+
+
+_sky_coord_strings_cached = lru_cache(maxsize=128)(_sky_coord_strings)
+
 # class Coordinates(APIBaseObject):
 
 #     _orientations_ra = ['left', 'right']
@@ -2,8 +2,125 @@ __author__ = 'aymgal'
 
 
 import os
+import threading
+import numpy as np
+from collections import OrderedDict, namedtuple
 from astropy.io import fits
 
+FitsCacheInfo = namedtuple('FitsCacheInfo', ['hits', 'misses', 'evicted_bytes', 
+                                             'max_bytes', 'current_bytes', 'currsize'])
+
+
+class FitsCache(object):
+    """Least-recently-used cache of the content of FITS files, 
+    shared by all FitsFile instances of the process (see `FitsFile.cache`).
+
+    Entries are keyed on the absolute path, size and modification time of 
+    the file, hence modifying a file invalidates its entry. Cached arrays are 
+    read-only, and the total size of the cached arrays is kept below a 
+    budget in bytes by evicting the least recently used entries; 
+    files larger than the budget are not cached. 
+    The ranges of table columns (see `column_ranges()`) are cached 
+    in the same way, as entries of a few bytes.
+    The cache can be used from multiple threads.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        Maximum total size of the cached arrays, by default 512 MiB
+    """
+
+    def __init__(self, max_bytes=512 * 1024**2):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.max_bytes = int(max_bytes)
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted_bytes = 0
+
+    def read(self, abs_path):
+        """Returns the (data, header) content of a FITS file (as returned by 
+        fits.getdata()), from the cache if the file has not changed since 
+        it has been cached. The header is a copy that can be modified."""
+        key = self._key(abs_path)
+        entry = self._get(key)
+        if entry is not None:
+            return entry[0], entry[1].copy()
+        data, header = fits.getdata(abs_path, header=True)
+        # copy to release the file (and any memory-map) and prevent in-place modifications
+        data = data.copy()
+        data.setflags(write=False)
+        self._put(key, (data, header.copy()), data.nbytes)
+        return data, header
+
+    def column_ranges(self, abs_path, num_columns):
+        """Returns the (min, max) values of the first `num_columns` columns 
+        of the first table of a FITS file, reading only these columns 
+        if they are not in the cache"""
+        key = self._key(abs_path) + ('column_ranges', num_columns)
+        entry = self._get(key)
+        if entry is not None:
+            return list(entry)
+        with fits.open(abs_path) as hdu_list:
+            hdu = next(hdu for hdu in hdu_list if hdu.header.get('NAXIS', 0) > 0)
+            columns = [hdu.data.field(i) for i in range(num_columns)]
+            ranges = [(np.min(c), np.max(c)) for c in columns]
+        self._put(key, tuple(ranges), 2 * num_columns * 8)
+        return ranges
+
+    def resize(self, max_bytes):
+        """Changes the maximum total size of the cached arrays, 
+        evicting entries if needed"""
+        with self._lock:
+            self.max_bytes = int(max_bytes)
+            self._evict(self.max_bytes)
+
+    def info(self):
+        """Returns the number of hits and misses, the number of evicted bytes, 
+        the maximum and current size in bytes and the number of entries"""
+        with self._lock:
+            return FitsCacheInfo(self.hits, self.misses, self.evicted_bytes, 
+                                 self.max_bytes, self.current_bytes, len(self._entries))
+
+    def clear(self):
+        """Removes all entries and resets the statistics"""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evicted_bytes = 0
+
+    @staticmethod
+    def _key(abs_path):
+        stat = os.stat(abs_path)
+        return (os.path.abspath(abs_path), stat.st_size, stat.st_mtime_ns)
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def _put(self, key, value, nbytes):
+        with self._lock:
+            if nbytes <= self.max_bytes and key not in self._entries:
+                self._entries[key] = (value, nbytes)
+                self.current_bytes += nbytes
+                self._evict(self.max_bytes)
+
+    def _evict(self, max_bytes):
+        # must be called with the lock acquired
+        while self.current_bytes > max_bytes and len(self._entries) > 0:
+            _, (_, nbytes) = self._entries.popitem(last=False)
+            self.current_bytes -= nbytes
+            self.evicted_bytes += nbytes
+
 
 class FitsFile(object):
     """Class that represents a FITS file on the disk.
@@ -19,12 +136,22 @@ class FitsFile(object):
         If True, will check if the FITS file exists when the object is 
         instantiated, by default False
 
+    Notes
+    -----
+    The content of FITS files is cached by the process-wide FitsCache 
+    `FitsFile.cache`, whose budget can be changed with `FitsFile.cache.resize()`.
+    Alternatively, files can be memory-mapped (see `read()`), which is 
+    the default for all instances if `FitsFile.use_memmap` is set to True.
+
     Raises
     ------
     RuntimeError
         If the FITS file does not exist on the disk.
     """
 
+    cache = FitsCache()
+    use_memmap = False
+
     def __init__(self, path: str, 
                  directory: str = None, 
                  check_exist: bool = False) -> None:
@@ -44,8 +171,16 @@ class FitsFile(object):
             return False
         return os.path.exists(self.abs_path)
 
-    def read(self, directory=None):
+    def read(self, directory=None, memmap=None):
         """Read the data and header content of the FITS file, using astropy.io.fits.
+        The content is cached (see FitsCache), hence the data is read-only.
+
+        If `memmap` is True, the data is instead a read-only view of the 
+        memory-mapped file (without copy), such that only the parts of the array 
+        that are used are read from disk, and processes reading the same file 
+        share the OS page cache. This is not possible for scaled (BSCALE, BZERO, 
+        BLANK, TSCALn or TZEROn keywords) or compressed HDUs, which are read and 
+        cached as without memory-mapping.
 
         A directory must be given typically when it has not been set at 
         the initialization of the object.
@@ -54,6 +189,9 @@ class FitsFile(object):
         ----------
         directory : str, optional
             Absolute directory containing the FITS file, by default None
+        memmap : bool, optional
+            If True, memory-maps the file when possible, 
+            by default None (uses the class attribute `use_memmap`)
 
         Returns
         -------
@@ -65,10 +203,87 @@ class FitsFile(object):
         ValueError
             If no directory is provided and no directory has been set beforehand.
         """
+        abs_path = self._get_abs_path(directory)
+        if memmap is None:
+            memmap = self.use_memmap
+        if memmap:
+            content = self._read_memmap(abs_path)
+            if content is not None:
+                return content
+        return self.cache.read(abs_path)
+
+    @staticmethod
+    def _read_memmap(abs_path):
+        """Memory-mapped (data, header) content of the first HDU that contains data, 
+        or None if the HDU is scaled or compressed"""
+        with fits.open(abs_path, memmap=True) as hdu_list:
+            hdu = next((hdu for hdu in hdu_list if hdu.header.get('NAXIS', 0) > 0), hdu_list[0])
+            header = hdu.header
+            scaled = any(key in ('BSCALE', 'BZERO', 'BLANK') or key.startswith(('TSCAL', 'TZERO'))
+                         for key in header.keys())
+            if scaled or isinstance(hdu, fits.CompImageHDU):
+                return None
+            data = hdu.data
+            header = header.copy()
+        if data is not None:
+            # the file is opened in copy-on-write mode, hence disable writes explicitly
+            data = data.view()
+            data.setflags(write=False)
+        return data, header
+
+    def read_header(self, directory=None):
+        """Read only the header of the first HDU that contains data 
+        (i.e. the HDU read by `read()`), without loading the data.
+
+        Parameters
+        ----------
+        directory : str, optional
+            Absolute directory containing the FITS file, by default None
+
+        Returns
+        -------
+        Header
+            Header of the HDU
+
+        Raises
+        ------
+        ValueError
+            If no directory is provided and no directory has been set beforehand.
+        """
+        with fits.open(self._get_abs_path(directory)) as hdu_list:
+            for hdu in hdu_list:
+                if hdu.header.get('NAXIS', 0) > 0:
+                    return hdu.header
+            return hdu_list[0].header
+
+    def read_column_ranges(self, num_columns, directory=None):
+        """Minimum and maximum values of the first columns of a FITS table. 
+        They are taken from the TDMINn / TDMAXn header keywords if present; 
+        otherwise, only these columns are read and their ranges are cached 
+        until the file is modified (see FitsCache.column_ranges()).
+
+        Parameters
+        ----------
+        num_columns : int
+            Number of columns, starting from the first one
+        directory : str, optional
+            Absolute directory containing the FITS file, by default None
+
+        Returns
+        -------
+        list
+            List of (min, max) tuples, one for each column
+        """
+        abs_path = self._get_abs_path(directory)
+        header = self.read_header(directory=directory)
+        keys = [(f'TDMIN{i}', f'TDMAX{i}') for i in range(1, num_columns+1)]
+        if all(key_min in header and key_max in header for key_min, key_max in keys):
+            return [(header[key_min], header[key_max]) for key_min, key_max in keys]
+        return self.cache.column_ranges(abs_path, num_columns)
+
+    def _get_abs_path(self, directory):
         if not hasattr(self, '_directory'):
             if directory is None:
                 raise ValueError("You must provide a FITS file directory if none has been set")
-            abs_path = os.path.join(directory, self.path)
-        else:
-            abs_path = self.abs_path
-        return fits.getdata(abs_path, header=True)
+            return os.path.join(directory, self.path)
+        return self.abs_path
@@ -135,20 +135,22 @@ class PixelatedRegularGrid(Grid):
             self.num_pix_x, self.num_pix_y = num_pix_x, num_pix_y
 
     def read_fits(self):
-        """Read the content of the FITS file and extract the necessary Grid attributes.
+        """Read the header of the FITS file and extract the necessary Grid attributes.
+        Pixel values are only read when needed (see `get_pixels()`).
 
         Returns
         -------
         (num_pix_x, num_pix_y)
             Number of pixels along each axis.
         """
-        array, header = self.fits_file.read()
-        array_shape = array.shape
+        header = self.fits_file.read_header()
+        # shape of the array as read by astropy, i.e. (NAXISn, ..., NAXIS1)
+        array_shape = tuple(header[f'NAXIS{i}'] for i in range(header['NAXIS'], 0, -1))
         if array_shape != (header['NAXIS1'], header['NAXIS2']):
             warnings.warn("Image dimensions do not match the FITS header")
         return array_shape
 
-    def get_pixels(self, directory=None):
+    def get_pixels(self, directory=None, memmap=None):
         """Get the pixel (z) values of the regular grid from the FITS file.
         If the attribute FITS path is a relative one, it needs the absolute
         directory to read the FITS file.
@@ -157,13 +159,16 @@ class PixelatedRegularGrid(Grid):
         ----------
         directory : str, optional
             Absolute directory of the FITS file, by default None
+        memmap : bool, optional
+            If True, returns a read-only view of the memory-mapped file when possible
+            (see FitsFile.read()), by default None (uses `FitsFile.use_memmap`)
 
         Returns
         -------
         ndarray
             2D array of pixel values associated to the regular grid.
         """
-        array, _ = self.fits_file.read(directory=directory)
+        array, _ = self.fits_file.read(directory=directory, memmap=memmap)
         return array
 
 
@@ -223,22 +228,23 @@ class IrregularGrid(Grid):
             self.num_pix = num_pix
 
     def read_fits(self):
-        """Read the content of the FITS file and extract the necessary Grid attributes.
+        """Read the header of the FITS file and the ranges of the x and y columns
+        (see FitsFile.read_column_ranges()) to extract the necessary Grid attributes.
+        Values are only read when needed (see `get_xyz()`).
 
         Returns
         -------
         field_of_view_x, field_of_view_y, num_pix
             Field of view and number of pxiels.
         """
-        x, y, z = self.get_xyz()
-        num_pix = len(z)
+        header = self.fits_file.read_header()
+        num_pix = header['NAXIS2']  # number of rows of the table
         #assert self.num_pix == len(z), "Given number of grid points does not match the number of .fits table rows!"
         # Here we may want to check/report the overlap between the given field of view and the square encompassing the irregular grid
-        field_of_view_x = (min(x), max(x))
-        field_of_view_y = (min(y), max(y))
+        field_of_view_x, field_of_view_y = self.fits_file.read_column_ranges(2)
         return field_of_view_x, field_of_view_y, num_pix
 
-    def get_xyz(self, directory=None):
+    def get_xyz(self, directory=None, memmap=None):
         """Get the x, y, z values of the irregular grid from the FITS file.
         If the attribute FITS path is a relative one, it needs the absolute
         directory to read the FITS file.
@@ -247,14 +253,21 @@ class IrregularGrid(Grid):
         ----------
         directory : str, optional
             Absolute directory of the FITS file, by default None
+        memmap : bool, optional
+            If True, returns read-only views of the memory-mapped file when possible
+            (see FitsFile.read()), by default None (uses `FitsFile.use_memmap`)
 
         Returns
         -------
         ndarray, ndarray, ndarray
-            x, y and z arrays
+            x, y and z arrays (read-only)
         """
-        data, _ = self.fits_file.read(directory=directory)
-        x = data.field(0)
-        y = data.field(1)
-        z = data.field(2)
+        data, _ = self.fits_file.read(directory=directory, memmap=memmap)
+        columns = []
+        for i in range(3):
+            # table columns do not inherit the read-only flag of the table
+            column = data.field(i).view()
+            column.setflags(write=False)
+            columns.append(column)
+        x, y, z = columns
         return x, y, z
@@ -1,6 +1,8 @@
 # Single parameter of a profile
 
 from typing import List
+from functools import lru_cache
+import inspect
 
 from coolest.template.classes.base import APIBaseObject
 from coolest.template.classes.probabilities import Prior, PosteriorStatistics
@@ -50,6 +52,95 @@ class PointEstimate(APIBaseObject):
         self.value = value
 
 
+def _any_smaller(a, b):
+    # avoids converting to numpy arrays for the common case of scalar values
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return a < b
+    return np.any(np.asarray(a) < np.asarray(b))
+
+
+def _build_point_estimate(settings):
+    return PointEstimate() if settings is None else PointEstimate(**settings)
+
+
+def _build_posterior_stats(settings):
+    return PosteriorStatistics() if settings is None else PosteriorStatistics(**settings)
+
+
+def _build_prior(settings):
+    from coolest.template.classes import probabilities as proba_module
+    if settings is None or settings.get('type', None) is None:
+        return Prior()
+    settings = dict(settings)
+    PriorClass = getattr(proba_module, settings.pop('type'))
+    return PriorClass(**settings)
+
+
+@lru_cache(maxsize=None)
+def _init_arguments(cls):
+    return frozenset(inspect.signature(cls.__init__).parameters) - {'self'}
+
+
+def _check_arguments(cls, settings):
+    unknown = set(settings) - _init_arguments(cls)
+    if unknown:
+        raise ValueError(f"Unknown settings for {cls.__name__}: {sorted(unknown)}.")
+
+
+def _check_posterior_stats(settings):
+    _check_arguments(PosteriorStatistics, settings)
+
+
+def _check_prior(settings):
+    from coolest.template.classes import probabilities as proba_module
+    prior_type = settings.get('type', None)
+    if prior_type is None:
+        return
+    if prior_type not in proba_module.PRIOR_SUPPORTED_CHOICES:
+        raise ValueError(f"Prior type '{prior_type}' is not supported "
+                         f"(supported choices are {proba_module.PRIOR_SUPPORTED_CHOICES}).")
+    _check_arguments(getattr(proba_module, prior_type), 
+                     [key for key in settings if key != 'type'])
+
+
+class LazyAttribute(object):
+    """Attribute of a Parameter that is instantiated only when first accessed,
+    either from the settings (e.g. decoded from a JSON template) given to 
+    `Parameter.set_lazy_settings()`, or with its default value.
+    Once instantiated, the attribute is a regular instance attribute.
+
+    Parameters
+    ----------
+    factory : callable
+        Function that builds the attribute from its settings (dict or None)
+    check : callable, optional
+        Function that raises a ValueError if the settings (dict) are invalid,
+        such that errors are reported when the settings are given 
+        and not when the attribute is first accessed, by default None
+    """
+
+    def __init__(self, factory, check=None):
+        self.factory = factory
+        self.check = check
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        settings = instance.__dict__.get('_lazy_settings', {}).pop(self.name, None)
+        value = self.factory(settings)
+        instance.__dict__[self.name] = value
+        return value
+
+    def peek(self, instance):
+        """Returns the value of the attribute, without instantiating it on `instance`"""
+        if self.name in instance.__dict__:
+            return instance.__dict__[self.name]
+        return self.factory(instance.__dict__.get('_lazy_settings', {}).get(self.name, None))
+
+
 class Parameter(APIBaseObject):
     """Base class of a generic model parameter.
 
@@ -73,10 +164,18 @@ class Parameter(APIBaseObject):
         Prior assigned the parameter, if any, by default None
     latex_str : str, optional
         LaTeX representation of the parameter, by default None
+
+    Point estimate, posterior statistics and prior that are not provided
+    are only instantiated when first accessed (see LazyAttribute).
     
     #TODO: for parameters like orientation / axis ratio, add a class method to compute
                  related quantities like ellipticity parameters.
     """
+
+    point_estimate = LazyAttribute(_build_point_estimate)
+    posterior_stats = LazyAttribute(_build_posterior_stats, check=_check_posterior_stats)
+    prior = LazyAttribute(_build_prior, check=_check_prior)
+
     def __init__(self, 
                  documentation: str, 
                  definition_range: DefinitionRange = None,
@@ -90,20 +189,71 @@ class Parameter(APIBaseObject):
         self.units = units
         self.definition_range = definition_range
         self.fixed = fixed
-        if not isinstance(point_estimate, PointEstimate):
-            self.point_estimate = PointEstimate(point_estimate)
-        else:
+        if isinstance(point_estimate, PointEstimate):
             self.point_estimate = point_estimate
-        if posterior_stats is None:
-            posterior_stats = PosteriorStatistics()
-        self.posterior_stats = posterior_stats
-        if prior is None:
-            prior = Prior()
-        self.prior = prior
+        elif point_estimate is not None:
+            self.point_estimate = PointEstimate(point_estimate)
+        if posterior_stats is not None:
+            self.posterior_stats = posterior_stats
+        if prior is not None:
+            self.prior = prior
         self.latex_str = latex_str
         self.id = None
         super().__init__()
-        
+
+    def set_lazy_settings(self, **settings):
+        """Set the settings from which the point estimate, posterior statistics 
+        or prior are instantiated when first accessed, replacing their current value.
+
+        Parameters
+        ----------
+        settings : dict
+            Dictionary of settings (or None) for each of 'point_estimate', 
+            'posterior_stats' or 'prior', e.g. as decoded from a JSON template.
+            Prior settings contain the name of the Prior class as 'type'.
+
+        Raises
+        ------
+        ValueError
+            If an attribute cannot be instantiated lazily, or if its settings
+            are invalid (e.g. unknown prior type).
+        """
+        lazy_settings = self.__dict__.setdefault('_lazy_settings', {})
+        for name, value in settings.items():
+            attribute = getattr(type(self), name, None)
+            if not isinstance(attribute, LazyAttribute):
+                raise ValueError(f"Attribute '{name}' cannot be instantiated lazily.")
+            if value is not None and attribute.check is not None:
+                attribute.check(value)
+            self.__dict__.pop(name, None)
+            lazy_settings[name] = value
+
+    # order in which the attributes are set by __init__, hence serialized
+    _attribute_order = ('documentation', 'units', 'definition_range', 'fixed',
+                        'point_estimate', 'posterior_stats', 'prior', 'latex_str', 'id')
+
+    def _attributes(self):
+        # new dictionary, in the order of __init__, where lazy attributes 
+        # are built without being instantiated on the parameter
+        attributes = {}
+        for name in self._attribute_order:
+            attribute = getattr(type(self), name, None)
+            if isinstance(attribute, LazyAttribute):
+                attributes[name] = attribute.peek(self)
+            elif name in self.__dict__:
+                attributes[name] = self.__dict__[name]
+        # attributes set only by subclasses come last, as in __init__
+        for name, value in self.__dict__.items():
+            if name not in attributes and name != '_lazy_settings':
+                attributes[name] = value
+        return attributes
+
+    def _materialize_attributes(self):
+        # lazy attributes would otherwise be added last to __dict__
+        attributes = self._attributes()
+        self.__dict__.clear()
+        self.__dict__.update(attributes)
+
     def set_point_estimate(self, point_estimate):
         """Set the point estimate value of the parameter.
 
@@ -136,9 +286,9 @@ class Parameter(APIBaseObject):
             val = self.point_estimate.value
             min_val = self.definition_range.min_value
             max_val = self.definition_range.max_value
-            if min_val is not None and np.any(np.asarray(val) < np.asarray(min_val)):
+            if min_val is not None and _any_smaller(val, min_val):
                 raise ValueError(f"Value cannot be smaller than {self.definition_range.min_value}.")
-            if max_val is not None and np.any(np.asarray(val) > np.asarray(max_val)):
+            if max_val is not None and _any_smaller(max_val, val):
                 raise ValueError(f"Value cannot be larger than {self.definition_range.max_value}.")
 
     def remove_point_estimate(self):
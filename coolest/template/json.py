@@ -5,7 +5,7 @@ import math
 
 from coolest.template.standard import COOLEST
 from coolest.template.lazy import *
-from coolest.template.classes.parameter import PointEstimate, PosteriorStatistics, Prior
+from coolest.template.classes.parameter import PointEstimate
 from coolest.template.info import all_supported_choices as support
 
 
@@ -84,6 +84,9 @@ class JSONSerializer(object):
         WARNING: this feature may be dropped in the future.
         """
         json_path = self.path + self._api_suffix + '.json'
+        # jsonpickle encodes the __dict__ of each object, hence
+        # lazy attributes (see Parameter) need to be instantiated first
+        self.obj.materialize()
         result = jsonpickle.encode(self.obj, indent=self.indent)
         with open(json_path, 'w') as f:
             f.write(result)
@@ -131,12 +134,22 @@ class JSONSerializer(object):
         COOLEST object
             COOLEST object that corresponds to the JSON template
         """
-        with open(json_path, 'r') as f:
-            content = json.loads(f.read())
+        content = self._decode(json_path)
         if not as_object:
             return content  # dictionary
         return self._json_to_coolest(content)  # COOLEST object
 
+    @staticmethod
+    def _decode(json_path):
+        """Decodes the JSON file, using the faster `orjson` package if installed"""
+        try:
+            import orjson
+        except ImportError:
+            with open(json_path, 'r') as f:
+                return json.loads(f.read())
+        with open(json_path, 'rb') as f:
+            return orjson.loads(f.read())
+
     def load_jsonpickle(self, jsonpickle_path):
         """Read the JSON template file and build up the corresponding COOLEST object
         using the `jsonpickle`.
@@ -324,22 +337,11 @@ class JSONSerializer(object):
             raise ValueError(f"Unknown grid profile ({profile_out.type})")
         
     def _update_std_parameter(self, profile_out, name, values):
-        pt_estim = PointEstimate(**values['point_estimate'])
-        profile_out.parameters[name].set_point_estimate(pt_estim)
-        if 'posterior_stats' in values:
-            post_stats = PosteriorStatistics(**values['posterior_stats'])
-            profile_out.parameters[name].set_posterior(post_stats)
-        if 'prior' in values:
-            prior = self._setup_prior(values['prior'])
-            profile_out.parameters[name].set_prior(prior)
-
-    def _setup_prior(self, prior_in):
-        from coolest.template.classes import probabilities as proba_module
-        prior_type = prior_in.pop('type')
-        if prior_type is None:
-            return Prior()
-        PriorClass = getattr(proba_module, prior_type)
-        return PriorClass(**prior_in)
+        parameter = profile_out.parameters[name]
+        parameter.set_point_estimate(PointEstimate(**values['point_estimate']))
+        # posterior statistics and prior are only instantiated when accessed
+        parameter.set_lazy_settings(posterior_stats=values.get('posterior_stats', None),
+                                    prior=values.get('prior', None))
 
     def _setup_noise(self, noise_in):
         from coolest.template.classes import noise as noise_module
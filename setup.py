@@ -31,6 +31,8 @@ install_optional = [
     'ipython',              # for running example notebooks
     'ipykernel',            # notebooks in custom environment
     'getdist>=1.3.2',       # for making corner plots
+    'scikit-sparse',        # for sparse Cholesky in source inversions
+    'orjson',               # for faster loading of JSON templates
 ]
 
 setuptools.setup(
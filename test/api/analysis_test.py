@@ -69,3 +69,48 @@ def test_effective_radius_light(supersampling, axis_ratio, radius):
                                                 entity_selection=[1], 
                                                 profile_selection='all')
     npt.assert_allclose(theta_eff_th, theta_eff, rtol=4e-2)
+
+@pytest.mark.parametrize("n_processes", [1, 2])
+def test_derived_quantity_samples(n_processes, tmp_path):
+    analysis = _get_analysis_instance(1)
+    coolest = analysis.coolest
+    # write a chain file with a few samples
+    parameter_ids = ['0-galaxy-mass-0-PEMD-theta_E', '0-galaxy-mass-0-PEMD-q']
+    samples = np.array([[0.8, 0.9], [1.1, 0.8], [1.4, 1.0], [1.2, 0.9], [0.9, 0.8]])
+    weights = np.array([0.1, 0.3, 0.2, 0.3, 0.1])
+    np.savetxt(os.path.join(tmp_path, 'chain.csv'), np.hstack([samples, weights[:, None]]),
+               delimiter=',', header=','.join(parameter_ids + ['probability_weights']), comments='')
+    coolest.meta['chain_file_name'] = 'chain.csv'
+    analysis.coolest_dir = str(tmp_path)
+    theta_E_eff, weights_out = analysis.derived_quantity_samples(
+        'effective_einstein_radius', n_processes=n_processes, chunk_size=2, entity_selection=[0])
+    npt.assert_allclose(weights_out, weights)
+    npt.assert_allclose(theta_E_eff, samples[:, 0], rtol=4e-2)
+    # point estimates of the original object are left untouched
+    assert coolest.lensing_entities[0].mass_model[0].parameters['theta_E'].point_estimate.value == 1.27
+    # and no copy of the object is kept in the calling process after the evaluation
+    from coolest.api import analysis as analysis_module
+    assert analysis_module._worker_analysis is None and analysis_module._worker_parameters is None
+    # random subset of samples
+    _, weights_out = analysis.derived_quantity_samples(
+        'effective_einstein_radius', num_samples=3, seed=1, n_processes=n_processes, entity_selection=[0])
+    assert len(weights_out) == 3
+    with pytest.raises(ValueError):
+        analysis.derived_quantity_samples('lensing_information')
+
+@pytest.mark.parametrize("n_processes", [1, 2])
+def test_derived_quantity_samples_outside_range(n_processes, tmp_path):
+    analysis = _get_analysis_instance(1)
+    # the axis ratio of the second sample is outside of its definition range
+    parameter_ids = ['0-galaxy-mass-0-PEMD-theta_E', '0-galaxy-mass-0-PEMD-q']
+    samples = np.array([[0.9, 0.9], [1.1, 1.02], [1.3, 0.8]])
+    with pytest.raises(ValueError):
+        analysis.coolest.lensing_entities[0].mass_model[0].parameters['q'].set_point_estimate(1.02)
+    np.savetxt(os.path.join(tmp_path, 'chain.csv'), np.hstack([samples, np.ones((3, 1))]),
+               delimiter=',', header=','.join(parameter_ids + ['probability_weights']), comments='')
+    analysis.coolest.meta['chain_file_name'] = 'chain.csv'
+    analysis.coolest_dir = str(tmp_path)
+    theta_E_eff, _ = analysis.derived_quantity_samples(
+        'effective_einstein_radius', n_processes=n_processes, chunk_size=2, entity_selection=[0])
+    assert len(theta_E_eff) == 3
+    npt.assert_allclose(theta_E_eff, samples[:, 0], rtol=4e-2)
@@ -0,0 +1,450 @@
+__author__ = 'aymgal'
+
+
+import pytest
+import os
+import numpy as np
+import numpy.testing as npt
+
+from coolest.api.composable_models import ComposableMassModel, ComposableLensModel
+from coolest.api import util
+from coolest.api.profiles.light import PixelatedRegularGrid, IrregularGrid
+from coolest.template.classes.psf import GaussianPSF, PixelatedPSF
+from coolest.template.classes.grid import PixelatedRegularGrid as PixelatedRegularGridTemplate
+
+
+def _get_coolest_object():
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    coolest_path = os.path.join(current_dir, '_templates', 'pemd_sersic')
+    return util.get_coolest_object(coolest_path, check_external_files=False)
+
+
+class TestComposableMassModel(object):
+
+    def setup_method(self):
+        self.coolest = _get_coolest_object()
+        self.coordinates = util.get_coordinates(self.coolest).create_new_coordinates(pixel_scale_factor=4)
+        self.parameter_ids = ['0-galaxy-mass-0-PEMD-theta_E', '0-galaxy-mass-0-PEMD-q']
+        self.samples = np.array([[0.9, 0.7], [1.1, 0.8], [1.3, 0.95]])
+
+    def _loop_over_samples(self, method_name, x, y):
+        results = []
+        for sample in self.samples:
+            mass_model = ComposableMassModel(self.coolest, entity_selection=[0])
+            for param_id, value in zip(self.parameter_ids, sample):
+                mass_model.param_list[0][param_id.split('-')[-1]] = value
+            results.append(getattr(mass_model, method_name)(x, y))
+        return results
+
+    def test_evaluate_samples(self):
+        x, y = self.coordinates.pixel_coordinates
+        mass_model = ComposableMassModel(self.coolest, entity_selection=[0])
+        alpha_x, alpha_y = mass_model.evaluate_deflection_samples(x, y, self.samples, self.parameter_ids)
+        kappa = mass_model.evaluate_convergence_samples(x, y, self.samples, self.parameter_ids)
+        mu = mass_model.evaluate_magnification_samples(x, y, self.samples, self.parameter_ids)
+        assert kappa.shape == (len(self.samples),) + x.shape
+        alpha_ref = self._loop_over_samples('evaluate_deflection', x, y)
+        kappa_ref = self._loop_over_samples('evaluate_convergence', x, y)
+        mu_ref = self._loop_over_samples('evaluate_magnification', x, y)
+        for i in range(len(self.samples)):
+            npt.assert_allclose(alpha_x[i], alpha_ref[i][0], rtol=1e-10, atol=1e-10)
+            npt.assert_allclose(alpha_y[i], alpha_ref[i][1], rtol=1e-10, atol=1e-10)
+            npt.assert_allclose(kappa[i], kappa_ref[i], rtol=1e-10, atol=1e-10)
+            npt.assert_allclose(mu[i], mu_ref[i], rtol=1e-10, atol=1e-10)
+
+    def test_evaluate_lensing(self):
+        x, y = self.coordinates.pixel_coordinates
+        mass_model = ComposableMassModel(self.coolest, entity_selection=[0])
+        results = mass_model.evaluate_lensing(x, y, quantities=('alpha', 'kappa', 'magnification'))
+        assert set(results.keys()) == {'alpha', 'kappa', 'magnification'}
+        npt.assert_allclose(results['alpha'], mass_model.evaluate_deflection(x, y), rtol=1e-12)
+        npt.assert_allclose(results['kappa'], mass_model.evaluate_convergence(x, y), rtol=1e-12)
+        npt.assert_allclose(results['magnification'], mass_model.evaluate_magnification(x, y), rtol=1e-12)
+        results = mass_model.evaluate_lensing_samples(x, y, quantities=('kappa', 'potential'), 
+                                                      samples=self.samples, parameter_ids=self.parameter_ids)
+        kappa = mass_model.evaluate_convergence_samples(x, y, self.samples, self.parameter_ids)
+        npt.assert_allclose(results['kappa'], kappa, rtol=1e-12)
+        assert results['potential'].shape == kappa.shape
+
+    def test_evaluate_sparse_coordinates(self):
+        coordinates = util.get_coordinates(self.coolest)
+        x, y = coordinates.pixel_coordinates
+        x_sparse, y_sparse = coordinates.pixel_coordinates_sparse
+        mass_model = ComposableMassModel(self.coolest, entity_selection=[0])
+        for method_name in ('evaluate_deflection', 'evaluate_convergence', 'evaluate_magnification'):
+            npt.assert_allclose(getattr(mass_model, method_name)(x_sparse, y_sparse),
+                                getattr(mass_model, method_name)(x, y), rtol=1e-12)
+        npt.assert_allclose(mass_model.evaluate_deflection(x_sparse, y_sparse, block_size=7),
+                            mass_model.evaluate_deflection(x, y), rtol=1e-12)
+        alpha_x, _ = mass_model.evaluate_deflection_samples(x_sparse, y_sparse, self.samples, self.parameter_ids)
+        alpha_x_ref, _ = mass_model.evaluate_deflection_samples(x, y, self.samples, self.parameter_ids)
+        npt.assert_allclose(alpha_x, alpha_x_ref, rtol=1e-12)
+
+    def test_evaluate_by_blocks(self):
+        x, y = self.coordinates.pixel_coordinates
+        mass_model = ComposableMassModel(self.coolest, entity_selection=[0])
+        results = mass_model.evaluate_lensing(x, y, quantities=('alpha', 'magnification'), block_size=7)
+        results_ref = mass_model.evaluate_lensing(x, y, quantities=('alpha', 'magnification'))
+        npt.assert_array_equal(results['alpha'], results_ref['alpha'])
+        npt.assert_array_equal(results['magnification'], results_ref['magnification'])
+        npt.assert_array_equal(mass_model.evaluate_convergence(x, y, block_size=7), 
+                               mass_model.evaluate_convergence(x, y))
+
+    @pytest.mark.parametrize("block_size", [None, 4])
+    def test_evaluate_threads(self, block_size):
+        x, y = self.coordinates.pixel_coordinates
+        mass_model = ComposableMassModel(self.coolest, entity_selection=[0])
+        mass_model_threads = ComposableMassModel(self.coolest, entity_selection=[0], n_threads=3)
+        alpha_x, alpha_y = mass_model_threads.evaluate_deflection(x, y, block_size=block_size)
+        alpha_x_ref, alpha_y_ref = mass_model.evaluate_deflection(x, y)
+        npt.assert_array_equal(alpha_x, alpha_x_ref)
+        npt.assert_array_equal(alpha_y, alpha_y_ref)
+        npt.assert_array_equal(mass_model_threads.evaluate_magnification(x, y, block_size=block_size), 
+                               mass_model.evaluate_magnification(x, y))
+
+    def test_evaluate_samples_from_chain(self, tmp_path):
+        chain_path = os.path.join(tmp_path, 'chain.csv')
+        header = ','.join(self.parameter_ids + ['probability_weights'])
+        weights = np.ones((len(self.samples), 1))
+        np.savetxt(chain_path, np.hstack([self.samples, weights]),
+                   delimiter=',', header=header, comments='')
+        self.coolest.meta['chain_file_name'] = 'chain.csv'
+        x, y = self.coordinates.pixel_coordinates
+        mass_model = ComposableMassModel(self.coolest, str(tmp_path), entity_selection=[0])
+        kappa = mass_model.evaluate_convergence_samples(x, y)
+        kappa_ref = mass_model.evaluate_convergence_samples(x, y, self.samples, self.parameter_ids)
+        npt.assert_allclose(kappa, kappa_ref, rtol=1e-10)
+        with pytest.raises(ValueError):
+            mass_model.evaluate_convergence_samples(x, y, samples=self.samples)
+
+
+class TestComposableLensModel(object):
+
+    def setup_method(self):
+        self.coolest = _get_coolest_object()
+
+    def test_ray_shooting_cache(self):
+        kwargs_selection = dict(kwargs_selection_source=dict(entity_selection=[1]),
+                                kwargs_selection_lens_mass=dict(entity_selection=[0]))
+        lens_model = ComposableLensModel(self.coolest, ray_shooting_cache_size=2, **kwargs_selection)
+        lens_model_ref = ComposableLensModel(self.coolest, **kwargs_selection)
+        assert lens_model_ref.ray_shooting_cache_info() is None
+        image, _ = lens_model.model_image(supersampling=2, convolved=False)
+        # changing a source parameter only does not require to ray-shoot again
+        lens_model.source.param_list[0]['theta_eff'] *= 2.
+        lens_model_ref.source.param_list[0]['theta_eff'] *= 2.
+        image, _ = lens_model.model_image(supersampling=2, convolved=False)
+        info = lens_model.ray_shooting_cache_info()
+        assert (info.hits, info.misses, info.currsize) == (1, 1, 1)
+        image_ref, _ = lens_model_ref.model_image(supersampling=2, convolved=False)
+        npt.assert_allclose(image, image_ref, rtol=1e-12)
+        # changing a mass parameter invalidates the cached entry
+        lens_model.lens_mass.param_list[0]['theta_E'] *= 1.1
+        lens_model_ref.lens_mass.param_list[0]['theta_E'] *= 1.1
+        image, _ = lens_model.model_image(supersampling=2, convolved=False)
+        image_ref, _ = lens_model_ref.model_image(supersampling=2, convolved=False)
+        npt.assert_allclose(image, image_ref, rtol=1e-12)
+        # least recently used entry is evicted
+        lens_model.model_image(supersampling=3, convolved=False)
+        info = lens_model.ray_shooting_cache_info()
+        assert (info.hits, info.misses, info.currsize) == (1, 3, 2)
+
+    @pytest.mark.parametrize("kwargs_render", [dict(mask=True), dict(block_size=50), dict(n_threads=2)])
+    def test_ray_shooting_cache_paths(self, kwargs_render):
+        # coordinates recreated by the masked, tiled and threaded paths are found in the cache
+        kwargs_selection = dict(kwargs_selection_source=dict(entity_selection=[1]),
+                                kwargs_selection_lens_mass=dict(entity_selection=[0]))
+        kwargs_render = dict(kwargs_render)
+        n_threads = kwargs_render.pop('n_threads', None)
+        lens_model = ComposableLensModel(self.coolest, ray_shooting_cache_size=8, 
+                                         n_threads=n_threads, **kwargs_selection)
+        lens_model_ref = ComposableLensModel(self.coolest, **kwargs_selection)
+        if kwargs_render.pop('mask', False):
+            x, y = util.get_coordinates(self.coolest).pixel_coordinates
+            kwargs_render['mask'] = np.hypot(x, y) < 1.5
+        # the evaluation grid has 200 rows, by default split in one block per thread
+        num_blocks = n_threads or (4 if 'block_size' in kwargs_render else 1)
+        image, _ = lens_model.model_image(supersampling=2, convolved=False, **kwargs_render)
+        lens_model.source.param_list[0]['theta_eff'] *= 2.
+        lens_model_ref.source.param_list[0]['theta_eff'] *= 2.
+        image, _ = lens_model.model_image(supersampling=2, convolved=False, **kwargs_render)
+        info = lens_model.ray_shooting_cache_info()
+        assert (info.hits, info.misses) == (num_blocks, num_blocks)
+        image_ref, _ = lens_model_ref.model_image(supersampling=2, convolved=False, **kwargs_render)
+        npt.assert_allclose(image, image_ref, rtol=1e-12)
+        # the content of the coordinates is part of the key
+        cache = lens_model._ray_shooting_cache
+        x, y = np.ones((2, 3)), np.zeros((2, 3))
+        cache(x, y)
+        cache(x.copy(), y.copy())
+        cache(x + 1., y)
+        assert cache.info().hits == num_blocks + 1
+
+    @pytest.mark.parametrize("supersampling", [1, 3])
+    def test_model_image_tiled(self, supersampling):
+        kwargs_selection = dict(kwargs_selection_source=dict(entity_selection=[1]),
+                                kwargs_selection_lens_mass=dict(entity_selection=[0]))
+        lens_model = ComposableLensModel(self.coolest, **kwargs_selection)
+        image_ref, _ = lens_model.model_image(supersampling=supersampling, convolved=False)
+        for block_size in (1, 16, 1000):
+            image, _ = lens_model.model_image(supersampling=supersampling, convolved=False, 
+                                              block_size=block_size)
+            npt.assert_allclose(image, image_ref, rtol=1e-12)
+
+    def test_model_image_threads(self):
+        kwargs_selection = dict(kwargs_selection_source=dict(entity_selection=[1]),
+                                kwargs_selection_lens_mass=dict(entity_selection=[0]))
+        lens_model = ComposableLensModel(self.coolest, n_threads=4, **kwargs_selection)
+        lens_model_ref = ComposableLensModel(self.coolest, **kwargs_selection)
+        image, _ = lens_model.model_image(supersampling=2, convolved=False)
+        image_ref, _ = lens_model_ref.model_image(supersampling=2, convolved=False)
+        npt.assert_allclose(image, image_ref, rtol=1e-12)
+
+    @pytest.mark.parametrize("source_type,method", [('PixelatedRegularGrid', 'linear'), 
+                                                    ('PixelatedRegularGrid', 'cubic'),
+                                                    ('IrregularGrid', 'linear')])
+    def test_lensing_operator(self, source_type, method, tmp_path):
+        kwargs_selection = dict(kwargs_selection_source=dict(entity_selection=[1]),
+                                kwargs_selection_lens_mass=dict(entity_selection=[0]))
+        lens_model = ComposableLensModel(self.coolest, **kwargs_selection)
+        # replace the source by a pixelated profile
+        x_, y_ = np.linspace(-0.5, 0.5, 15), np.linspace(-0.5, 0.5, 15)
+        x, y = np.meshgrid(x_, y_)
+        if source_type == 'PixelatedRegularGrid':
+            profile = PixelatedRegularGrid([-0.5, 0.5], [-0.5, 0.5], 15, 15, interpolation_method=method)
+            params = {'pixels': np.exp(-(x**2 + y**2) / 0.05)}
+            source = params['pixels']
+        else:
+            rng = np.random.default_rng(0)
+            x, y = rng.uniform(-0.5, 0.5, size=(2, 200))
+            profile = IrregularGrid([-0.5, 0.5], [-0.5, 0.5], 200, interpolation_method=method)
+            params = {'x': x, 'y': y, 'z': np.exp(-(x**2 + y**2) / 0.05)}
+            source = params['z']
+        lens_model.source.profile_list[0] = profile
+        lens_model.source.param_list[0] = params
+        cache_path = str(tmp_path / 'operator.npz')
+        operator = lens_model.get_lensing_operator(supersampling=2, convolved=False, cache_path=cache_path)
+        image_ref, _ = lens_model.model_image(supersampling=2, convolved=False)
+        # outside of the convex hull of an irregular grid, model_image() returns NaNs
+        finite = np.isfinite(image_ref)
+        npt.assert_allclose(operator.model_image(source)[finite], image_ref[finite], atol=1e-12)
+        # the operator is linear in the source pixels
+        npt.assert_allclose(operator.model_image(3. * source), 3. * operator.model_image(source), rtol=1e-12)
+        # read from the disk cache
+        operator_cached = lens_model.get_lensing_operator(supersampling=2, convolved=False, cache_path=cache_path)
+        assert (operator_cached.matrix != operator.matrix).nnz == 0
+        # the cache is not used for a different mass model
+        lens_model.lens_mass.param_list[0]['theta_E'] *= 1.1
+        operator_new = lens_model.get_lensing_operator(supersampling=2, convolved=False, cache_path=cache_path)
+        image_ref, _ = lens_model.model_image(supersampling=2, convolved=False)
+        finite = np.isfinite(image_ref)
+        npt.assert_allclose(operator_new.model_image(source)[finite], image_ref[finite], atol=1e-12)
+
+    @pytest.mark.parametrize("psf_type", ['PixelatedPSF', 'GaussianPSF'])
+    @pytest.mark.parametrize("super_convolution", [True, False])
+    def test_lensing_operator_convolved(self, psf_type, super_convolution, tmp_path):
+        from astropy.io import fits
+        if psf_type == 'PixelatedPSF':
+            # kernel at twice the resolution of the observation
+            positions = np.arange(-4., 5.)
+            kernel = np.exp(- 0.5 * (positions[:, None]**2 + 2. * positions[None, :]**2) / 2.**2)
+            fits.writeto(os.path.join(tmp_path, 'psf.fits'), kernel / kernel.sum())
+            half_size = 4.5 * 0.03
+            self.coolest.instrument.psf = PixelatedPSF(PixelatedRegularGridTemplate(
+                'psf.fits', field_of_view_x=(-half_size, half_size), field_of_view_y=(-half_size, half_size),
+                num_pix_x=9, num_pix_y=9, fits_file_dir=str(tmp_path)))
+        else:
+            self.coolest.instrument.psf = GaussianPSF(fwhm=1.5)
+        kwargs_selection = dict(kwargs_selection_source=dict(entity_selection=[1]),
+                                kwargs_selection_lens_mass=dict(entity_selection=[0]))
+        lens_model = ComposableLensModel(self.coolest, str(tmp_path), **kwargs_selection)
+        x, y = np.meshgrid(np.linspace(-0.5, 0.5, 15), np.linspace(-0.5, 0.5, 15))
+        source = np.exp(-(x**2 + y**2) / 0.05)
+        lens_model.source.profile_list[0] = PixelatedRegularGrid([-0.5, 0.5], [-0.5, 0.5], 15, 15)
+        lens_model.source.param_list[0] = {'pixels': source}
+        # the operator convolves as model_image() with the same settings
+        kwargs_render = dict(supersampling=2, super_convolution=super_convolution)
+        operator = lens_model.get_lensing_operator(**kwargs_render)
+        assert operator.includes_psf is super_convolution
+        image_ref, _ = lens_model.model_image(**kwargs_render)
+        npt.assert_allclose(operator.model_image(source), image_ref, rtol=0., atol=1e-8 * image_ref.max())
+        # the setting is part of the key of the disk cache
+        cache_path = str(tmp_path / 'operator.npz')
+        lens_model.get_lensing_operator(supersampling=2, super_convolution=not super_convolution, 
+                                        cache_path=cache_path)
+        operator_cached = lens_model.get_lensing_operator(cache_path=cache_path, **kwargs_render)
+        assert operator_cached.includes_psf is super_convolution
+        npt.assert_allclose(operator_cached.model_image(source), image_ref, rtol=0., atol=1e-8 * image_ref.max())
+
+    @pytest.mark.parametrize("super_convolution", [True, False])
+    def test_model_image_pixelated_psf(self, super_convolution, tmp_path):
+        from astropy.io import fits
+        from scipy.signal import fftconvolve
+        from coolest.template.classes.noise import UniformGaussianNoise
+        # kernel at twice the resolution of the observation
+        positions = np.arange(-4., 5.)
+        kernel = np.exp(- 0.5 * (positions[:, None]**2 + 2. * positions[None, :]**2) / 2.**2)
+        kernel /= kernel.sum()
+        fits.writeto(os.path.join(tmp_path, 'psf.fits'), kernel)
+        half_size = 4.5 * 0.03
+        self.coolest.instrument.psf = PixelatedPSF(PixelatedRegularGridTemplate(
+            'psf.fits', field_of_view_x=(-half_size, half_size), field_of_view_y=(-half_size, half_size),
+            num_pix_x=9, num_pix_y=9, fits_file_dir=str(tmp_path)))
+        kwargs_selection = dict(kwargs_selection_source=dict(entity_selection=[1]),
+                                kwargs_selection_lens_mass=dict(entity_selection=[0]))
+        lens_model = ComposableLensModel(self.coolest, str(tmp_path), **kwargs_selection)
+        image, _ = lens_model.model_image(supersampling=2, super_convolution=super_convolution)
+        # reference: scipy convolution of the unconvolved supersampled image
+        plan = lens_model.get_render_plan(supersampling=2, convolved=False)
+        image_super = lens_model.evaluate_lensed_surface_brightness(*plan.pixel_coordinates)
+        if super_convolution:
+            image_ref = util.downsampling(fftconvolve(image_super, kernel, mode='same'), 2)
+        else:
+            image_ref = fftconvolve(util.downsampling(image_super, 2), kernel, mode='same')
+        npt.assert_allclose(image, image_ref, rtol=1e-10, atol=1e-12 * image_ref.max())
+        # render plans are reused, and rebuilt when the supersampling or the PSF changes
+        plan = lens_model.get_render_plan(supersampling=2, super_convolution=super_convolution)
+        assert lens_model.get_render_plan(supersampling=2, super_convolution=super_convolution) is plan
+        assert lens_model.get_render_plan(supersampling=4, super_convolution=super_convolution) is not plan
+        # including when the PSF file is overwritten
+        psf_path = os.path.join(tmp_path, 'psf.fits')
+        stat = os.stat(psf_path)
+        fits.writeto(psf_path, kernel[::-1], overwrite=True)
+        # same size, so make sure the modification time differs even with a coarse resolution
+        os.utime(psf_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        plan_flipped = lens_model.get_render_plan(supersampling=2, super_convolution=super_convolution)
+        assert plan_flipped is not plan
+        npt.assert_allclose(plan_flipped._kernel, plan._kernel[::-1])
+        self.coolest.instrument.psf = GaussianPSF(fwhm=2.)
+        plan_gaussian = lens_model.get_render_plan(supersampling=2, super_convolution=super_convolution)
+        assert plan_gaussian is not plan and plan_gaussian._gaussian_sigma is not None
+        self.coolest.instrument.psf = GaussianPSF(fwhm=3.)
+        assert lens_model.get_render_plan(supersampling=2, super_convolution=super_convolution) is not plan_gaussian
+        # residuals: data and noise are read at each call, hence follow changes of the observation
+        data = np.ones(image.shape)
+        fits.writeto(os.path.join(tmp_path, 'data.fits'), data)
+        self.coolest.observation.pixels = PixelatedRegularGridTemplate(
+            'data.fits', field_of_view_x=(-3., 3.), field_of_view_y=(-3., 3.),
+            num_pix_x=100, num_pix_y=100, fits_file_dir=str(tmp_path))
+        model, _ = lens_model.model_image(supersampling=2, convolved=False)
+        for std_dev in (0.1, 0.2):
+            self.coolest.observation.noise = UniformGaussianNoise(std_dev=std_dev)
+            residuals, _ = lens_model.model_residuals(supersampling=2, convolved=False)
+            npt.assert_allclose(residuals, (data - model) / std_dev, rtol=1e-12)
+
+    @pytest.mark.parametrize("fwhm", [0.8, 3.])  # separable and FFT convolutions
+    def test_model_image_gaussian_psf(self, fwhm):
+        from scipy.signal import fftconvolve
+        self.coolest.instrument.psf = GaussianPSF(fwhm=fwhm)
+        kwargs_selection = dict(kwargs_selection_source=dict(entity_selection=[1]),
+                                kwargs_selection_lens_mass=dict(entity_selection=[0]))
+        lens_model = ComposableLensModel(self.coolest, **kwargs_selection)
+        image, _ = lens_model.model_image(supersampling=3)
+        # reference: convolution of the supersampled image with the sampled Gaussian kernel
+        plan = lens_model.get_render_plan(supersampling=3, convolved=False)
+        image_super = lens_model.evaluate_lensed_surface_brightness(*plan.pixel_coordinates)
+        sigma = fwhm / (2. * np.sqrt(2. * np.log(2.))) * 3
+        radius = int(np.ceil(5. * sigma))
+        positions = np.arange(-radius, radius + 1)
+        kernel = np.exp(- 0.5 * (positions[:, None]**2 + positions[None, :]**2) / sigma**2)
+        image_ref = util.downsampling(fftconvolve(image_super, kernel / kernel.sum(), mode='same'), 3)
+        npt.assert_allclose(image, image_ref, rtol=1e-6, atol=1e-6 * image_ref.max())
+        image_tiled, _ = lens_model.model_image(supersampling=3, block_size=30)
+        npt.assert_allclose(image_tiled, image, rtol=1e-6, atol=1e-6 * image_ref.max())
+        # convolution after downsampling
+        image_low, _ = lens_model.model_image(supersampling=3, super_convolution=False)
+        assert image_low.shape == image.shape
+
+    @pytest.mark.parametrize("psf_type,super_convolution", [(None, True),
+                                                            ('PixelatedPSF', True),
+                                                            ('PixelatedPSF', False),
+                                                            ('GaussianPSF', True),
+                                                            ('GaussianPSF', False)])
+    def test_model_image_masked(self, psf_type, super_convolution, tmp_path):
+        from astropy.io import fits
+        convolved = psf_type is not None
+        if psf_type == 'PixelatedPSF':
+            # kernel with an even size, at twice the resolution of the observation
+            positions = np.arange(-4.5, 5.)
+            kernel = np.exp(- 0.5 * (positions[:, None]**2 + 2. * positions[None, :]**2) / 2.**2)
+            fits.writeto(os.path.join(tmp_path, 'psf.fits'), kernel)
+            half_size = 5 * 0.03
+            self.coolest.instrument.psf = PixelatedPSF(PixelatedRegularGridTemplate(
+                'psf.fits', field_of_view_x=(-half_size, half_size), field_of_view_y=(-half_size, half_size),
+                num_pix_x=10, num_pix_y=10, fits_file_dir=str(tmp_path)))
+        elif psf_type == 'GaussianPSF':
+            self.coolest.instrument.psf = GaussianPSF(fwhm=2.)
+        kwargs_selection = dict(kwargs_selection_source=dict(entity_selection=[1]),
+                                kwargs_selection_lens_mass=dict(entity_selection=[0]))
+        lens_model = ComposableLensModel(self.coolest, str(tmp_path), **kwargs_selection)
+        kwargs_render = dict(supersampling=2, convolved=convolved, super_convolution=super_convolution)
+        image_ref, _ = lens_model.model_image(**kwargs_render)
+        x, y = util.get_coordinates(self.coolest).pixel_coordinates
+        mask = (np.hypot(x, y) > 1.) & (np.hypot(x, y) < 1.5)
+        mask[:5, :5] = True  # region at the edge of the image
+        image, _ = lens_model.model_image(mask=mask, **kwargs_render)
+        npt.assert_allclose(image[mask], image_ref[mask], rtol=1e-8, atol=1e-10 * image_ref.max())
+        assert np.all(image[~mask] == 0.)
+        # batched rendering of samples
+        parameter_ids = ['0-galaxy-mass-0-PEMD-theta_E']
+        samples = np.array([[1.2], [1.3]])
+        images_ref = lens_model.model_image_samples(samples, parameter_ids, **kwargs_render)
+        images = lens_model.model_image_samples(samples, parameter_ids, mask=mask, **kwargs_render)
+        npt.assert_allclose(images[:, mask], images_ref[:, mask], rtol=1e-8, atol=1e-10 * image_ref.max())
+        with pytest.raises(ValueError):
+            lens_model.model_image(mask=mask[1:], **kwargs_render)
+
+    def test_model_image_adaptive(self):
+        kwargs_selection = dict(kwargs_selection_source=dict(entity_selection=[1]),
+                                kwargs_selection_lens_mass=dict(entity_selection=[0]))
+        lens_model = ComposableLensModel(self.coolest, **kwargs_selection)
+        image_ref, _ = lens_model.model_image(supersampling=8, convolved=False)
+        tolerance = 1e-3 * image_ref.max()
+        image, coordinates, supersampling_map = lens_model.model_image_adaptive(
+            supersampling_max=8, tolerance=tolerance, convolved=False, return_extra=True)
+        assert coordinates is lens_model.coord_obs
+        npt.assert_allclose(image, image_ref, rtol=0., atol=tolerance)
+        # only a small fraction of the pixels is supersampled
+        assert np.sum(supersampling_map**2) < 0.2 * 8**2 * image.size
+        assert set(np.unique(supersampling_map)) <= {1, 4, 8}
+        # pixels at maximum supersampling are identical to uniform supersampling
+        at_max = supersampling_map == 8
+        npt.assert_allclose(image[at_max], image_ref[at_max], rtol=1e-10)
+        # refinement mask and convolution
+        refinement_mask = np.zeros(image.shape)
+        refinement_mask[:3, :3] = 1
+        _, _, supersampling_map = lens_model.model_image_adaptive(
+            supersampling_max=8, convolved=False, magnification_threshold=None,
+            refinement_mask=refinement_mask, return_extra=True)
+        assert np.all(supersampling_map[:3, :3] >= 4)
+        self.coolest.instrument.psf = GaussianPSF(fwhm=2.)
+        lens_model = ComposableLensModel(self.coolest, **kwargs_selection)
+        image_conv, _ = lens_model.model_image_adaptive(supersampling_max=8, tolerance=tolerance)
+        image_conv_ref, _ = lens_model.model_image(supersampling=8, super_convolution=False)
+        npt.assert_allclose(image_conv, image_conv_ref, rtol=0., atol=tolerance)
+        with pytest.raises(ValueError):
+            lens_model.model_image_adaptive(refinement_mask=refinement_mask[1:])
+
+    @pytest.mark.parametrize("psf_type", [None, 'GaussianPSF'])
+    def test_model_image_single_precision(self, psf_type):
+        # non-isothermal PEMD, evaluated with the series of complex numbers
+        self.coolest.lensing_entities[0].mass_model[0].parameters['gamma'].point_estimate.value = 2.2
+        if psf_type == 'GaussianPSF':
+            self.coolest.instrument.psf = GaussianPSF(fwhm=2.)
+        kwargs_selection = dict(kwargs_selection_source=dict(entity_selection=[1]),
+                                kwargs_selection_lens_mass=dict(entity_selection=[0]))
+        kwargs_render = dict(supersampling=3, convolved=psf_type is not None)
+        image_ref, _ = ComposableLensModel(self.coolest, **kwargs_selection).model_image(**kwargs_render)
+        lens_model = ComposableLensModel(self.coolest, dtype=np.float32, **kwargs_selection)
+        image, _ = lens_model.model_image(**kwargs_render)
+        assert image.dtype == np.float32
+        npt.assert_allclose(image, image_ref, rtol=0., atol=1e-5 * image_ref.max())
+        image_tiled, _ = lens_model.model_image(block_size=30, **kwargs_render)
+        assert image_tiled.dtype == np.float32
+        npt.assert_allclose(image_tiled, image_ref, rtol=0., atol=1e-5 * image_ref.max())
+        parameter_ids = ['0-galaxy-mass-0-PEMD-theta_E']
+        images = lens_model.model_image_samples(np.array([[1.27]]), parameter_ids, **kwargs_render)
+        assert images.dtype == np.float32
+        npt.assert_allclose(images[0], image_ref, rtol=0., atol=1e-5 * image_ref.max())
+        with pytest.raises(ValueError):
+            ComposableLensModel(self.coolest, dtype=np.int32, **kwargs_selection)
@@ -0,0 +1,96 @@
+__author__ = 'aymgal'
+
+
+import pytest
+import os
+import numpy as np
+import numpy.testing as npt
+from astropy.io import fits
+
+from coolest.api.likelihood import ImagingLikelihood
+from coolest.api.composable_models import ComposableLensModel
+from coolest.api import util
+from coolest.template.classes.grid import PixelatedRegularGrid
+from coolest.template.classes.noise import UniformGaussianNoise, NoiseMap, InstrumentalNoise
+from coolest.template.classes.likelihood_list import LikelihoodList
+
+
+KWARGS_SELECTION = dict(kwargs_selection_source=dict(entity_selection=[1]),
+                        kwargs_selection_lens_mass=dict(entity_selection=[0]))
+KWARGS_RENDER = dict(supersampling=2, convolved=False)
+
+
+def _get_coolest_object():
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    coolest_path = os.path.join(current_dir, '_templates', 'pemd_sersic')
+    return util.get_coolest_object(coolest_path, check_external_files=False)
+
+
+def _write_fits(directory, file_name, array):
+    fits.writeto(os.path.join(directory, file_name), array)
+    return PixelatedRegularGrid(file_name, field_of_view_x=(-3., 3.), field_of_view_y=(-3., 3.),
+                                num_pix_x=array.shape[1], num_pix_y=array.shape[0], fits_file_dir=directory)
+
+
+class TestImagingLikelihood(object):
+
+    def setup_method(self):
+        self.coolest = _get_coolest_object()
+        self.model, _ = ComposableLensModel(self.coolest, **KWARGS_SELECTION).model_image(**KWARGS_RENDER)
+        self.noise = 0.1 * np.random.default_rng(0).normal(size=self.model.shape)
+
+    def _set_data(self, directory):
+        self.coolest.observation.pixels = _write_fits(directory, 'data.fits', self.model + self.noise)
+
+    def test_uniform_noise(self, tmp_path):
+        self._set_data(str(tmp_path))
+        self.coolest.observation.noise = UniformGaussianNoise(std_dev=0.1)
+        mask = np.ones(self.model.shape)
+        mask[:10] = 0.
+        likelihood = ImagingLikelihood(self.coolest, str(tmp_path), mask=mask, 
+                                       **KWARGS_RENDER, **KWARGS_SELECTION)
+        chi2_ref = np.sum((self.noise[10:] / 0.1)**2)
+        npt.assert_allclose(likelihood.chi2(), chi2_ref, rtol=1e-10)
+        log_norm = likelihood.num_pixels * np.log(2. * np.pi * 0.1**2)
+        npt.assert_allclose(likelihood.log_likelihood(), -0.5 * (chi2_ref + log_norm), rtol=1e-10)
+        with pytest.raises(ValueError):
+            ImagingLikelihood(self.coolest, str(tmp_path), likelihoods=LikelihoodList('time_delays'))
+        with pytest.raises(NotImplementedError):
+            ImagingLikelihood(self.coolest, str(tmp_path), 
+                              likelihoods=LikelihoodList('imaging_data', 'time_delays'))
+
+    def test_noise_types(self, tmp_path):
+        self._set_data(str(tmp_path))
+        noise_map = np.full(self.model.shape, 0.1)
+        noise_map[0, 0] = 0.2
+        self.coolest.observation.noise = NoiseMap(noise_map=_write_fits(str(tmp_path), 'noise.fits', noise_map))
+        likelihood = ImagingLikelihood(self.coolest, str(tmp_path), **KWARGS_RENDER, **KWARGS_SELECTION)
+        npt.assert_allclose(likelihood.chi2(), np.sum((self.noise / noise_map)**2), rtol=1e-10)
+        # noise that depends on the model flux
+        self.coolest.observation.noise = InstrumentalNoise(with_sky_shot_noise=False)
+        self.coolest.observation.exposure_time = 100.
+        self.coolest.instrument.readout_noise = 5.
+        likelihood = ImagingLikelihood(self.coolest, str(tmp_path), **KWARGS_RENDER, **KWARGS_SELECTION)
+        variance = 5.**2 / 100.**2 + np.maximum(self.model, 0.) / 100.
+        log_likelihood_ref = - 0.5 * np.sum(self.noise**2 / variance + np.log(2. * np.pi * variance))
+        npt.assert_allclose(likelihood.log_likelihood(), log_likelihood_ref, rtol=1e-10)
+        self.coolest.observation.noise = InstrumentalNoise()
+        with pytest.raises(ValueError):
+            ImagingLikelihood(self.coolest, str(tmp_path), **KWARGS_RENDER, **KWARGS_SELECTION)
+
+    def test_samples(self, tmp_path):
+        self._set_data(str(tmp_path))
+        self.coolest.observation.noise = UniformGaussianNoise(std_dev=0.1)
+        likelihood = ImagingLikelihood(self.coolest, str(tmp_path), **KWARGS_RENDER, **KWARGS_SELECTION)
+        parameter_ids = ['0-galaxy-mass-0-PEMD-theta_E', '1-galaxy-light-0-Sersic-I_eff']
+        samples = np.array([[1.2, 1.], [1.27, 2.], [1.3, 0.5]])
+        log_likelihood = likelihood.log_likelihood_samples(samples, parameter_ids, batch_size=2)
+        chi2 = likelihood.chi2_samples(samples, parameter_ids)
+        assert log_likelihood.shape == chi2.shape == (len(samples),)
+        for i, (theta_E, I_eff) in enumerate(samples):
+            lens_model = ComposableLensModel(self.coolest, **KWARGS_SELECTION)
+            lens_model.lens_mass.param_list[0]['theta_E'] = theta_E
+            lens_model.source.param_list[0]['I_eff'] = I_eff
+            model, _ = lens_model.model_image(**KWARGS_RENDER)
+            npt.assert_allclose(log_likelihood[i], likelihood.log_likelihood(model), rtol=1e-10)
+            npt.assert_allclose(chi2[i], likelihood.chi2(model), rtol=1e-10)
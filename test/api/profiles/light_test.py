@@ -3,8 +3,9 @@ __author__ = 'lynevdv'
 import pytest
 import numpy as np
 import numpy.testing as npt
+from scipy.interpolate import griddata
 
-from coolest.api.profiles.light import Sersic
+from coolest.api.profiles.light import Sersic, PixelatedRegularGrid, IrregularGrid
 
 from lenstronomy.Util import param_util
 from lenstronomy.LightModel.light_model import LightModel
@@ -47,3 +48,64 @@ class TestSersic(object):
 
         # compare
         npt.assert_almost_equal(result, result_ref, decimal=8)
+
+
+class TestPixelatedRegularGrid(object):
+
+    def setup_method(self):
+        self.profile = PixelatedRegularGrid([-1., 1.], [-1., 1.], 20, 20)
+        x_, y_ = self.profile.get_coordinates().pixel_axes
+        x, y = np.meshgrid(x_, y_)
+        self.pixels = np.exp(-(x**2 + 2*y**2) / 0.3) + 0.1 * np.sin(3*x)
+
+    def test_interpolation_at_pixels(self):
+        # with prefiltered splines the interpolant goes through the pixel values
+        x, y = self.profile.get_coordinates().pixel_coordinates
+        result = self.profile.evaluate_surface_brightness(x, y, pixels=self.pixels)
+        npt.assert_allclose(result, self.pixels, atol=1e-10)
+        # same with broadcastable coordinates
+        x, y = self.profile.get_coordinates().pixel_coordinates_sparse
+        result = self.profile.evaluate_surface_brightness(x, y, pixels=self.pixels)
+        npt.assert_allclose(result, self.pixels, atol=1e-10)
+
+    def test_interpolator_cache(self):
+        x, y = np.meshgrid(np.linspace(-0.8, 0.7, 13), np.linspace(-0.6, 0.9, 11))
+        interp = self.profile.get_interpolator(self.pixels)
+        assert self.profile.get_interpolator(self.pixels) is interp
+        assert self.profile.get_interpolator(self.pixels.copy()) is interp
+        result = self.profile.evaluate_surface_brightness(x, y, pixels=self.pixels)
+        # an in-place change of the pixel values invalidates the cache
+        self.pixels *= 2.
+        assert self.profile.get_interpolator(self.pixels) is not interp
+        result_new = self.profile.evaluate_surface_brightness(x, y, pixels=self.pixels)
+        npt.assert_allclose(result_new, 2. * result, rtol=1e-12)
+
+
+class TestIrregularGrid(object):
+
+    def setup_method(self):
+        rng = np.random.default_rng(0)
+        self.x, self.y = rng.uniform(-1., 1., size=(2, 300))
+        self.z = np.sin(3*self.x) * np.cos(2*self.y)
+        self.x_eval, self.y_eval = np.meshgrid(np.linspace(-1.1, 1.1, 15), np.linspace(-1.1, 1.1, 17))
+
+    @pytest.mark.parametrize("method", ['linear', 'cubic', 'nearest'])
+    def test_surface_brightness(self, method):
+        profile = IrregularGrid([-1., 1.], [-1., 1.], len(self.z), interpolation_method=method)
+        for factor in (1., 2.):
+            result = profile.evaluate_surface_brightness(self.x_eval, self.y_eval, 
+                                                         x=self.x, y=self.y, z=factor*self.z)
+            result_ref = griddata((self.x, self.y), factor*self.z, (self.x_eval, self.y_eval), method=method)
+            npt.assert_allclose(result, result_ref, rtol=1e-10, atol=1e-12, equal_nan=True)
+
+    def test_triangulation_cache(self):
+        profile = IrregularGrid([-1., 1.], [-1., 1.], len(self.z), interpolation_method='linear')
+        tri = profile.get_triangulation(self.x, self.y)
+        assert profile.get_triangulation(self.x.copy(), self.y.copy()) is tri
+        profile.evaluate_surface_brightness(self.x_eval, self.y_eval, x=self.x, y=self.y, z=self.z)
+        # moving the points invalidates the cache
+        self.x[0] += 0.01
+        assert profile.get_triangulation(self.x, self.y) is not tri
+        result = profile.evaluate_surface_brightness(self.x_eval, self.y_eval, x=self.x, y=self.y, z=self.z)
+        result_ref = griddata((self.x, self.y), self.z, (self.x_eval, self.y_eval), method='linear')
+        npt.assert_allclose(result, result_ref, rtol=1e-10, atol=1e-12, equal_nan=True)
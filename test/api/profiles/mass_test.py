@@ -5,12 +5,60 @@ import pytest
 import numpy as np
 import numpy.testing as npt
 
-from coolest.api.profiles.mass import PEMD, ExternalShear
+from coolest.api.profiles.mass import SIE, NIE, PEMD, ExternalShear
 
 from lenstronomy.Util import param_util
 from lenstronomy.LensModel.lens_model import LensModel
 
 
+class TestSIE(object):
+
+    @pytest.mark.parametrize("q", [1., 0.8, 0.4])
+    def test_deflection_hessian(self, q):
+        x, y = np.meshgrid(np.linspace(-0.4, 0.2, 10), np.linspace(-0.3, 0.5, 10))
+        kwargs = dict(theta_E=1.1, phi=22., q=q, center_x=0.1, center_y=-0.15)
+        # compare to the generic PEMD implementation
+        pemd = PEMD(deflection_method='hyp2f1')
+        npt.assert_allclose(SIE().deflection(x, y, **kwargs), 
+                            pemd.deflection(x, y, gamma=2., **kwargs), rtol=1e-10, atol=1e-12)
+        npt.assert_allclose(SIE().hessian(x, y, **kwargs), 
+                            pemd.hessian(x, y, gamma=2., **kwargs), rtol=1e-10, atol=1e-12)
+        npt.assert_allclose(SIE().convergence(x, y, **kwargs), 
+                            pemd.convergence(x, y, gamma=2., **kwargs), rtol=1e-10)
+        # PEMD with gamma = 2 uses the same expressions
+        npt.assert_allclose(PEMD().deflection(x, y, gamma=2., **kwargs), 
+                            pemd.deflection(x, y, gamma=2., **kwargs), rtol=1e-10, atol=1e-12)
+        npt.assert_allclose(PEMD().hessian(x, y, gamma=2., **kwargs), 
+                            pemd.hessian(x, y, gamma=2., **kwargs), rtol=1e-10, atol=1e-12)
+
+
+class TestNIE(object):
+
+    def test_deflection(self):
+        x, y = np.meshgrid(np.linspace(-0.4, 0.2, 10), np.linspace(-0.3, 0.5, 10))
+        theta_E, r_core, q, phi = 1.1, 0.2, 0.7, 22.
+        center_x, center_y = 0.1, -0.15
+        kwargs = dict(theta_E=theta_E, r_core=r_core, phi=phi, q=q, center_x=center_x, center_y=center_y)
+        alpha_x, alpha_y = NIE().deflection(x, y, **kwargs)
+        # reference
+        ref = LensModel(['NIE'])
+        e1, e2 = param_util.phi_q2_ellipticity((phi-90.)*np.pi/180., q)
+        kwargs_ref = {'theta_E': theta_E, 's_scale': r_core, 'e1': e1, 'e2': e2,
+                      'center_x': center_x, 'center_y': center_y}
+        alpha_x_ref, alpha_y_ref = ref.alpha(x, y, [kwargs_ref])
+        npt.assert_almost_equal(alpha_x, alpha_x_ref, decimal=8)
+        npt.assert_almost_equal(alpha_y, alpha_y_ref, decimal=8)
+        npt.assert_almost_equal(NIE().potential(x, y, **kwargs), 
+                                ref.potential(x, y, [kwargs_ref]), decimal=8)
+        # lenstronomy computes the hessian with finite differences
+        H_xx, H_xy, _, H_yy = NIE().hessian(x, y, **kwargs)
+        H_xx_ref, H_xy_ref, _, H_yy_ref = ref.hessian(x, y, [kwargs_ref])
+        npt.assert_almost_equal(H_xx, H_xx_ref, decimal=4)
+        npt.assert_almost_equal(H_xy, H_xy_ref, decimal=4)
+        npt.assert_almost_equal(H_yy, H_yy_ref, decimal=4)
+        npt.assert_allclose(NIE().convergence(x, y, **kwargs), (H_xx + H_yy) / 2., rtol=1e-10)
+
+
 class TestPEMD(object):
 
     def test_deflection(self):
@@ -50,6 +98,18 @@ class TestPEMD(object):
         npt.assert_almost_equal(alpha_y, alpha_y_ref, decimal=8)
 
 
+    @pytest.mark.parametrize("q", [0.95, 0.6, 0.2])
+    @pytest.mark.parametrize("gamma", [1.7, 2., 2.3])
+    def test_deflection_series(self, q, gamma):
+        x, y = np.meshgrid(np.linspace(-2, 2, 20), np.linspace(-2, 2, 20))
+        kwargs = dict(theta_E=1.1, gamma=gamma, phi=22., q=q, center_x=0.1, center_y=-0.15)
+        alpha_x, alpha_y = PEMD(deflection_method='series').deflection(x, y, **kwargs)
+        alpha_x_ref, alpha_y_ref = PEMD(deflection_method='hyp2f1').deflection(x, y, **kwargs)
+        npt.assert_allclose(alpha_x, alpha_x_ref, rtol=1e-10, atol=1e-10)
+        npt.assert_allclose(alpha_y, alpha_y_ref, rtol=1e-10, atol=1e-10)
+        with pytest.raises(ValueError):
+            PEMD(deflection_method='unknown')
+
     def test_hessian(self):
         # define some coordinates grid
         n_points = 10
@@ -124,6 +184,38 @@ class TestPEMD(object):
         npt.assert_almost_equal(result, result_ref, decimal=8)
 
 
+    def test_potential(self):
+        x, y = np.meshgrid(np.linspace(-0.4, 0.2, 10), np.linspace(-0.3, 0.5, 10))
+        theta_E, gamma, q, phi = 1.1, 1.9, 0.8, 22.
+        center_x, center_y = 0.1, -0.15
+        result = PEMD().potential(x, y,
+                                  theta_E=theta_E, gamma=gamma, phi=phi, q=q,
+                                  center_x=center_x, center_y=center_y)
+        ref = LensModel(['EPL'])
+        e1, e2 = param_util.phi_q2_ellipticity((phi-90.)*np.pi/180., q)
+        kwargs = {'gamma': gamma, 'theta_E': theta_E, 'e1': e1, 'e2': e2,
+                  'center_x': center_x, 'center_y': center_y}
+        result_ref = ref.potential(x, y, [kwargs])
+        npt.assert_almost_equal(result, result_ref, decimal=8)
+
+    def test_evaluate_lensing(self):
+        x, y = np.meshgrid(np.linspace(-0.4, 0.2, 10), np.linspace(-0.3, 0.5, 10))
+        kwargs = dict(theta_E=1.1, gamma=1.9, phi=22., q=0.8, center_x=0.1, center_y=-0.15)
+        profile = PEMD()
+        results = profile.evaluate_lensing(x, y, quantities=('alpha', 'kappa', 'shear', 'hessian', 
+                                                             'magnification', 'potential'), **kwargs)
+        H_xx, H_xy, H_yx, H_yy = profile.hessian(x, y, **kwargs)
+        npt.assert_allclose(results['alpha'], profile.deflection(x, y, **kwargs), rtol=1e-12)
+        npt.assert_allclose(results['kappa'], profile.convergence(x, y, **kwargs), rtol=1e-12)
+        npt.assert_allclose(results['shear'], ((H_xx - H_yy) / 2., H_xy), rtol=1e-12)
+        npt.assert_allclose(results['hessian'], (H_xx, H_xy, H_yx, H_yy), rtol=1e-12)
+        npt.assert_allclose(results['magnification'], 1. / ((1 - H_xx) * (1 - H_yy) - H_xy*H_yx), rtol=1e-12)
+        npt.assert_allclose(results['potential'], profile.potential(x, y, **kwargs), rtol=1e-12)
+        assert list(profile.evaluate_lensing(x, y, quantities='kappa', **kwargs).keys()) == ['kappa']
+        with pytest.raises(ValueError):
+            profile.evaluate_lensing(x, y, quantities=('time_delay',), **kwargs)
+
+
 
 class TestExternalShear(object):
 
@@ -155,3 +247,13 @@ class TestExternalShear(object):
         # compare
         npt.assert_almost_equal(alpha_x, alpha_x_ref, decimal=8)
         npt.assert_almost_equal(alpha_y, alpha_y_ref, decimal=8)
+
+    def test_potential(self):
+        x, y = np.meshgrid(np.linspace(-0.4, 0.2, 10), np.linspace(-0.3, 0.5, 10))
+        phi_ext, gamma_ext = 22., 0.08
+        result = ExternalShear().potential(x, y, phi_ext=phi_ext, gamma_ext=gamma_ext)
+        ref = LensModel(['SHEAR_GAMMA_PSI'])
+        kwargs = {'gamma_ext': gamma_ext, 'psi_ext': (phi_ext-90.)*np.pi/180., 
+                  'ra_0': 0., 'dec_0': 0.}
+        result_ref = ref.potential(x, y, [kwargs])
+        npt.assert_almost_equal(result, result_ref, decimal=8)
@@ -0,0 +1,128 @@
+__author__ = 'aymgal'
+
+
+import pytest
+import os
+import numpy as np
+import numpy.testing as npt
+
+from coolest.api.composable_models import ComposableLensModel
+from coolest.api.source_inversion import SourceInversion, regularization_matrices, convolution_matrix
+from coolest.api.profiles.light import PixelatedRegularGrid, IrregularGrid
+from coolest.api import util
+
+
+def _get_lens_model(source_type, method):
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    coolest_path = os.path.join(current_dir, '_templates', 'pemd_sersic')
+    coolest = util.get_coolest_object(coolest_path, check_external_files=False)
+    lens_model = ComposableLensModel(coolest, 
+                                     kwargs_selection_source=dict(entity_selection=[1]),
+                                     kwargs_selection_lens_mass=dict(entity_selection=[0]))
+    # replace the source by a pixelated profile
+    if source_type == 'PixelatedRegularGrid':
+        profile = PixelatedRegularGrid([-0.5, 0.5], [-0.5, 0.5], 12, 12, interpolation_method=method)
+        x, y = profile.get_coordinates().pixel_coordinates
+        params = {'pixels': np.exp(-(x**2 + y**2) / 0.05)}
+    else:
+        rng = np.random.default_rng(0)
+        x, y = rng.uniform(-0.5, 0.5, size=(2, 150))
+        profile = IrregularGrid([-0.5, 0.5], [-0.5, 0.5], 150, interpolation_method=method)
+        params = {'x': x, 'y': y, 'z': np.exp(-(x**2 + y**2) / 0.05)}
+    lens_model.source.profile_list[0] = profile
+    lens_model.source.param_list[0] = params
+    return lens_model, params
+
+
+class TestSourceInversion(object):
+
+    @pytest.mark.parametrize("source_type,method", [('PixelatedRegularGrid', 'linear'), 
+                                                    ('PixelatedRegularGrid', 'cubic'),
+                                                    ('IrregularGrid', 'linear')])
+    def test_noiseless_reconstruction(self, source_type, method, monkeypatch):
+        lens_model, params = _get_lens_model(source_type, method)
+        source = params['pixels'] if source_type == 'PixelatedRegularGrid' else params['z']
+        operator = lens_model.get_lensing_operator(supersampling=2, convolved=False)
+        data = operator.model_image(source)
+        # data and noise are not available in the template, so they are set directly
+        monkeypatch.setattr(lens_model, '_get_data_and_noise', 
+                            lambda model=None: (data, np.full_like(data, 0.01)))
+        inversion = SourceInversion(lens_model, [('PixelCurvature', {'lambda': 1e-6})], 
+                                    supersampling=2, convolved=False)
+        source_rec = inversion.solve()
+        assert source_rec.shape == source.shape
+        npt.assert_allclose(inversion.model_image(source_rec), data, atol=1e-5)
+
+    def test_solvers_and_strengths(self, monkeypatch):
+        lens_model, params = _get_lens_model('PixelatedRegularGrid', 'linear')
+        operator = lens_model.get_lensing_operator(supersampling=2, convolved=False)
+        data = operator.model_image(params['pixels'])
+        noise = 0.05 * np.random.default_rng(1).normal(size=data.shape)
+        # data and noise are not available in the template, so they are set directly
+        monkeypatch.setattr(lens_model, '_get_data_and_noise', 
+                            lambda model=None: (data + noise, np.full_like(data, 0.05)))
+        regularizations = [('PixelGradient', {'lambda': 10.}), ('PixelStarlet', {'lambda_hf': 1., 'lambda': 1.})]
+        inversion_dense = SourceInversion(lens_model, regularizations, supersampling=2, convolved=False)
+        inversion_cg = SourceInversion(lens_model, regularizations, supersampling=2, convolved=False, 
+                                       dense=False, solver='cg')
+        assert inversion_dense.dense and not inversion_cg.dense
+        for strength in (10., 1000.):
+            strengths = [{'lambda': strength}, None]
+            npt.assert_allclose(inversion_cg.solve(strengths), inversion_dense.solve(strengths), 
+                                rtol=1e-6, atol=1e-8)
+        # a stronger gradient regularization gives a smoother source
+        source_weak = inversion_dense.solve([{'lambda': 1.}, None])
+        source_strong = inversion_dense.solve([{'lambda': 1e4}, None])
+        assert np.abs(np.diff(source_strong, axis=0)).sum() < np.abs(np.diff(source_weak, axis=0)).sum()
+        with pytest.raises(ValueError):
+            SourceInversion(lens_model, [('PixelRidge', {})], supersampling=2, convolved=False).solve()
+        with pytest.raises(ValueError):
+            SourceInversion(lens_model, regularizations, supersampling=2, convolved=False, 
+                            dense=False, solver='cholesky')
+        with pytest.raises(NotImplementedError):
+            SourceInversion(lens_model, [('PixelLasso', {'lambda': 1.})], supersampling=2, convolved=False)
+
+
+def test_regularization_matrices():
+    profile = PixelatedRegularGrid([-0.5, 0.5], [-0.5, 0.5], 8, 8)
+    params = {'pixels': np.zeros((8, 8))}
+    constant = np.ones(64)
+    for regul_type in ('PixelGradient', 'PixelCurvature'):
+        H = regularization_matrices(regul_type, profile, params)['lambda']
+        npt.assert_allclose(H @ constant, 0., atol=1e-12)  # constant source is not penalized
+    H = regularization_matrices('PixelGaussianKernel', profile, params)['lambda']
+    npt.assert_allclose(H.toarray(), H.toarray().T, atol=1e-8)
+    # starlet operators are symmetric, with consistent diagonals, and do not penalize a constant source
+    for H in regularization_matrices('PixelStarlet', profile, params).values():
+        H_dense = H @ np.identity(64)
+        npt.assert_allclose(H_dense, H_dense.T, atol=1e-12)
+        npt.assert_allclose(H.diagonal(), np.diag(H_dense), atol=1e-12)
+        npt.assert_allclose(H @ constant, 0., atol=1e-12)
+    # memory of the regularizations does not scale with the square of the number of pixels
+    profile = PixelatedRegularGrid([-0.5, 0.5], [-0.5, 0.5], 48, 48)
+    params = {'pixels': np.zeros((48, 48))}
+    for regul_type in ('PixelGradient', 'PixelCurvature'):
+        H = regularization_matrices(regul_type, profile, params)['lambda']
+        assert H.nnz < 15 * 48**2
+    for H in regularization_matrices('PixelStarlet', profile, params).values():
+        assert sum(P.size + Q.size for _, P, Q in H.terms) < 50 * 48**2  # instead of 48**4
+    profile = PixelatedRegularGrid([-0.5, 0.5], [-0.5, 0.5], 70, 70)
+    params = {'pixels': np.zeros((70, 70))}
+    with pytest.raises(ValueError):
+        regularization_matrices('PixelExponentialKernel', profile, params)
+
+
+def test_convolution_matrix():
+    from scipy.signal import fftconvolve
+    rng = np.random.default_rng(2)
+    image, kernel = rng.normal(size=(10, 13)), rng.uniform(size=(5, 4))
+    result = (convolution_matrix(kernel, image.shape) @ image.ravel()).reshape(image.shape)
+    npt.assert_allclose(result, fftconvolve(image, kernel, mode='same'), atol=1e-12)
+
+
+def test_cg_tolerance_keyword():
+    # the keyword of the relative tolerance has been renamed in scipy 1.12
+    import inspect
+    from scipy.sparse import linalg as sparse_linalg
+    from coolest.api.source_inversion import _CG_TOLERANCE
+    assert set(_CG_TOLERANCE) <= set(inspect.signature(sparse_linalg.cg).parameters)
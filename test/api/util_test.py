@@ -1,6 +1,8 @@
 __author__ = 'aymgal'
 
 
+import os
+import shutil
 import pytest
 import numpy as np
 import numpy.testing as npt
@@ -22,3 +24,85 @@ def test_get_coordinates_from_regular_grid(field_of_view_x, field_of_view_y, num
     retrieved_field_of_view_y = [plt_extent[2], plt_extent[3]]
     npt.assert_allclose(retrieved_field_of_view_y, field_of_view_y, atol=1e-8)
     npt.assert_allclose(coordinates.center, (np.mean(field_of_view_x), np.mean(field_of_view_y)), atol=1e-8)
+
+
+@pytest.mark.parametrize("num_pix_x", [10, 11])
+@pytest.mark.parametrize("num_pix_y", [10, 11])
+@pytest.mark.parametrize("block_size", [1, 3, 20])
+def test_coordinates_row_blocks(num_pix_x, num_pix_y, block_size):
+    # tests that blocks of rows are consistent with the full coordinates grid
+    coordinates = util.get_coordinates_from_regular_grid([-1., 1.], [-2., 0.], num_pix_x, num_pix_y)
+    x, y = coordinates.pixel_coordinates
+    assert x.shape == coordinates.array_shape
+    blocks = list(coordinates.iterate_row_blocks(block_size))
+    npt.assert_array_equal(np.concatenate([block[2] for block in blocks]), x)
+    npt.assert_array_equal(np.concatenate([block[3] for block in blocks]), y)
+    for row_start, row_stop, x_block, _ in blocks:
+        npt.assert_array_equal(x_block, x[row_start:row_stop])
+
+
+@pytest.mark.parametrize("num_pix_x", [10, 11])
+@pytest.mark.parametrize("num_pix_y", [10, 11])
+def test_coordinates_cached_and_hashable(num_pix_x, num_pix_y):
+    coordinates = util.get_coordinates_from_regular_grid([-1., 1.], [-2., 0.], num_pix_x, num_pix_y)
+    x, y = coordinates.pixel_coordinates
+    # arrays are built once and cannot be modified
+    assert coordinates.pixel_coordinates[0] is x
+    with pytest.raises(ValueError):
+        x[0, 0] = 0.
+    # 1D axes are consistent with the 2D arrays
+    assert coordinates.is_axis_aligned
+    x_axis, y_axis = coordinates.pixel_axes
+    npt.assert_array_equal(x_axis, x[0, :])
+    npt.assert_array_equal(y_axis, y[:, 0])
+    # coordinates are immutable and can be used as dictionary keys
+    with pytest.raises(AttributeError):
+        coordinates._nx = 2
+    same = util.get_coordinates_from_regular_grid([-1., 1.], [-2., 0.], num_pix_x, num_pix_y)
+    other = coordinates.create_new_coordinates(pixel_scale_factor=0.5)
+    assert same == coordinates and hash(same) == hash(coordinates)
+    assert other != coordinates
+    assert len({coordinates: 0, same: 1, other: 2}) == 2
+    # broadcastable coordinates are only available for separable grids
+    assert coordinates.is_separable == (num_pix_x == num_pix_y)
+    if coordinates.is_separable:
+        x_sparse, y_sparse = coordinates.pixel_coordinates_sparse
+        assert x_sparse.shape == (1, num_pix_y) and y_sparse.shape == (num_pix_x, 1)
+        npt.assert_array_equal(np.broadcast_to(x_sparse, x.shape), x)
+        npt.assert_array_equal(np.broadcast_to(y_sparse, y.shape), y)
+    else:
+        # the rows of the 2D arrays of non-square grids span several rows of the grid
+        assert np.ptp(x, axis=0).max() > 0. and np.ptp(y, axis=1).max() > 0.
+        with pytest.raises(ValueError, match="not square"):
+            coordinates.pixel_coordinates_sparse
+
+
+def test_downsampling_leading_axes():
+    images = np.random.default_rng(0).normal(size=(3, 12, 8))
+    down = util.downsampling(images, factor=4)
+    assert down.shape == (3, 3, 2)
+    for image, image_down in zip(images, down):
+        npt.assert_array_equal(util.downsampling(image, factor=4), image_down)
+
+
+def test_get_coolest_objects(tmp_path):
+    # tests that templates are loaded concurrently and errors are collected
+    template = os.path.join(os.path.dirname(__file__), '_templates', 'pemd_sersic.json')
+    for i in range(3):
+        shutil.copy(template, os.path.join(tmp_path, f'lens_{i}.json'))
+    with open(os.path.join(tmp_path, 'lens_3.json'), 'w') as f:
+        f.write('{')
+    objects, errors = util.get_coolest_objects(os.path.join(tmp_path, 'lens_*.json'),
+                                               max_workers=2, check_external_files=False)
+    paths = [os.path.join(tmp_path, f'lens_{i}') for i in range(4)]
+    assert list(objects.keys()) == paths[:3]
+    assert list(errors.keys()) == paths[3:]
+    assert isinstance(errors[paths[3]], ValueError)
+    reference = util.get_coolest_object(paths[0], check_external_files=False)
+    for coolest_object in objects.values():
+        assert coolest_object.lensing_entities[0].name == reference.lensing_entities[0].name
+    # paths without extension, and missing files
+    objects, errors = util.get_coolest_objects([paths[1], paths[1] + '.json', str(tmp_path) + '/missing'],
+                                               check_external_files=False)
+    assert list(objects.keys()) == [paths[1]]
+    assert isinstance(errors[str(tmp_path) + '/missing'], FileNotFoundError)
@@ -0,0 +1,16 @@
+__author__ = 'aymgal'
+
+
+import astropy.units as u
+
+from coolest.template.classes.coordinates import CoordinatesOrigin
+
+
+def test_coordinates_origin():
+    origin = CoordinatesOrigin('00h11m20.244s', '-08d45m51.48s')
+    assert (origin.ra, origin.dec) == ('00h11m20.244s', '-08d45m51.48s')
+    # the check of hashable coordinates is cached
+    assert CoordinatesOrigin('00h11m20.244s', '-08d45m51.48s').ra == origin.ra
+    # astropy quantities are not hashable
+    origin_deg = CoordinatesOrigin(2.83435 * u.deg, -8.7643 * u.deg)
+    assert (origin_deg.ra, origin_deg.dec) == (origin.ra, origin.dec)
@@ -0,0 +1,149 @@
+__author__ = 'aymgal'
+
+
+import os
+import mmap
+import pytest
+import numpy as np
+import numpy.testing as npt
+from concurrent.futures import ThreadPoolExecutor
+from astropy.io import fits
+
+from coolest.template.classes.fits_file import FitsFile, FitsCache
+from coolest.template.classes.grid import PixelatedRegularGrid, IrregularGrid
+
+
+def _write(directory, file_name, array):
+    path = os.path.join(directory, file_name)
+    fits.writeto(path, array, overwrite=True)
+    return path
+
+
+class TestFitsCache(object):
+
+    def test_hits_and_invalidation(self, tmp_path):
+        cache = FitsCache()
+        array = np.arange(16.).reshape(4, 4)
+        path = _write(tmp_path, 'image.fits', array)
+        data, header = cache.read(path)
+        npt.assert_array_equal(data, array)
+        assert header['NAXIS'] == 2
+        data_cached, _ = cache.read(path)
+        assert data_cached is data
+        assert not data.flags.writeable
+        info = cache.info()
+        assert (info.hits, info.misses, info.currsize, info.current_bytes) == (1, 1, 1, array.nbytes)
+        # modifying the file invalidates the entry
+        _write(tmp_path, 'image.fits', np.ones((2, 3)))
+        data, _ = cache.read(path)
+        assert data.shape == (2, 3)
+        assert cache.info().misses == 2
+
+    def test_byte_budget(self, tmp_path):
+        array = np.zeros((10, 10))
+        cache = FitsCache(max_bytes=2 * array.nbytes)
+        paths = [_write(tmp_path, f'image_{i}.fits', array + i) for i in range(3)]
+        for path in paths:
+            cache.read(path)
+        info = cache.info()
+        assert (info.currsize, info.current_bytes, info.evicted_bytes) == (2, 2 * array.nbytes, array.nbytes)
+        # least recently used entry has been evicted
+        cache.read(paths[0])
+        assert cache.info().misses == 4
+        cache.resize(array.nbytes // 2)
+        assert cache.info().currsize == 0
+        # files larger than the budget are not cached
+        cache.read(paths[1])
+        assert cache.info().currsize == 0
+        cache.clear()
+        assert cache.info() == (0, 0, 0, array.nbytes // 2, 0, 0)
+
+    def test_column_ranges(self, tmp_path):
+        x, y = np.linspace(-1., 2., 5), np.linspace(-3., 0.5, 5)
+        path = os.path.join(tmp_path, 'table.fits')
+        fits.BinTableHDU.from_columns([fits.Column(name='x', array=x, format='D'), 
+                                       fits.Column(name='y', array=y, format='D')]).writeto(path)
+        cache = FitsCache(max_bytes=2 * 2 * 8)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda _: cache.column_ranges(path, 2), range(8)))
+        for ranges in results:
+            assert ranges == [(-1., 2.), (-3., 0.5)]
+        info = cache.info()
+        assert (info.currsize, info.current_bytes, info.hits + info.misses) == (1, 2 * 2 * 8, 8)
+        # ranges share the byte budget and eviction of the cache
+        cache.column_ranges(path, 1)
+        info = cache.info()
+        assert (info.currsize, info.current_bytes, info.evicted_bytes) == (1, 2 * 8, 2 * 2 * 8)
+        cache.clear()
+        assert cache.info().currsize == 0
+
+    def test_fits_file(self, tmp_path):
+        FitsFile.cache.clear()
+        array = np.arange(6.).reshape(2, 3)
+        _write(tmp_path, 'image.fits', array)
+        fits_file = FitsFile('image.fits', directory=str(tmp_path))
+        for _ in range(3):
+            data, _ = fits_file.read()
+            npt.assert_array_equal(data, array)
+        with pytest.raises(ValueError):
+            data[0, 0] = 1.
+        info = FitsFile.cache.info()
+        assert (info.hits, info.misses) == (2, 1)
+        FitsFile.cache.clear()
+
+
+def _is_memory_mapped(array):
+    base = array
+    while base is not None:
+        if isinstance(base, mmap.mmap):
+            return True
+        base = getattr(base, 'base', None)
+    return False
+
+
+class TestMemoryMapping(object):
+
+    def test_image(self, tmp_path):
+        FitsFile.cache.clear()
+        array = np.arange(12.).reshape(3, 4)
+        _write(tmp_path, 'image.fits', array)
+        grid = PixelatedRegularGrid('image.fits', fits_file_dir=str(tmp_path))
+        pixels = grid.get_pixels(memmap=True)
+        npt.assert_array_equal(pixels, array)
+        assert _is_memory_mapped(pixels)
+        assert not pixels.flags.writeable
+        assert FitsFile.cache.info().misses == 0
+        pixels_copy = grid.get_pixels()
+        assert not _is_memory_mapped(pixels_copy)
+        FitsFile.cache.clear()
+
+    @pytest.mark.parametrize("hdu_type", ['scaled', 'compressed'])
+    def test_fallback(self, tmp_path, hdu_type):
+        FitsFile.cache.clear()
+        array = np.arange(12, dtype=np.uint16).reshape(3, 4)
+        path = os.path.join(tmp_path, 'image.fits')
+        if hdu_type == 'scaled':
+            # unsigned integers are stored with BZERO = 32768
+            fits.writeto(path, array)
+        else:
+            fits.HDUList([fits.PrimaryHDU(), fits.CompImageHDU(array.astype(np.float32))]).writeto(path)
+        pixels, _ = FitsFile('image.fits', directory=str(tmp_path)).read(memmap=True)
+        npt.assert_array_equal(pixels, array)
+        assert not pixels.flags.writeable
+        assert FitsFile.cache.info().misses == 1
+        FitsFile.cache.clear()
+
+    def test_table(self, tmp_path):
+        FitsFile.cache.clear()
+        x, y, z = np.linspace(-1, 1, 5), np.linspace(0, 1, 5), np.arange(5.)
+        columns = [fits.Column(name=name, array=values, format='D')
+                   for name, values in zip(('x', 'y', 'z'), (x, y, z))]
+        fits.BinTableHDU.from_columns(columns).writeto(os.path.join(tmp_path, 'table.fits'))
+        grid = IrregularGrid('table.fits', fits_file_dir=str(tmp_path))
+        for memmap in (True, False):
+            values = grid.get_xyz(memmap=memmap)
+            for value, expected in zip(values, (x, y, z)):
+                npt.assert_array_equal(value, expected)
+                assert not value.flags.writeable
+                assert _is_memory_mapped(value) is memmap
+        FitsFile.cache.clear()
@@ -1,7 +1,9 @@
 __author__ = 'aymgal'
 
 
+import os
 import pytest
+import numpy as np
 from unittest import TestCase
 
 from coolest.template.lazy import *
@@ -23,3 +25,47 @@ class TestMissingFile(TestCase):
         with self.assertRaises(RuntimeError):
             galaxy.light_model[0].parameters['pixels'].set_grid('inexisting_table.fits',
                                                                 check_fits_file=True)
+
+
+class TestHeaderOnlyReading(object):
+
+    @staticmethod
+    def _forbid_data_reading(monkeypatch):
+        from coolest.template.classes import fits_file
+        def getdata(*args, **kwargs):
+            raise AssertionError("FITS data should not be read")
+        monkeypatch.setattr(fits_file.fits, 'getdata', getdata)
+
+    def test_regular_grid(self, tmp_path, monkeypatch):
+        from astropy.io import fits
+        array = np.arange(20.).reshape(4, 5)
+        fits.writeto(os.path.join(tmp_path, 'image.fits'), array)
+        with monkeypatch.context() as m:
+            self._forbid_data_reading(m)
+            with pytest.warns(UserWarning):  # non-square image
+                grid = PixelatedRegularGrid('image.fits', fits_file_dir=str(tmp_path))
+        assert grid.shape == (4, 5)
+        np.testing.assert_array_equal(grid.get_pixels(), array)
+
+    @pytest.mark.parametrize("with_header_ranges", [False, True])
+    def test_irregular_grid(self, tmp_path, monkeypatch, with_header_ranges):
+        from astropy.io import fits
+        x, y, z = np.random.default_rng(0).normal(size=(3, 50))
+        table = fits.BinTableHDU.from_columns([fits.Column(name=name, format='D', array=values)
+                                               for name, values in zip('xyz', (x, y, z))])
+        if with_header_ranges:
+            # ranges given in the header are used without reading the table
+            for i, values in enumerate((x, y), start=1):
+                table.header[f'TDMIN{i}'] = -10. * i
+                table.header[f'TDMAX{i}'] = 10. * i
+        table.writeto(os.path.join(tmp_path, 'table.fits'))
+        with monkeypatch.context() as m:
+            self._forbid_data_reading(m)
+            grid = IrregularGrid('table.fits', fits_file_dir=str(tmp_path))
+        assert grid.num_pix == 50
+        if with_header_ranges:
+            assert grid.field_of_view_x == (-10., 10.) and grid.field_of_view_y == (-20., 20.)
+        else:
+            assert grid.field_of_view_x == (x.min(), x.max())
+            assert grid.field_of_view_y == (y.min(), y.max())
+        np.testing.assert_array_equal(grid.get_xyz()[2], z)
@@ -2,13 +2,55 @@ __author__ = 'aymgal'
 
 
 import os
+import json
+import importlib
 import pytest
+import jsonpickle
 
 from coolest.template.lazy import *
 from coolest.template.standard import COOLEST
 from coolest.template.json import JSONSerializer
 
 
+def _decode_jsonpickle(path):
+    """Decodes a jsonpickle template as plain JSON, where references to objects
+    (whose numbering depends on the order of the attributes) are normalized,
+    and checks that every parameter is encoded with all its attributes"""
+    from coolest.template.classes.parameter import Parameter
+
+    def normalize(obj):
+        if isinstance(obj, list):
+            return [normalize(value) for value in obj]
+        if not isinstance(obj, dict):
+            return obj
+        assert 'py/state' not in obj
+        if 'py/id' in obj:
+            return {'py/id': None}
+        if 'py/object' in obj:
+            module_name, class_name = obj['py/object'].rsplit('.', 1)
+            if issubclass(getattr(importlib.import_module(module_name), class_name), Parameter):
+                assert {'point_estimate', 'posterior_stats', 'prior'} <= set(obj)
+                assert '_lazy_settings' not in obj
+        return {key: normalize(value) for key, value in obj.items()}
+
+    with open(path, 'r') as f:
+        return normalize(json.loads(f.read()))
+
+
+def _assert_stable_jsonpickle(template_path, obj):
+    """Dumps `obj` with jsonpickle, and checks that decoding and dumping it again 
+    gives the same template; attributes missing from the first dump would be 
+    added by the second one"""
+    JSONSerializer(template_path, obj=obj).dump_jsonpickle()
+    content = _decode_jsonpickle(template_path + '_pyAPI.json')
+    with open(template_path + '_pyAPI.json', 'r') as f:
+        obj_decoded = jsonpickle.decode(f.read())
+    JSONSerializer(template_path + '_decoded', obj=obj_decoded).dump_jsonpickle()
+    assert _decode_jsonpickle(template_path + '_decoded_pyAPI.json') == content
+    os.remove(template_path + '_decoded_pyAPI.json')
+    return content
+
+
 class TestJSONSerialization(object):
 
     def setup_method(self):
@@ -108,6 +150,7 @@ class TestJSONSerialization(object):
                                     check_external_files=self.check_files)
         serializer.dump_jsonpickle()
         serializer.dump_simple()
+        _assert_stable_jsonpickle(template_path, coolest)
         coolest_2 = serializer.load()
         assert isinstance(coolest_2, COOLEST)
 
@@ -124,3 +167,57 @@ class TestJSONSerialization(object):
         json_new  = serializer_2.load_simple(json_path, as_object=False)
 
         assert json_orig == json_new
+
+        # test that priors and posterior statistics are only instantiated when accessed
+        gamma = coolest_3.lensing_entities[1].mass_model[0].parameters['gamma']
+        assert 'prior' not in gamma.__dict__
+        assert gamma.prior.type == 'GaussianPrior' and gamma.prior.mean == 2.0
+        assert 'prior' in gamma.__dict__
+        theta_eff = coolest_3.lensing_entities[2].light_model[0].parameters['theta_eff']
+        assert theta_eff.posterior_stats.median == 0.15
+        assert theta_eff.prior.type is None
+
+        # and that they are serialized when dumping again the template
+        serializer_3 = JSONSerializer(template_path + '_2', obj=coolest_3,
+                                      check_external_files=self.check_files)
+        serializer_3.dump_simple()
+        theta_e = coolest_3.lensing_entities[1].mass_model[0].parameters['theta_E']
+        assert 'prior' not in theta_e.__dict__ and '_lazy_settings' in theta_e.__dict__
+        assert serializer_3.load_simple(template_path + '_2.json', as_object=False) == json_orig
+        os.remove(template_path + '_2.json')
+        coolest_4 = serializer_2.load(skip_jsonpickle=True)
+        theta_eff = coolest_4.lensing_entities[2].light_model[0].parameters['theta_eff']
+        assert 'posterior_stats' not in theta_eff.__dict__
+        _assert_stable_jsonpickle(template_path + '_reloaded', coolest_4)
+        assert theta_eff.__dict__['posterior_stats'].median == 0.15
+        os.remove(template_path + '_reloaded_pyAPI.json')
+
+    def test_invalid_lazy_settings(self):
+        from coolest.template.classes.parameter import NonLinearParameter
+        parameter = NonLinearParameter("some parameter")
+        # invalid settings are reported when given, not when first accessed
+        with pytest.raises(ValueError):
+            parameter.set_lazy_settings(prior={'type': 'CauchyPrior', 'mean': 0.})
+        with pytest.raises(ValueError):
+            parameter.set_lazy_settings(prior={'type': 'GaussianPrior', 'mean': 0., 'sigma': 1.})
+        with pytest.raises(ValueError):
+            parameter.set_lazy_settings(posterior_stats={'mean': 0., 'mode': 0.})
+        with pytest.raises(ValueError):
+            parameter.set_lazy_settings(latex_str='$x$')
+        parameter.set_lazy_settings(prior={'type': 'UniformPrior', 'min_value': 0., 'max_value': 1.},
+                                    posterior_stats=None)
+        assert parameter.prior.max_value == 1.
+        assert parameter.posterior_stats.mean is None
+
+        # which includes loading a template
+        template_path = os.path.join(os.getcwd(), 'test_invalid_prior')
+        json_path = os.path.join('test', 'api', '_templates', 'pemd_sersic.json')
+        content = JSONSerializer(os.path.abspath(json_path)[:-5]).load_simple(json_path, as_object=False)
+        content['lensing_entities'][0]['mass_model'][0]['parameters']['gamma']['prior'] = {'type': 'CauchyPrior'}
+        with open(template_path + '.json', 'w') as f:
+            json.dump(content, f)
+        try:
+            with pytest.raises(ValueError):
+                JSONSerializer(template_path, check_external_files=False).load(skip_jsonpickle=True)
+        finally:
+            os.remove(template_path + '.json')